@@ -0,0 +1,42 @@
+"""
+Construye la tabla precalculada de cotizaciones y la guarda en disco
+
+Uso:
+    python -m app.cli.construir_tabla --salida assets/tabla_precalculada/tabla.npy
+
+Luego se activa en el servidor con:
+    TABLA_PRECALCULADA=1 TABLA_PRECALCULADA_RUTA=assets/tabla_precalculada/tabla.npy
+"""
+import argparse
+import json
+import time
+
+from app.services.cotizacion_service import PERIODOS_CONFIG_PATH, GRILLA_EDAD_MIN, GRILLA_EDAD_MAX
+from app.services.motor_vectorizado import SEXOS
+from app.services.tabla_precalculada import TablaPrecalculada
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye la tabla precalculada de cotizaciones")
+    parser.add_argument("--salida", required=True, help="Ruta del archivo .npy a generar")
+    parser.add_argument("--edad-min", type=int, default=GRILLA_EDAD_MIN, help="Edad actuarial mínima")
+    parser.add_argument("--edad-max", type=int, default=GRILLA_EDAD_MAX, help="Edad actuarial máxima")
+    args = parser.parse_args()
+
+    with open(PERIODOS_CONFIG_PATH, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    inicio = time.perf_counter()
+    tabla = TablaPrecalculada.construir(config, edades=range(args.edad_min, args.edad_max + 1), sexos=SEXOS)
+    tabla.guardar(args.salida)
+    duracion = time.perf_counter() - inicio
+
+    stats = tabla.obtener_estadisticas()
+    print(f"✓ Tabla guardada en {args.salida}")
+    print(f"  Combinaciones: {stats['combinaciones']}")
+    print(f"  Tamaño: {stats['bytes']} bytes")
+    print(f"  Tiempo: {duracion:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Exporta la superficie completa de cotizaciones en formato binario columnar
+
+Uso:
+    python -m app.cli.exportar_superficie --salida superficie.rcol
+    python -m app.cli.exportar_superficie --salida superficie.rcol --url http://localhost:8000
+
+Sin --url la superficie se calcula en este proceso; con --url se descarga de
+GET /api/v1/cotizaciones/grid/exportar. En ambos casos el archivo se escribe
+por bloques a medida que llega. Para leerlo:
+
+    from app.services.exportacion_columnar import leer_superficie
+    columnas = leer_superficie("superficie.rcol")   # dict de arreglos NumPy
+"""
+import argparse
+import os
+import time
+
+from app.services.cotizacion_service import (
+    CotizacionService,
+    GRILLA_EDAD_MIN,
+    GRILLA_EDAD_MAX,
+    EXPORTACION_EDADES_POR_BLOQUE
+)
+from app.services.exportacion_columnar import leer_encabezado, iterar_bloques
+
+
+def exportar_local(salida: str, edad_min: int, edad_max: int, edades_por_bloque: int) -> None:
+    _, bloques = CotizacionService().exportar_superficie(
+        edad_min=edad_min, edad_max=edad_max, edades_por_bloque=edades_por_bloque
+    )
+    with open(salida, "wb") as archivo:
+        for bloque in bloques:
+            archivo.write(bloque)
+
+
+def exportar_remoto(salida: str, url: str, edad_min: int, edad_max: int) -> None:
+    import httpx
+
+    with httpx.stream(
+        "GET",
+        f"{url.rstrip('/')}/api/v1/cotizaciones/grid/exportar",
+        params={"edad_min": edad_min, "edad_max": edad_max},
+        timeout=None
+    ) as respuesta:
+        respuesta.raise_for_status()
+        with open(salida, "wb") as archivo:
+            for bloque in respuesta.iter_bytes():
+                archivo.write(bloque)
+
+
+def contar_filas(ruta: str) -> int:
+    """Recorre el archivo bloque por bloque (también valida que esté completo)"""
+    with open(ruta, "rb") as archivo:
+        encabezado = leer_encabezado(archivo)
+        return sum(len(bloque["prima"]) for bloque in iterar_bloques(archivo, encabezado))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta la superficie de cotizaciones en formato binario columnar")
+    parser.add_argument("--salida", required=True, help="Archivo a generar (.rcol)")
+    parser.add_argument("--url", help="URL base de la API; sin ella se calcula en este proceso")
+    parser.add_argument("--edad-min", type=int, default=GRILLA_EDAD_MIN, help="Edad actuarial mínima")
+    parser.add_argument("--edad-max", type=int, default=GRILLA_EDAD_MAX, help="Edad actuarial máxima")
+    parser.add_argument(
+        "--edades-por-bloque", type=int, default=EXPORTACION_EDADES_POR_BLOQUE,
+        help="Edades por bloque (solo sin --url)"
+    )
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    if args.url:
+        exportar_remoto(args.salida, args.url, args.edad_min, args.edad_max)
+    else:
+        exportar_local(args.salida, args.edad_min, args.edad_max, args.edades_por_bloque)
+    duracion = time.perf_counter() - inicio
+
+    filas = contar_filas(args.salida)
+    tamano = os.path.getsize(args.salida)
+    print(f"✓ Superficie exportada en {args.salida}")
+    print(f"  Cotizaciones: {filas}")
+    print(f"  Tamaño: {tamano} bytes ({tamano / filas if filas else 0:.1f} bytes por cotización)")
+    print(f"  Tiempo: {duracion:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Informe del tiempo de arranque en frío de la API
+
+Uso:
+    python -m app.cli.informe_arranque [--top 15] [--puerto 8765] [--sin-servidor]
+
+1. Importa app.main en un proceso nuevo con `python -X importtime` y muestra
+   el tiempo de importación total, el de cada módulo de app y los paquetes
+   externos más costosos.
+2. Levanta uvicorn en otro proceso nuevo y mide cuánto tarda en responder
+   /health (primera respuesta sana) y /ready (pool de renderizado y
+   precalentamiento listos).
+
+Las variables de entorno se pasan tal cual a ambos procesos (IMAGE_RENDERER,
+RENDER_WORKERS, PRECALENTAMIENTO, ...), así se pueden comparar configuraciones.
+"""
+import argparse
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+
+def medir_importaciones(modulo: str = "app.main") -> List[Tuple[str, int, int]]:
+    """Lista (módulo, µs propios, µs acumulados) de importar el módulo en un proceso nuevo"""
+    resultado = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    modulos = []
+    for linea in resultado.stderr.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        propio, acumulado, nombre = linea[len("import time:"):].split("|")
+        modulos.append((nombre.strip(), int(propio), int(acumulado)))
+    return modulos
+
+
+def _esperar(url: str, limite: float, proceso: subprocess.Popen) -> Optional[float]:
+    """Segundos hasta que url responde 200 (None si se agota el tiempo o el proceso termina)"""
+    inicio = time.monotonic()
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            return None
+        try:
+            with urllib.request.urlopen(url, timeout=1) as respuesta:
+                if respuesta.status == 200:
+                    return time.monotonic() - inicio
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def medir_servidor(puerto: int, espera_max: float) -> Dict[str, Optional[float]]:
+    """Segundos desde que se lanza uvicorn hasta la primera respuesta de /health y de /ready"""
+    inicio = time.monotonic()
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(puerto)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        limite = inicio + espera_max
+        base = f"http://127.0.0.1:{puerto}"
+        health = _esperar(f"{base}/health", limite, proceso)
+        health = None if health is None else time.monotonic() - inicio
+        ready = _esperar(f"{base}/ready", limite, proceso) if health is not None else None
+        ready = None if ready is None else time.monotonic() - inicio
+        return {"health": health, "ready": ready}
+    finally:
+        proceso.terminate()
+        try:
+            proceso.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+
+
+def _ms(microsegundos: int) -> str:
+    return f"{microsegundos / 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el arranque en frío de la API (importaciones y primera respuesta)")
+    parser.add_argument("--top", type=int, default=15, help="Paquetes externos a mostrar")
+    parser.add_argument("--puerto", type=int, default=8765, help="Puerto para el servidor de prueba")
+    parser.add_argument("--espera-max", type=float, default=120.0, help="Segundos máximos de espera por /ready")
+    parser.add_argument("--sin-servidor", action="store_true", help="Solo medir las importaciones")
+    args = parser.parse_args()
+
+    modulos = medir_importaciones()
+    total = next((acumulado for nombre, _, acumulado in modulos if nombre == "app.main"), 0)
+    print(f"Importación de app.main: {_ms(total)}")
+
+    print("\nMódulos de app (acumulado, incluye lo que importan):")
+    for nombre, _, acumulado in sorted((m for m in modulos if m[0].startswith("app.")), key=lambda m: -m[2]):
+        print(f"  {_ms(acumulado)}  {nombre}")
+
+    # Tiempo propio sumado por paquete raíz: cuánto cuesta cada dependencia
+    por_paquete = defaultdict(int)
+    for nombre, propio, _ in modulos:
+        if not nombre.startswith("app"):
+            por_paquete[nombre.split(".")[0]] += propio
+    print(f"\nPaquetes externos (tiempo propio, top {args.top}):")
+    for paquete, propio in sorted(por_paquete.items(), key=lambda p: -p[1])[:args.top]:
+        print(f"  {_ms(propio)}  {paquete}")
+    pesados = [p for p in ("matplotlib", "PIL", "httpx") if p in por_paquete]
+    if pesados:
+        print(f"  (se importan al arrancar: {', '.join(pesados)})")
+
+    if args.sin_servidor:
+        return
+
+    tiempos = medir_servidor(args.puerto, args.espera_max)
+    print("\nServidor (desde que se lanza uvicorn):")
+    for endpoint in ("health", "ready"):
+        valor = tiempos[endpoint]
+        print(f"  /{endpoint:<7} {'sin respuesta' if valor is None else f'{valor:.2f} s'}")
+
+
+if __name__ == "__main__":
+    main()
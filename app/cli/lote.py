@@ -0,0 +1,328 @@
+"""
+Genera cotizaciones e imágenes en lote, fuera de la API, en varios procesos
+
+Uso:
+    python -m app.cli.lote campana.csv --salida salida/campana [--workers 8]
+    python -m app.cli.lote campana.jsonl --salida salida/campana --renderizador rapido --formato webp
+
+Cada fila de la entrada (CSV con encabezado o JSONL) tiene edad_actuarial,
+sexo y prima, y opcionalmente producto (por defecto RUMBO), periodo_pago e id:
+    - con periodo_pago se calcula la cotización individual
+    - sin periodo_pago se calcula la colección de todos los periodos y su gráfico
+En JSONL también se aceptan objetos con el formato de la API ({"producto", "parametros"}).
+
+Salida:
+    <salida>/resultados.jsonl   una línea por fila: {"clave", "linea", "cotizacion", "imagen", ...}
+                                o {"clave", "linea", "error"}
+    <salida>/imagenes/          <clave>.<extensión> (y <clave>_min.<extensión> con --miniatura)
+    <salida>/almacen/           imágenes por huella de contenido (las de imagenes/ son hard links)
+
+La clave de cada fila es su id o, si no tiene, sus parámetros. Al volver a
+ejecutar sobre la misma salida se omiten las filas que ya terminaron bien (y
+cuya imagen sigue en disco); las que fallaron se reintentan.
+
+Los IDs de las cotizaciones se reservan en la secuencia del almacén SQLite
+(ALMACEN_COTIZACIONES_RUTA), la misma que usa la API con
+ALMACEN_COTIZACIONES=sqlite: no se repiten entre corridas ni con la API.
+Las imágenes se generan en la salida, sin pasar por db/graficos de la API.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from app.schemas.cotizacion import (
+    CotizacionColeccionRequest,
+    CotizacionCreate,
+    OpcionesImagen
+)
+from app.services.image_service import EXTENSIONES, RENDERIZADORES
+
+
+ARCHIVO_RESULTADOS = "resultados.jsonl"
+DIRECTORIO_IMAGENES = "imagenes"
+DIRECTORIO_ALMACEN = "almacen"
+
+# Fila de la entrada: (número de línea, clave, datos)
+Fila = Tuple[int, str, Dict]
+
+
+def leer_filas(ruta: str) -> Iterator[Fila]:
+    """Lee las filas del CSV o JSONL de a una (la entrada no se carga entera)"""
+    with open(ruta, "r", encoding="utf-8", newline="") as f:
+        if ruta.lower().endswith(".csv"):
+            # Línea 1 es el encabezado; las celdas vacías cuentan como ausentes
+            for numero, fila in enumerate(csv.DictReader(f), start=2):
+                fila = {campo: valor.strip() for campo, valor in fila.items() if campo and valor and valor.strip()}
+                yield numero, clave_fila(fila), fila
+        else:
+            for numero, linea in enumerate(f, start=1):
+                if not linea.strip():
+                    continue
+                try:
+                    fila = json.loads(linea)
+                except json.JSONDecodeError as e:
+                    fila = {"_error": f"JSON inválido: {e}"}
+                if not isinstance(fila, dict):
+                    fila = {"_error": "Cada línea debe ser un objeto JSON"}
+                yield numero, clave_fila(fila, numero), fila
+
+
+def _parametros(fila: Dict) -> Dict:
+    """Parámetros de la fila, plana o con el formato de la API"""
+    parametros = fila.get("parametros")
+    return parametros if isinstance(parametros, dict) else fila
+
+
+def clave_fila(fila: Dict, numero: int = 0) -> str:
+    """Clave estable de la fila: su id o sus parámetros (se usa para reanudar y nombrar la imagen)"""
+    if fila.get("id") not in (None, ""):
+        clave = str(fila["id"])
+    elif "_error" in fila:
+        clave = f"linea-{numero}"
+    else:
+        parametros = _parametros(fila)
+        partes = [
+            fila.get("producto", "RUMBO"),
+            parametros.get("edad_actuarial"),
+            parametros.get("sexo"),
+            parametros.get("prima"),
+        ]
+        if parametros.get("periodo_pago") not in (None, ""):
+            partes.append(f"p{parametros['periodo_pago']}")
+        clave = "-".join(str(parte) for parte in partes)
+    return re.sub(r"[^\w.-]", "_", clave)
+
+
+def leer_completadas(ruta_resultados: str, directorio_imagenes: str) -> Set[str]:
+    """
+    Claves ya resueltas en una corrida anterior
+
+    Cuenta la última línea de cada clave: si terminó en error se reintenta,
+    y si su imagen ya no está en disco también. Una última línea cortada (la
+    corrida anterior se interrumpió a mitad de escritura) se ignora.
+    """
+    completadas: Set[str] = set()
+    if not os.path.exists(ruta_resultados):
+        return completadas
+    with open(ruta_resultados, "r", encoding="utf-8") as f:
+        for linea in f:
+            try:
+                resultado = json.loads(linea)
+            except json.JSONDecodeError:
+                continue
+            clave = resultado.get("clave")
+            imagen = resultado.get("imagen")
+            if "error" in resultado or (imagen and not os.path.exists(os.path.join(directorio_imagenes, imagen))):
+                completadas.discard(clave)
+            else:
+                completadas.add(clave)
+    return completadas
+
+
+# Estado propio de cada proceso worker
+_cotizacion_service = None
+_image_service = None
+_directorio_imagenes = None
+
+
+def _inicializar_worker(directorio_imagenes: str, directorio_almacen: str) -> None:
+    """Crea los servicios una sola vez por proceso, con el almacén de imágenes en la salida"""
+    global _cotizacion_service, _image_service, _directorio_imagenes
+    from app.services.cotizacion_service import CotizacionService
+    from app.services.image_service import ImageService
+    from app.services.almacen_imagenes import AlmacenImagenes
+    _cotizacion_service = CotizacionService()
+    _image_service = ImageService()
+    _image_service.almacen = AlmacenImagenes(directorio=directorio_almacen, directorio_publicacion=directorio_imagenes)
+    _directorio_imagenes = directorio_imagenes
+
+
+def _procesar_fila(
+    fila: Fila,
+    id_cotizacion: int,
+    renderizador: Optional[str],
+    opciones: Optional[OpcionesImagen]
+) -> Dict:
+    """Cotiza una fila (y genera su gráfico si es una colección) dentro del worker"""
+    numero, clave, datos = fila
+    resultado = {"clave": clave, "linea": numero}
+    if "_error" in datos:
+        resultado["error"] = datos["_error"]
+        return resultado
+
+    parametros = _parametros(datos)
+    producto = datos.get("producto", "RUMBO")
+    try:
+        if parametros.get("periodo_pago") is not None:
+            cotizacion = _cotizacion_service.cotizar(
+                CotizacionCreate(producto=producto, parametros=parametros), id_cotizacion
+            )
+            resultado["cotizacion"] = cotizacion.model_dump(mode="json")
+            return resultado
+
+        request = CotizacionColeccionRequest(producto=producto, parametros=parametros)
+        coleccion, data = _cotizacion_service.coleccion_con_datos_grafico(request)
+        resultado["cotizacion"] = coleccion.model_dump(mode="json", exclude={"imagen_base64", "miniatura_url"})
+        if opciones is None or data is None:
+            return resultado
+
+        imagen = _image_service.generar_imagen(data, renderizador=renderizador, opciones=opciones)
+        nombre = f"{clave}.{EXTENSIONES[imagen.formato]}"
+        _image_service.almacen.publicar(imagen.ruta, os.path.join(_directorio_imagenes, nombre))
+        resultado.update(
+            imagen=nombre,
+            bytes=imagen.bytes,
+            tiempo_render_ms=imagen.tiempo_render_ms,
+            reutilizada=imagen.reutilizada
+        )
+        if imagen.miniatura is not None:
+            miniatura = f"{clave}_min{os.path.splitext(imagen.miniatura.ruta)[1]}"
+            _image_service.almacen.publicar(imagen.miniatura.ruta, os.path.join(_directorio_imagenes, miniatura))
+            resultado["miniatura"] = miniatura
+    except ValidationError as e:
+        resultado["error"] = "Fila inválida"
+        resultado["detalle"] = e.errors(include_url=False, include_input=False)
+    except Exception as e:
+        resultado["error"] = f"No se pudo procesar la fila: {e}"
+    return resultado
+
+
+def _procesar_tarea(
+    filas: List[Fila],
+    primer_id: int,
+    renderizador: Optional[str],
+    opciones: Optional[OpcionesImagen]
+) -> List[Dict]:
+    """Procesa varias filas por envío al pool (menos overhead de IPC por fila); IDs consecutivos desde primer_id"""
+    return [_procesar_fila(fila, primer_id + i, renderizador, opciones) for i, fila in enumerate(filas)]
+
+
+def _tareas(filas: Iterator[Fila], completadas: Set[str], tamano: int) -> Iterator[List[Fila]]:
+    """Agrupa las filas pendientes en tareas de hasta tamano filas"""
+    tarea: List[Fila] = []
+    for fila in filas:
+        if fila[1] in completadas:
+            continue
+        tarea.append(fila)
+        if len(tarea) >= tamano:
+            yield tarea
+            tarea = []
+    if tarea:
+        yield tarea
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera cotizaciones e imágenes en lote a partir de un CSV o JSONL")
+    parser.add_argument("entrada", help="Archivo .csv (con encabezado) o .jsonl con una fila por cotización")
+    parser.add_argument("--salida", required=True, help="Directorio de salida (resultados.jsonl e imagenes/)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo")
+    parser.add_argument("--tamano-tarea", type=int, default=8, help="Filas por envío a cada proceso")
+    parser.add_argument("--sin-imagenes", action="store_true", help="Solo cotizaciones, sin gráficos")
+    parser.add_argument("--renderizador", choices=RENDERIZADORES, default=None, help="Por defecto IMAGE_RENDERER")
+    parser.add_argument("--formato", choices=list(EXTENSIONES), default="jpeg")
+    parser.add_argument("--dpi", type=int, default=None, help="Resolución (por defecto 300)")
+    parser.add_argument("--ancho", type=int, default=None, help="Ancho en píxeles (tiene prioridad sobre --dpi)")
+    parser.add_argument("--calidad", type=int, default=None, help="Calidad JPEG/WebP")
+    parser.add_argument("--miniatura", action="store_true", help="Generar también la miniatura")
+    args = parser.parse_args()
+
+    opciones = None
+    if not args.sin_imagenes:
+        try:
+            opciones = OpcionesImagen(
+                formato=args.formato, dpi=args.dpi, ancho=args.ancho, calidad=args.calidad, miniatura=args.miniatura
+            )
+        except ValidationError as e:
+            parser.error(str(e))
+
+    directorio_imagenes = os.path.abspath(os.path.join(args.salida, DIRECTORIO_IMAGENES))
+    directorio_almacen = os.path.abspath(os.path.join(args.salida, DIRECTORIO_ALMACEN))
+    os.makedirs(directorio_imagenes, exist_ok=True)
+    ruta_resultados = os.path.join(args.salida, ARCHIVO_RESULTADOS)
+
+    completadas = leer_completadas(ruta_resultados, directorio_imagenes)
+    total = sum(1 for _ in leer_filas(args.entrada))
+    omitidas = sum(1 for _, clave, _ in leer_filas(args.entrada) if clave in completadas)
+    pendientes = total - omitidas
+    print(f"Filas: {total}  ya completadas: {omitidas}  pendientes: {pendientes}  workers: {args.workers}")
+
+    hechas = errores = imagenes = reutilizadas = 0
+    inicio = time.perf_counter()
+    ultimo_progreso = 0.0
+
+    # Si la corrida anterior se cortó a mitad de una línea, empezar en una nueva
+    if os.path.exists(ruta_resultados) and os.path.getsize(ruta_resultados):
+        with open(ruta_resultados, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            cortada = f.read(1) != b"\n"
+    else:
+        cortada = False
+
+    executor = ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_inicializar_worker,
+        initargs=(directorio_imagenes, directorio_almacen)
+    )
+    from app.services.almacen_cotizaciones import AlmacenSQLite
+    secuencia_ids = AlmacenSQLite()
+    try:
+        with open(ruta_resultados, "a", encoding="utf-8") as salida:
+            if cortada:
+                salida.write("\n")
+            tareas = _tareas(leer_filas(args.entrada), completadas, max(1, args.tamano_tarea))
+            en_curso = set()
+            # Se envían pocas tareas por adelantado: la memoria no depende del tamaño de la entrada
+            while True:
+                while len(en_curso) < args.workers * 2:
+                    tarea = next(tareas, None)
+                    if tarea is None:
+                        break
+                    primer_id = secuencia_ids.reservar_ids(len(tarea))
+                    en_curso.add(executor.submit(_procesar_tarea, tarea, primer_id, args.renderizador, opciones))
+                if not en_curso:
+                    break
+
+                terminadas, en_curso = wait(en_curso, return_when=FIRST_COMPLETED)
+                for futuro in terminadas:
+                    for resultado in futuro.result():
+                        salida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+                        hechas += 1
+                        if "error" in resultado:
+                            errores += 1
+                        elif "imagen" in resultado:
+                            imagenes += 1
+                            reutilizadas += resultado["reutilizada"]
+                salida.flush()
+
+                ahora = time.perf_counter()
+                if ahora - ultimo_progreso >= 0.5:
+                    ultimo_progreso = ahora
+                    print(f"\r  {hechas}/{pendientes}  errores: {errores}  {hechas / (ahora - inicio):.1f} filas/s", end="", flush=True)
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        secuencia_ids.cerrar()
+        print(f"\n✗ Interrumpido tras {hechas} filas; volver a ejecutar el mismo comando para continuar")
+        raise SystemExit(130)
+    executor.shutdown()
+    secuencia_ids.cerrar()
+
+    duracion = time.perf_counter() - inicio
+    print(f"\r  {hechas}/{pendientes}  errores: {errores}" + " " * 20)
+    print(f"✓ Resultados en {ruta_resultados}")
+    print(f"  Procesadas: {hechas} ({errores} con error), omitidas: {omitidas}")
+    if opciones is not None:
+        print(f"  Imágenes: {imagenes} ({reutilizadas} reutilizadas del almacén) en {directorio_imagenes}")
+    print(f"  Tiempo: {duracion:.2f} s  ({hechas / duracion if duracion else 0:.1f} filas/s)")
+
+
+if __name__ == "__main__":
+    main()
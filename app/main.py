@@ -1,13 +1,70 @@
 import os
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.routers import cotizaciones
+from app.services import cotizacion_service
+from app.services.ejecutor_render import ejecutor_render, RENDER_INICIO_BLOQUEANTE
+from app.services.subida_imagenes import cliente_subida
+from app.services.almacen_cotizaciones import almacen_cotizaciones
+from app.services.precalentamiento import precalentador
+from app.services import metricas
+from app.services.arranque import informe_arranque
+from app.services.limpieza_imagenes import limpiador_imagenes, LIMPIEZA_IMAGENES
+from app.services.bitacora import bitacora
+from app.services.perfilado import PerfiladoMiddleware, PERFILADO
+
+
+def _pool_render_iniciado(tarea) -> None:
+    if tarea.cancelled():
+        return
+    if tarea.exception() is not None:
+        bitacora.error("pool_render_error", "No se pudo precalentar el pool de renderizado", excepcion=tarea.exception())
+        return
+    informe_arranque.marcar("pool_render_listo")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Tareas de arranque y apagado de la aplicación"""
+    # Tabla precalculada de cotizaciones (opcional)
+    if cotizacion_service.TABLA_PRECALCULADA_HABILITADA:
+        cotizacion_service.cargar_tabla_precalculada()
+    
+    # Pool de procesos para generar imágenes (renderizador ya cargado en cada worker).
+    # Por defecto se precalienta en segundo plano para no demorar el arranque en frío
+    if RENDER_INICIO_BLOQUEANTE:
+        await ejecutor_render.iniciar()
+        informe_arranque.marcar("pool_render_listo")
+    else:
+        ejecutor_render.iniciar_en_segundo_plano().add_done_callback(_pool_render_iniciado)
+    
+    # Limpieza de db/ por TTL y cuota de bytes en segundo plano (un solo worker por máquina, por flock)
+    if LIMPIEZA_IMAGENES:
+        limpiador_imagenes.iniciar()
+    
+    # Precalentamiento de imágenes en segundo plano (opcional); /ready informa el avance
+    precalentador.iniciar()
+    
+    informe_arranque.marcar("lifespan_listo")
+    yield
+    
+    await precalentador.detener()
+    ejecutor_render.detener()
+    limpiador_imagenes.detener()
+    await cliente_subida.cerrar()
+    almacen_cotizaciones.cerrar()
+    bitacora.cerrar()
+
 
 app = FastAPI(
     title="RumbIA Cotizador API",
     description="API para el sistema de cotizaciones RumbIA",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS
@@ -19,11 +76,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+class MetricasMiddleware:
+    """
+    Duración, código de estado y requests en curso de cada request HTTP
+
+    Middleware ASGI puro (no BaseHTTPMiddleware) para no envolver las
+    respuestas en streaming. La ruta se etiqueta con la plantilla de la ruta
+    que atendió el request, no con la URL, para acotar las series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metodo = scope["method"]
+        codigo = 500
+
+        async def enviar(mensaje):
+            nonlocal codigo
+            if mensaje["type"] == "http.response.start":
+                codigo = mensaje["status"]
+            await send(mensaje)
+
+        metricas.requests_en_curso.sumar(1, metodo)
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            metricas.requests_en_curso.sumar(-1, metodo)
+            ruta = getattr(scope.get("route"), "path", "sin_ruta")
+            metricas.duracion_request.observar(time.perf_counter() - inicio, ruta, metodo)
+            metricas.requests_total.incrementar(ruta, metodo, str(codigo))
+
+
+app.add_middleware(MetricasMiddleware)
+
+# Perfilado a pedido (X-Perfilar / ?perfilar=) o por muestreo; sin PERFILADO=1 no se instala
+if PERFILADO:
+    app.add_middleware(PerfiladoMiddleware)
+
 # Crear directorio para imágenes si no existe
 os.makedirs("db", exist_ok=True)
 
+
+class ImagenesEstaticas(StaticFiles):
+    """Archivos de db/; cada imagen servida cuenta como uso para la limpieza (LRU)"""
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            limpiador_imagenes.tocar(os.path.join(self.directory, path))
+        return response
+
+
 # Servir archivos estáticos (imágenes)
-app.mount("/images", StaticFiles(directory="db"), name="images")
+app.mount("/images", ImagenesEstaticas(directory="db"), name="images")
 
 # Incluir routers
 app.include_router(cotizaciones.router, prefix="/api/v1", tags=["cotizaciones"])
@@ -40,5 +152,34 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    informe_arranque.primera_respuesta()
     return {"status": "healthy"}
 
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas de este proceso en formato de texto de Prometheus"""
+    return PlainTextResponse(metricas.registro.exponer(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Listo cuando el pool de renderizado está iniciado; mientras tanto 503.
+    El precalentamiento no retiene el tráfico: solo se informa su avance.
+    """
+    precalentamiento = precalentador.obtener_estadisticas()
+    listo = ejecutor_render.listo
+    return JSONResponse(
+        status_code=200 if listo else 503,
+        content={
+            "status": "ready" if listo else "warming",
+            "precalentamiento": precalentamiento,
+            "render_listo": ejecutor_render.listo,
+            "render_roto": ejecutor_render.roto,
+            "arranque": informe_arranque.obtener_estadisticas()
+        }
+    )
+
+
+informe_arranque.marcar("app_importada")
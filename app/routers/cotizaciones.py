@@ -1,38 +1,174 @@
-from fastapi import APIRouter, status
-from typing import Dict
+import anyio
+import asyncio
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import Dict, Optional
 from app.schemas.cotizacion import (
     CotizacionCreate, 
     CotizacionResponse,
     CotizacionColeccionRequest,
     CotizacionColeccionResponse,
+    CotizacionGridResponse,
     ImageGenerationRequest,
-    ImageGenerationResponse
+    ImageGenerationResponse,
+    MiniaturaInfo
 )
 import os
-from app.services.image_service import ImageService
+from app.services.ejecutor_render import ejecutor_render, RenderSaturadoError, RenderTimeoutError, RenderCaidoError
+from app.services.subida_imagenes import cliente_subida
+from app.services.almacen_cotizaciones import almacen_cotizaciones, AlmacenSaturadoError
+from app.services.limpieza_imagenes import limpiador_imagenes
+from app.services.bitacora import bitacora
+from app.services.perfilado import perfilador, PERFILADO
+from app.services.exportacion_columnar import TIPO_MEDIO as TIPO_MEDIO_COLUMNAR
 
 # Importar el servicio de cotizaciones (sin dependencias de Excel/LibreOffice)
-from app.services.cotizacion_service import CotizacionService
+from app.services.cotizacion_service import CotizacionService, GRILLA_EDAD_MIN, GRILLA_EDAD_MAX
 
 router = APIRouter()
 service = CotizacionService()
-image_service = ImageService()
+
+
+class _StreamingDuplex(StreamingResponse):
+    """
+    StreamingResponse que se envía mientras todavía se lee el cuerpo del request
+    
+    La versión base escucha http.disconnect en paralelo y se queda con los
+    mensajes del cuerpo que necesita request.stream(); aquí la desconexión la
+    detecta la propia lectura del cuerpo (ClientDisconnect).
+    """
+    
+    async def listen_for_disconnect(self, receive) -> None:
+        await anyio.sleep_forever()
 
 
 @router.post("/cotizaciones", response_model=CotizacionResponse, status_code=status.HTTP_201_CREATED)
 async def crear_cotizacion(cotizacion: CotizacionCreate):
     """Crear una nueva cotización"""
-    return service.crear(cotizacion)
+    # Con SQLite la reserva de IDs puede esperar a otro escritor: fuera del event loop
+    try:
+        return await asyncio.to_thread(service.crear, cotizacion)
+    except AlmacenSaturadoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"}
+        )
+
+
+@router.post(
+    "/cotizaciones/lote",
+    status_code=status.HTTP_200_OK,
+    response_class=_StreamingDuplex,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/x-ndjson": {"schema": CotizacionCreate.model_json_schema()}}
+        }
+    }
+)
+async def crear_cotizaciones_lote(request: Request):
+    """
+    Crear cotizaciones en bloque a partir de un stream NDJSON
+    
+    Cada línea del cuerpo es un CotizacionCreate. La respuesta es NDJSON con una
+    línea por línea de entrada, en el mismo orden: el CotizacionResponse creado o
+    {"linea": n, "error": ..., "detalle": [...]} si esa línea no se pudo cotizar.
+    Las respuestas se envían a medida que se calcula cada bloque.
+    """
+    return _StreamingDuplex(
+        service.crear_lote_ndjson(request.stream()),
+        media_type="application/x-ndjson"
+    )
+
+
+def _etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match con comparación débil (RFC 9110): se ignora el prefijo W/"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidato.strip().removeprefix("W/") == etag for candidato in if_none_match.split(","))
 
 
 @router.post("/cotizaciones/coleccion", response_model=CotizacionColeccionResponse, status_code=status.HTTP_200_OK)
-async def crear_cotizacion_coleccion(request: CotizacionColeccionRequest):
+async def crear_cotizacion_coleccion(request: CotizacionColeccionRequest, http_request: Request):
     """
     Crear cotizaciones para todos los periodos disponibles de una prima específica
     
     Genera múltiples cotizaciones basadas en los periodos configurados para la prima solicitada.
+    La imagen se genera en el pool de renderizado sin bloquear el servidor.
+    
+    La respuesta lleva un ETag; si el request manda ese ETag en If-None-Match
+    se responde 304 sin cuerpo. El JSON se responde tal como quedó codificado
+    en el cache (el response_model se mantiene para la documentación).
     """
-    return service.crear_cotizacion_coleccion(request)
+    coleccion = await service.crear_cotizacion_coleccion_serializada_async(request)
+    headers = {"ETag": coleccion.etag}
+    if _etag_coincide(http_request.headers.get("if-none-match"), coleccion.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=coleccion.cuerpo, media_type="application/json", headers=headers)
+
+
+@router.get("/cotizaciones/grid", response_model=CotizacionGridResponse, status_code=status.HTTP_200_OK)
+async def obtener_grilla_cotizaciones(
+    edad_min: int = Query(GRILLA_EDAD_MIN, ge=0, description="Edad actuarial mínima"),
+    edad_max: int = Query(GRILLA_EDAD_MAX, ge=0, le=120, description="Edad actuarial máxima")
+):
+    """
+    Obtiene la superficie completa de cotizaciones
+    
+    Cotiza todas las combinaciones edad × sexo × prima × periodo permitidas por
+    la configuración de periodos en una sola pasada vectorizada. La respuesta es
+    columnar: la posición i de cada lista corresponde a la misma combinación.
+    Se responde directamente con JSONResponse para no validar cada elemento
+    contra el modelo (el response_model se mantiene para la documentación).
+    El cálculo y la serialización corren en un hilo para no bloquear el event loop.
+    """
+    if edad_min > edad_max:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="edad_min no puede ser mayor que edad_max"
+        )
+    return await asyncio.to_thread(_responder_grilla, edad_min, edad_max)
+
+
+def _responder_grilla(edad_min: int, edad_max: int) -> JSONResponse:
+    """Calcula la grilla y la serializa (JSONResponse renderiza el cuerpo al construirse)"""
+    return JSONResponse(content=service.generar_grilla(edad_min=edad_min, edad_max=edad_max))
+
+
+@router.get(
+    "/cotizaciones/grid/exportar",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={200: {"content": {TIPO_MEDIO_COLUMNAR: {}}, "description": "Archivo binario columnar"}}
+)
+async def exportar_grilla_cotizaciones(
+    edad_min: int = Query(GRILLA_EDAD_MIN, ge=0, description="Edad actuarial mínima"),
+    edad_max: int = Query(GRILLA_EDAD_MAX, ge=0, le=120, description="Edad actuarial máxima")
+):
+    """
+    Exporta la superficie completa de cotizaciones en formato binario columnar
+    
+    Mismas combinaciones que /cotizaciones/grid, con columnas numéricas tipadas
+    y tabla_devolucion como arreglo de ancho fijo (ver app/services/exportacion_columnar.py).
+    El archivo se calcula y se envía por bloques de edades; se lee con
+    leer_superficie o con python -m app.cli.exportar_superficie.
+    """
+    if edad_min > edad_max:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="edad_min no puede ser mayor que edad_max"
+        )
+    exportador, bloques = service.exportar_superficie(edad_min=edad_min, edad_max=edad_max)
+    # El generador es síncrono: Starlette calcula cada bloque en el threadpool
+    return StreamingResponse(
+        bloques,
+        media_type=TIPO_MEDIO_COLUMNAR,
+        headers={
+            "Content-Disposition": f'attachment; filename="superficie_{edad_min}_{edad_max}.rcol"',
+            "X-Total-Filas": str(exportador.total_filas),
+        }
+    )
 
 
 @router.post("/cotizaciones/generar-imagen", response_model=ImageGenerationResponse, status_code=status.HTTP_201_CREATED)
@@ -41,23 +177,62 @@ async def generar_imagen_cotizacion(request: ImageGenerationRequest):
     Genera una imagen con gráfico y tabla de cotizaciones
     
     Crea un gráfico mostrando la evolución de devolución por periodo y una tabla resumen.
-    La imagen se guarda en formato JPEG en la carpeta 'db'.
-    """
-    # Generar la imagen
-    ruta_archivo, _ = image_service.generar_grafico_desde_endpoint(
-        prima=request.parametros.prima,
-        edad_actuarial=request.parametros.edad_actuarial,
-        sexo=request.parametros.sexo,
-        retornar_base64=False
+    La imagen se guarda en la carpeta 'db/graficos' con el hash de su contenido (JPEG a
+    300 dpi por defecto; formato, dpi/ancho y calidad se eligen en "imagen") junto con
+    una miniatura; si se pide un nombre_archivo también se publica como 'db/<nombre>.<ext>'.
+    Un gráfico con los mismos datos y opciones no se vuelve a renderizar.
+    La respuesta informa el tamaño en bytes y píxeles y el tiempo de renderizado.
+    """
+    coleccion_request = CotizacionColeccionRequest(
+        producto=request.producto,
+        parametros=request.parametros,
+        renderizador=request.renderizador
     )
+    data = service.datos_grafico_coleccion(coleccion_request)
+    if data is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No hay periodos configurados para la prima {request.parametros.prima}"
+        )
+    
+    # Generar la imagen en el pool de renderizado (o reutilizarla del almacén)
+    try:
+        imagen = await ejecutor_render.renderizar(
+            data=data,
+            nombre_archivo=request.nombre_archivo,
+            renderizador=request.renderizador,
+            opciones=request.imagen
+        )
+    except (RenderSaturadoError, RenderCaidoError) as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except RenderTimeoutError as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
     
     # Obtener nombre del archivo
-    nombre_archivo = os.path.basename(ruta_archivo)
+    nombre_archivo = os.path.basename(imagen.ruta)
+    
+    miniatura = None
+    if imagen.miniatura is not None:
+        miniatura = MiniaturaInfo(
+            ruta_archivo=imagen.miniatura.ruta,
+            nombre_archivo=os.path.basename(imagen.miniatura.ruta),
+            formato=imagen.miniatura.formato,
+            ancho=imagen.miniatura.ancho,
+            alto=imagen.miniatura.alto,
+            bytes=imagen.miniatura.bytes
+        )
     
     return ImageGenerationResponse(
-        ruta_archivo=ruta_archivo,
+        ruta_archivo=imagen.ruta,
         nombre_archivo=nombre_archivo,
-        mensaje=f"Imagen generada exitosamente: {nombre_archivo}"
+        mensaje=f"Imagen generada exitosamente: {nombre_archivo}",
+        formato=imagen.formato,
+        ancho=imagen.ancho,
+        alto=imagen.alto,
+        bytes=imagen.bytes,
+        tiempo_render_ms=imagen.tiempo_render_ms,
+        reutilizada=imagen.reutilizada,
+        miniatura=miniatura
     )
 
 
@@ -80,11 +255,32 @@ async def obtener_estadisticas_cache() -> Dict:
     """
     Obtiene estadísticas del cache
     
-    Muestra cuántos elementos hay en cache actualmente.
+    Muestra cuántos elementos hay en cache, los bytes estimados que ocupan,
+    aciertos, fallos, expulsiones, expiraciones y la latencia de consulta.
     """
     stats = service.obtener_estadisticas_cache()
+    stats["render"] = ejecutor_render.obtener_estadisticas()
+    stats["subida"] = cliente_subida.obtener_estadisticas()
+    stats["almacen_cotizaciones"] = almacen_cotizaciones.obtener_estadisticas()
+    stats["limpieza_imagenes"] = limpiador_imagenes.obtener_estadisticas()
+    stats["bitacora"] = bitacora.obtener_estadisticas()
+    stats["perfilado"] = perfilador.obtener_estadisticas() if PERFILADO else None
     return {
         "estadisticas": stats,
         "mensaje": "Estadísticas obtenidas exitosamente"
     }
 
+
+
+@router.get("/cotizaciones/configuracion", status_code=status.HTTP_200_OK)
+async def obtener_version_configuracion() -> Dict:
+    """
+    Obtiene la versión de la configuración de periodos activa
+    
+    La configuración se recarga sola cuando cambia periodos_cotizacion.json;
+    la versión es una huella de su contenido.
+    """
+    return {
+        "configuracion": service.obtener_version_config(),
+        "mensaje": "Configuración obtenida exitosamente"
+    }
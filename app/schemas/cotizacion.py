@@ -3,6 +3,20 @@ from typing import Optional, Literal, List
 from datetime import datetime
 
 
+# Renderizadores y formatos de imagen disponibles (ver app.services.image_service)
+Renderizador = Literal["matplotlib", "plantilla", "rapido"]
+FormatoImagen = Literal["jpeg", "png", "webp", "svg"]
+
+
+class OpcionesImagen(BaseModel):
+    """Opciones de salida de la imagen de cotización"""
+    formato: FormatoImagen = Field("jpeg", description="Formato de la imagen (svg no disponible con el renderizador rapido, que usa plantilla)")
+    dpi: Optional[int] = Field(None, ge=20, le=600, description="Resolución (por defecto 300)")
+    ancho: Optional[int] = Field(None, ge=200, le=6000, description="Ancho en píxeles; si se indica tiene prioridad sobre dpi")
+    calidad: Optional[int] = Field(None, ge=1, le=100, description="Calidad de compresión para JPEG y WebP")
+    miniatura: bool = Field(True, description="Generar también una miniatura pequeña")
+
+
 class ParametrosCotizacion(BaseModel):
     """Modelo para los parámetros de la cotización"""
     edad_actuarial: int = Field(..., ge=0, description="Edad actuarial del cliente")
@@ -49,6 +63,8 @@ class CotizacionColeccionRequest(BaseModel):
     """Request para cotizaciones por colección"""
     producto: str = Field(..., min_length=1, description="Nombre del producto")
     parametros: ParametrosCotizacionSinPeriodo = Field(..., description="Parámetros de la cotización")
+    renderizador: Optional[Renderizador] = Field(None, description="Renderizador de la imagen (por defecto IMAGE_RENDERER)")
+    imagen: Optional[OpcionesImagen] = Field(None, description="Opciones de la imagen (por defecto JPEG a 300 dpi, sin miniatura)")
 
 
 class CotizacionDetalle(BaseModel):
@@ -75,6 +91,7 @@ class CotizacionColeccionResponse(BaseModel):
     cotizaciones: List[CotizacionPorPeriodo] = Field(..., description="Lista de cotizaciones por periodo")
     total_cotizaciones: int = Field(..., description="Total de cotizaciones generadas")
     imagen_base64: Optional[str] = Field(None, description="URL temporal de la imagen (válida por 10 minutos)")
+    miniatura_url: Optional[str] = Field(None, description="URL temporal de la miniatura (solo si se pidieron opciones de imagen con miniatura)")
 
 
 # Schemas para generación de imágenes
@@ -82,7 +99,24 @@ class ImageGenerationRequest(BaseModel):
     """Request para generar imagen de cotización"""
     producto: str = Field(..., min_length=1, description="Nombre del producto")
     parametros: ParametrosCotizacionSinPeriodo = Field(..., description="Parámetros de la cotización")
-    nombre_archivo: Optional[str] = Field(None, description="Nombre opcional para el archivo (sin extensión)")
+    nombre_archivo: Optional[str] = Field(
+        None,
+        max_length=120,
+        pattern=r"^[\w.-]+$",
+        description="Nombre opcional para el archivo (sin extensión; solo letras, números, '_', '-' y '.')"
+    )
+    renderizador: Optional[Renderizador] = Field(None, description="Renderizador de la imagen (por defecto IMAGE_RENDERER)")
+    imagen: OpcionesImagen = Field(default_factory=OpcionesImagen, description="Formato, resolución, calidad y miniatura")
+
+
+class MiniaturaInfo(BaseModel):
+    """Miniatura generada junto con la imagen"""
+    ruta_archivo: str = Field(..., description="Ruta de la miniatura")
+    nombre_archivo: str = Field(..., description="Nombre de la miniatura")
+    formato: str = Field(..., description="Formato de la miniatura")
+    ancho: Optional[int] = Field(None, description="Ancho en píxeles")
+    alto: Optional[int] = Field(None, description="Alto en píxeles")
+    bytes: int = Field(..., description="Tamaño del archivo en bytes")
 
 
 class ImageGenerationResponse(BaseModel):
@@ -90,3 +124,26 @@ class ImageGenerationResponse(BaseModel):
     ruta_archivo: str = Field(..., description="Ruta del archivo generado")
     nombre_archivo: str = Field(..., description="Nombre del archivo generado")
     mensaje: str = Field(..., description="Mensaje de confirmación")
+    formato: Optional[str] = Field(None, description="Formato de la imagen")
+    ancho: Optional[int] = Field(None, description="Ancho en píxeles (None para SVG)")
+    alto: Optional[int] = Field(None, description="Alto en píxeles (None para SVG)")
+    bytes: Optional[int] = Field(None, description="Tamaño del archivo en bytes")
+    tiempo_render_ms: Optional[float] = Field(None, description="Tiempo de renderizado y codificación (0 si se reutilizó)")
+    reutilizada: Optional[bool] = Field(None, description="True si la imagen ya existía en el almacén")
+    miniatura: Optional[MiniaturaInfo] = Field(None, description="Miniatura de la imagen")
+
+
+# Schemas para la superficie completa de cotizaciones
+class CotizacionGridResponse(BaseModel):
+    """Superficie de cotizaciones en formato columnar (una posición por combinación)"""
+    total_cotizaciones: int = Field(..., description="Total de combinaciones cotizadas")
+    edad_actuarial: List[int] = Field(..., description="Edad actuarial de cada combinación")
+    sexo: List[str] = Field(..., description="Sexo de cada combinación")
+    prima: List[float] = Field(..., description="Prima de cada combinación")
+    periodo: List[int] = Field(..., description="Periodo de pago de cada combinación")
+    porcentaje_devolucion: List[float] = Field(..., description="Porcentaje de devolución")
+    trea: List[float] = Field(..., description="Tasa de rendimiento efectiva anual")
+    aporte_total: List[float] = Field(..., description="Aporte total")
+    ganancia_total: List[float] = Field(..., description="Ganancia total")
+    devolucion_total: List[float] = Field(..., description="Devolución total")
+    rentabilidad: List[float] = Field(..., description="Rentabilidad")
@@ -0,0 +1,417 @@
+"""
+Almacenamiento de cotizaciones individuales
+ALMACEN_COTIZACIONES elige el backend:
+    - "memoria" (por defecto): lista en memoria del proceso, se pierde al reiniciar
+    - "sqlite": SQLite embebido en modo WAL, compartido por todos los workers
+      y procesos que usen el mismo archivo
+
+Con SQLite las cotizaciones se encolan en un buffer acotado y un hilo las
+inserta por lotes (una transacción por lote); los IDs se reservan de a
+bloques con una transacción atómica sobre el mismo archivo, así que no se
+repiten entre procesos. Un lote que no se puede escribir se reintenta con
+backoff y, si igual falla, se aparta en un archivo JSONL en lugar de perderse.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from app.schemas.cotizacion import CotizacionResponse
+from app.services.bitacora import bitacora
+
+
+ALMACEN_COTIZACIONES = os.getenv("ALMACEN_COTIZACIONES", "memoria")
+# Fuera de db/, que se sirve como estático en /images
+ALMACEN_COTIZACIONES_RUTA = os.getenv(
+    "ALMACEN_COTIZACIONES_RUTA",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "datos", "cotizaciones.sqlite3")
+)
+# Cotizaciones pendientes de escribir (si se llena, guardar() rechaza) y máximo por transacción
+ALMACEN_BUFFER_MAX = int(os.getenv("ALMACEN_BUFFER_MAX", "10000"))
+ALMACEN_LOTE_ESCRITURA = int(os.getenv("ALMACEN_LOTE_ESCRITURA", "1000"))
+# IDs que cada proceso reserva de una vez en la base
+ALMACEN_BLOQUE_IDS = int(os.getenv("ALMACEN_BLOQUE_IDS", "100"))
+# Intentos por lote ante errores de SQLite y espera exponencial entre ellos (segundos)
+ALMACEN_REINTENTOS = int(os.getenv("ALMACEN_REINTENTOS", "5"))
+ALMACEN_BACKOFF_BASE = float(os.getenv("ALMACEN_BACKOFF_BASE", "0.5"))
+ALMACEN_BACKOFF_MAX = float(os.getenv("ALMACEN_BACKOFF_MAX", "8"))
+
+
+class AlmacenSaturadoError(Exception):
+    """
+    El buffer de escritura está lleno: la base no da abasto
+
+    guardadas indica cuántas de las cotizaciones pasadas a guardar() sí se
+    encolaron (las primeras, en orden); las demás no se guardaron.
+    """
+
+    def __init__(self, guardadas: int, mensaje: str):
+        super().__init__(mensaje)
+        self.guardadas = guardadas
+
+
+class AlmacenDetenidoError(AlmacenSaturadoError):
+    """
+    El hilo escritor terminó por un error: no se aceptan más cotizaciones
+
+    Para quien llama es lo mismo que un buffer lleno (no se guardaron; la API
+    responde 503), por eso hereda de AlmacenSaturadoError.
+    """
+
+
+class AlmacenCotizaciones(ABC):
+    """Interfaz de los backends de almacenamiento de cotizaciones"""
+
+    @abstractmethod
+    def reservar_ids(self, cantidad: int) -> int:
+        """Reserva cantidad IDs consecutivos y devuelve el primero"""
+
+    @abstractmethod
+    def guardar(self, cotizaciones: List[CotizacionResponse]) -> None:
+        """Guarda cotizaciones ya calculadas (con su ID reservado); AlmacenSaturadoError si no hay lugar"""
+
+    @abstractmethod
+    def obtener(self, id_cotizacion: int) -> Optional[CotizacionResponse]:
+        """Cotización guardada con ese ID"""
+
+    @abstractmethod
+    def listar(self, limite: int = 100, desde_id: int = 0) -> List[CotizacionResponse]:
+        """Hasta limite cotizaciones guardadas con ID mayor que desde_id, en orden de ID"""
+
+    @abstractmethod
+    def contar(self) -> int:
+        """Cantidad de cotizaciones guardadas"""
+
+    @abstractmethod
+    def vaciar(self) -> None:
+        """Espera a que se escriba todo lo pendiente"""
+
+    @abstractmethod
+    def obtener_estadisticas(self) -> Dict:
+        """Contadores del backend"""
+
+    def cerrar(self) -> None:
+        """Escribe lo pendiente y libera los recursos"""
+        self.vaciar()
+
+
+class AlmacenMemoria(AlmacenCotizaciones):
+    """Lista en memoria del proceso (los IDs solo son únicos dentro del proceso)"""
+
+    def __init__(self):
+        self.cotizaciones: List[CotizacionResponse] = []
+        self._siguiente_id = 1
+        self._lock = threading.Lock()
+
+    def reservar_ids(self, cantidad: int) -> int:
+        with self._lock:
+            primero = self._siguiente_id
+            self._siguiente_id += cantidad
+        return primero
+
+    def guardar(self, cotizaciones: List[CotizacionResponse]) -> None:
+        self.cotizaciones.extend(cotizaciones)
+
+    def obtener(self, id_cotizacion: int) -> Optional[CotizacionResponse]:
+        return next((c for c in self.cotizaciones if c.id == id_cotizacion), None)
+
+    def listar(self, limite: int = 100, desde_id: int = 0) -> List[CotizacionResponse]:
+        return sorted((c for c in self.cotizaciones if c.id > desde_id), key=lambda c: c.id)[:limite]
+
+    def contar(self) -> int:
+        return len(self.cotizaciones)
+
+    def vaciar(self) -> None:
+        """Nada pendiente: guardar() escribe directamente en la lista"""
+
+    def obtener_estadisticas(self) -> Dict:
+        return {"backend": "memoria", "cotizaciones": len(self.cotizaciones)}
+
+
+class AlmacenSQLite(AlmacenCotizaciones):
+    """
+    SQLite en modo WAL con escrituras agrupadas
+
+    - guardar() solo encola, sin esperar: si ya hay buffer_max cotizaciones
+      pendientes rechaza el resto con AlmacenSaturadoError (la API responde
+      503) en lugar de trabar a quien llama; un hilo escritor toma todo lo pendiente (hasta lote_escritura) y lo
+      inserta en una sola transacción, así que bajo carga cada commit agrupa
+      muchas cotizaciones
+    - reservar_ids() toma bloques de bloque_ids IDs de la tabla secuencia con
+      BEGIN IMMEDIATE (atómico entre procesos) y los reparte localmente
+    - La conexión y el hilo se crean en el primer uso, en el proceso que los usa
+
+    Lo que está en el buffer se escribe al cerrar (apagado de la API o salida
+    del proceso); si el proceso muere de golpe se pierde.
+
+    Un lote que falla se reintenta hasta reintentos veces con espera
+    exponencial; si no se logra escribir (o el hilo escritor se detiene por un
+    error inesperado) las filas se apartan en <ruta>.no_escritas.jsonl para
+    recuperarlas a mano, se registra el error y se cuentan como apartadas.
+    Con el escritor detenido guardar() falla enseguida con AlmacenDetenidoError.
+    """
+
+    def __init__(
+        self,
+        ruta: str = ALMACEN_COTIZACIONES_RUTA,
+        buffer_max: int = ALMACEN_BUFFER_MAX,
+        lote_escritura: int = ALMACEN_LOTE_ESCRITURA,
+        bloque_ids: int = ALMACEN_BLOQUE_IDS,
+        reintentos: int = ALMACEN_REINTENTOS
+    ):
+        self.ruta = ruta
+        self.ruta_apartadas = f"{ruta}.no_escritas.jsonl"
+        self.lote_escritura = lote_escritura
+        self.bloque_ids = bloque_ids
+        self.reintentos = max(1, reintentos)
+        self._pendientes: queue.Queue = queue.Queue(maxsize=buffer_max)
+        self._lock = threading.Lock()
+        # Encolar y detener el escritor se excluyen: nada queda en la cola sin quien lo consuma
+        self._lock_cola = threading.Lock()
+        self._detenido = False
+        self._conexion: Optional[sqlite3.Connection] = None
+        self._escritor: Optional[threading.Thread] = None
+        self._pid = None
+        self._siguiente_id = 0
+        self._ultimo_id = -1  # bloque local de IDs vacío
+
+        self.escritas = 0
+        self.transacciones = 0
+        self.errores = 0
+        self.reintentos_realizados = 0
+        self.rechazadas = 0
+        self.apartadas = 0
+
+    def _conectar(self) -> sqlite3.Connection:
+        conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None, check_same_thread=False)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        return conexion
+
+    def _iniciar(self) -> sqlite3.Connection:
+        """Abre la base y arranca el hilo escritor en este proceso (una sola vez)"""
+        if self._pid == os.getpid():
+            return self._conexion
+        with self._lock:
+            if self._pid == os.getpid():
+                return self._conexion
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            conexion = self._conectar()
+            conexion.executescript("""
+                CREATE TABLE IF NOT EXISTS cotizaciones (
+                    id INTEGER PRIMARY KEY,
+                    fecha_creacion TEXT NOT NULL,
+                    producto TEXT NOT NULL,
+                    datos TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS secuencia (
+                    nombre TEXT PRIMARY KEY,
+                    valor INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO secuencia (nombre, valor)
+                    SELECT 'cotizaciones', COALESCE(MAX(id), 0) FROM cotizaciones;
+            """)
+            self._conexion = conexion
+            self._escritor = threading.Thread(target=self._escribir_pendientes, name="almacen-cotizaciones", daemon=True)
+            self._escritor.start()
+            self._pid = os.getpid()
+            atexit.register(self.cerrar)
+            bitacora.info("almacen_cotizaciones", f"SQLite (WAL) en {self.ruta}", ruta=self.ruta)
+            return conexion
+
+    def reservar_ids(self, cantidad: int) -> int:
+        conexion = self._iniciar()
+        with self._lock:
+            if self._ultimo_id - self._siguiente_id + 1 < cantidad:
+                # Lo que quedaba del bloque anterior se descarta (quedan huecos en la numeración)
+                reserva = max(cantidad, self.bloque_ids)
+                conexion.execute("BEGIN IMMEDIATE")
+                try:
+                    conexion.execute(
+                        "UPDATE secuencia SET valor = valor + ? WHERE nombre = 'cotizaciones'", (reserva,)
+                    )
+                    (ultimo,) = conexion.execute(
+                        "SELECT valor FROM secuencia WHERE nombre = 'cotizaciones'"
+                    ).fetchone()
+                    conexion.execute("COMMIT")
+                except BaseException:
+                    conexion.execute("ROLLBACK")
+                    raise
+                self._siguiente_id = ultimo - reserva + 1
+                self._ultimo_id = ultimo
+            primero = self._siguiente_id
+            self._siguiente_id += cantidad
+        return primero
+
+    def guardar(self, cotizaciones: List[CotizacionResponse]) -> None:
+        self._iniciar()
+        for guardadas, cotizacion in enumerate(cotizaciones):
+            fila = (cotizacion.id, cotizacion.fecha_creacion.isoformat(), cotizacion.producto, cotizacion.model_dump_json())
+            try:
+                with self._lock_cola:
+                    if self._detenido or not self._escritor.is_alive():
+                        raise AlmacenDetenidoError(guardadas, "El escritor del almacén de cotizaciones está detenido")
+                    self._pendientes.put_nowait(fila)
+            except queue.Full:
+                rechazadas = len(cotizaciones) - guardadas
+                self.rechazadas += rechazadas
+                bitacora.advertencia(
+                    "almacen_cotizaciones_saturado",
+                    f"Buffer de escritura lleno: {rechazadas} cotizaciones rechazadas",
+                    rechazadas=rechazadas
+                )
+                raise AlmacenSaturadoError(guardadas, f"Almacén de cotizaciones saturado ({self._pendientes.maxsize} pendientes)")
+
+    def _escribir_pendientes(self) -> None:
+        """Hilo escritor: inserta por lotes todo lo que se haya acumulado"""
+        try:
+            conexion = self._conectar()
+            while True:
+                filas = [self._pendientes.get()]
+                try:
+                    while len(filas) < self.lote_escritura:
+                        try:
+                            filas.append(self._pendientes.get_nowait())
+                        except queue.Empty:
+                            break
+                    self._escribir_lote(conexion, filas)
+                except BaseException:
+                    self._apartar(filas)
+                    raise
+                finally:
+                    # Cada fila tomada de la cola se marca, pase lo que pase (vaciar() espera por ellas)
+                    for _ in filas:
+                        self._pendientes.task_done()
+        except BaseException as e:
+            bitacora.error("almacen_cotizaciones_error", f"El escritor del almacén se detuvo: {e}", excepcion=e)
+            with self._lock_cola:
+                self._detenido = True
+                restantes = []
+                while True:
+                    try:
+                        restantes.append(self._pendientes.get_nowait())
+                    except queue.Empty:
+                        break
+            self._apartar(restantes)
+            for _ in restantes:
+                self._pendientes.task_done()
+
+    def _escribir_lote(self, conexion: sqlite3.Connection, filas: List[tuple]) -> None:
+        """Inserta el lote en una transacción; reintenta con backoff y, si no se puede, lo aparta"""
+        for intento in range(1, self.reintentos + 1):
+            try:
+                conexion.execute("BEGIN IMMEDIATE")
+                conexion.executemany(
+                    "INSERT OR REPLACE INTO cotizaciones (id, fecha_creacion, producto, datos) VALUES (?, ?, ?, ?)",
+                    filas
+                )
+                conexion.execute("COMMIT")
+                self.escritas += len(filas)
+                self.transacciones += 1
+                return
+            except sqlite3.Error as e:
+                if conexion.in_transaction:
+                    conexion.execute("ROLLBACK")
+                self.errores += 1
+                if intento == self.reintentos:
+                    bitacora.error(
+                        "almacen_cotizaciones_error",
+                        f"No se pudieron escribir {len(filas)} cotizaciones tras {intento} intentos: {e}",
+                        cotizaciones=len(filas)
+                    )
+                    self._apartar(filas)
+                    return
+                self.reintentos_realizados += 1
+                espera = min(ALMACEN_BACKOFF_MAX, ALMACEN_BACKOFF_BASE * 2 ** (intento - 1))
+                bitacora.advertencia(
+                    "almacen_cotizaciones_reintento",
+                    f"Error al escribir {len(filas)} cotizaciones (intento {intento}): {e}; reintento en {espera} s",
+                    cotizaciones=len(filas), intento=intento
+                )
+                time.sleep(espera)
+
+    def _apartar(self, filas: List[tuple]) -> None:
+        """Guarda en ruta_apartadas las filas que no se pudieron escribir en la base"""
+        if not filas:
+            return
+        try:
+            with open(self.ruta_apartadas, "a", encoding="utf-8") as archivo:
+                for id_cotizacion, fecha_creacion, producto, datos in filas:
+                    archivo.write(json.dumps(
+                        {"id": id_cotizacion, "fecha_creacion": fecha_creacion, "producto": producto, "datos": datos},
+                        ensure_ascii=False
+                    ) + "\n")
+        except OSError as e:
+            bitacora.error(
+                "almacen_cotizaciones_error",
+                f"Se perdieron {len(filas)} cotizaciones: no se pudieron apartar en {self.ruta_apartadas}: {e}",
+                cotizaciones=len(filas)
+            )
+            return
+        self.apartadas += len(filas)
+        bitacora.error(
+            "almacen_cotizaciones_apartadas",
+            f"{len(filas)} cotizaciones apartadas en {self.ruta_apartadas}",
+            cotizaciones=len(filas), ruta=self.ruta_apartadas
+        )
+
+    def vaciar(self) -> None:
+        """Espera a que se escriba todo lo pendiente"""
+        if self._pid == os.getpid():
+            self._pendientes.join()
+
+    def obtener(self, id_cotizacion: int) -> Optional[CotizacionResponse]:
+        """Cotización ya escrita (no ve las que siguen en el buffer)"""
+        conexion = self._iniciar()
+        with self._lock:
+            fila = conexion.execute("SELECT datos FROM cotizaciones WHERE id = ?", (id_cotizacion,)).fetchone()
+        return CotizacionResponse.model_validate(json.loads(fila[0])) if fila else None
+
+    def listar(self, limite: int = 100, desde_id: int = 0) -> List[CotizacionResponse]:
+        """Cotizaciones ya escritas (no ve las que siguen en el buffer)"""
+        conexion = self._iniciar()
+        with self._lock:
+            filas = conexion.execute(
+                "SELECT datos FROM cotizaciones WHERE id > ? ORDER BY id LIMIT ?", (desde_id, limite)
+            ).fetchall()
+        return [CotizacionResponse.model_validate(json.loads(datos)) for (datos,) in filas]
+
+    def contar(self) -> int:
+        conexion = self._iniciar()
+        with self._lock:
+            return conexion.execute("SELECT COUNT(*) FROM cotizaciones").fetchone()[0]
+
+    def obtener_estadisticas(self) -> Dict:
+        return {
+            "backend": "sqlite",
+            "ruta": self.ruta,
+            "pendientes": self._pendientes.qsize(),
+            "escritas": self.escritas,
+            "transacciones": self.transacciones,
+            "cotizaciones_por_transaccion": round(self.escritas / self.transacciones, 1) if self.transacciones else 0,
+            "errores": self.errores,
+            "reintentos": self.reintentos_realizados,
+            "rechazadas": self.rechazadas,
+            "apartadas": self.apartadas,
+            "escritor_activo": self._escritor is not None and self._escritor.is_alive() and not self._detenido,
+        }
+
+
+def crear_almacen_cotizaciones(backend: str = ALMACEN_COTIZACIONES) -> AlmacenCotizaciones:
+    """Backend configurado en ALMACEN_COTIZACIONES"""
+    if backend == "memoria":
+        return AlmacenMemoria()
+    if backend == "sqlite":
+        return AlmacenSQLite()
+    raise ValueError(f"ALMACEN_COTIZACIONES desconocido: {backend} (usar 'memoria' o 'sqlite')")
+
+
+# Almacén compartido por el proceso
+almacen_cotizaciones = crear_almacen_cotizaciones()
@@ -0,0 +1,209 @@
+"""
+Almacén de imágenes direccionado por contenido
+Cada gráfico se guarda una sola vez con el hash de lo que dibuja (título,
+series, filas de la tabla) y del renderizador que lo generó; un request con
+los mismos datos reutiliza el archivo y la URL subida en lugar de renderizar
+otra vez. Las escrituras son atómicas (archivo temporal + os.replace), así que
+nunca se sirve un archivo a medio escribir.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from app.services.datos_grafico import DatosGrafico
+from app.services.metricas import medir_etapa, registrar_cache
+from app.services.limpieza_imagenes import limpiador_imagenes
+from app.services.bitacora import bitacora
+
+
+# Versión de cada renderizador: subirla cuando cambia cómo se dibuja el
+# gráfico, para que no se reutilicen imágenes generadas con la versión anterior
+VERSIONES_RENDERIZADOR = {
+    "matplotlib": 1,
+    "plantilla": 1,
+    "rapido": 1,
+}
+
+# Directorio db/ de la API: publicar() solo escribe dentro de él
+DIRECTORIO_PUBLICACION = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "db")
+ALMACEN_IMAGENES_DIR = os.getenv("ALMACEN_IMAGENES_DIR", os.path.join(DIRECTORIO_PUBLICACION, "graficos"))
+# Las URLs temporales expiran a la hora; se reutilizan un poco menos que eso
+ALMACEN_URL_TTL = float(os.getenv("ALMACEN_URL_TTL", "3000"))
+# Máximo de URLs recordadas; al superarse se olvidan las registradas hace más tiempo
+ALMACEN_URLS_MAX = int(os.getenv("ALMACEN_URLS_MAX", "10000"))
+
+
+def huella_grafico(
+    datos: DatosGrafico,
+    renderizador: str,
+    formato: str = "jpeg",
+    dpi: float = 300,
+    calidad: Optional[int] = None
+) -> str:
+    """Hash del contenido del gráfico, de la versión del renderizador y de las opciones de salida"""
+    contenido = json.dumps(
+        [
+            renderizador, VERSIONES_RENDERIZADOR.get(renderizador, 0), formato, round(dpi, 3), calidad,
+            datos.titulo, datos.series, datos.filas
+        ],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+
+class AlmacenImagenes:
+    """
+    Archivos <huella>.<extensión> en un directorio más un índice en memoria
+    de las URLs ya subidas (por ruta, con vencimiento)
+
+    El índice de URLs está en orden de registro: al registrar una URL se
+    descartan del principio las vencidas y, si se supera urls_max, las más
+    antiguas. La limpieza de db/ avisa (olvidar_url) cuando borra un archivo.
+
+    El directorio es el índice de imágenes: se comparte entre procesos, así
+    que lo que renderiza un worker lo reutilizan los demás.
+    """
+
+    def __init__(
+        self,
+        directorio: str = ALMACEN_IMAGENES_DIR,
+        url_ttl: float = ALMACEN_URL_TTL,
+        directorio_publicacion: str = DIRECTORIO_PUBLICACION,
+        urls_max: int = ALMACEN_URLS_MAX
+    ):
+        self.directorio = directorio
+        self.directorio_publicacion = directorio_publicacion
+        self.url_ttl = url_ttl
+        os.makedirs(self.directorio, exist_ok=True)
+        self.urls_max = max(1, urls_max)
+        self._urls: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.reutilizadas = 0
+        self.guardadas = 0
+        self.urls_reutilizadas = 0
+        self.urls_descartadas = 0
+
+    def ruta(self, huella: str, extension: str = "jpg") -> str:
+        return os.path.join(self.directorio, f"{huella}.{extension}")
+
+    def buscar(self, huella: str, extension: str = "jpg") -> Optional[str]:
+        """Ruta de la imagen si ya existe en el almacén"""
+        ruta = self.ruta(huella, extension)
+        if os.path.exists(ruta):
+            self.reutilizadas += 1
+            registrar_cache("imagenes", True)
+            bitacora.debug("cache_imagen", resultado="acierto", huella=huella)
+            limpiador_imagenes.tocar(ruta)
+            return ruta
+        registrar_cache("imagenes", False)
+        bitacora.debug("cache_imagen", resultado="fallo", huella=huella)
+        return None
+
+    def guardar(self, huella: str, escribir: Callable[[str], None], extension: str = "jpg") -> str:
+        """
+        Escribe la imagen con escribir(ruta_temporal) y la publica de forma atómica
+
+        Si dos procesos generan la misma imagen a la vez, ambos escriben en su
+        propio temporal y el último os.replace gana (el contenido es el mismo).
+        """
+        ruta = self.ruta(huella, extension)
+        fd, temporal = tempfile.mkstemp(dir=self.directorio, prefix=f".{huella[:16]}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            escribir(temporal)
+            with medir_etapa("escritura_disco"):
+                os.chmod(temporal, 0o644)  # mkstemp crea el archivo solo para el dueño
+                os.replace(temporal, ruta)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        self.guardadas += 1
+        limpiador_imagenes.registrar(ruta)
+        return ruta
+
+    def publicar(self, ruta: str, destino: str, directorio: Optional[str] = None) -> str:
+        """
+        Deja una copia de la imagen con otro nombre (hard link si se puede),
+        reemplazando el destino de forma atómica
+
+        El destino tiene que quedar dentro de directorio (por defecto
+        directorio_publicacion, db/); si no, ValueError (en la API el nombre
+        lo elige el cliente).
+        """
+        directorio = directorio or self.directorio_publicacion
+        raiz = os.path.realpath(directorio)
+        if os.path.commonpath([raiz, os.path.realpath(destino)]) != raiz:
+            raise ValueError(f"Destino fuera de {directorio}: {destino}")
+        temporal = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with medir_etapa("escritura_disco"):
+                try:
+                    os.link(ruta, temporal)
+                except OSError:
+                    shutil.copyfile(ruta, temporal)
+                os.replace(temporal, destino)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        limpiador_imagenes.registrar(destino)
+        return destino
+
+    def url_vigente(self, ruta: str) -> Optional[str]:
+        """URL pública ya subida para esa imagen, si todavía no venció"""
+        ruta = os.path.abspath(ruta)
+        with self._lock:
+            entrada = self._urls.get(ruta)
+            if entrada is not None and time.monotonic() - entrada[1] > self.url_ttl:
+                del self._urls[ruta]
+                entrada = None
+            if entrada is not None:
+                self.urls_reutilizadas += 1
+        registrar_cache("urls_imagenes", entrada is not None)
+        return entrada[0] if entrada is not None else None
+
+    def registrar_url(self, ruta: str, url: Optional[str]) -> None:
+        """Recuerda la URL pública de la imagen (se ignora si la subida falló)"""
+        if url is None:
+            return
+        ruta = os.path.abspath(ruta)
+        ahora = time.monotonic()
+        with self._lock:
+            self._urls.pop(ruta, None)
+            self._urls[ruta] = (url, ahora)
+            while self._urls:
+                _, (_, registrada) = next(iter(self._urls.items()))
+                if len(self._urls) <= self.urls_max and ahora - registrada <= self.url_ttl:
+                    break
+                self._urls.popitem(last=False)
+                self.urls_descartadas += 1
+
+    def olvidar_url(self, ruta: str) -> None:
+        """Descarta la URL de una imagen borrada del disco"""
+        with self._lock:
+            self._urls.pop(os.path.abspath(ruta), None)
+
+    def obtener_estadisticas(self) -> Dict:
+        """Contadores del almacén en este proceso"""
+        return {
+            "directorio": self.directorio,
+            "reutilizadas": self.reutilizadas,
+            "guardadas": self.guardadas,
+            "urls_en_indice": len(self._urls),
+            "urls_reutilizadas": self.urls_reutilizadas,
+            "urls_descartadas": self.urls_descartadas,
+        }
+
+
+# Almacén compartido por el proceso
+almacen_imagenes = AlmacenImagenes()
+limpiador_imagenes.al_eliminar(almacen_imagenes.olvidar_url)
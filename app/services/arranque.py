@@ -0,0 +1,62 @@
+"""
+Tiempos de arranque del proceso de la API
+Registra hitos (app importada, lifespan listo, pool de renderizado listo,
+primera respuesta de /health) medidos desde el inicio del proceso, para ver
+en los logs cuánto tarda un arranque en frío.
+"""
+import os
+import time
+from typing import Dict, Optional
+
+from app.services.bitacora import bitacora
+
+
+def _inicio_proceso() -> float:
+    """
+    Instante de inicio del proceso en la escala de time.monotonic()
+
+    En Linux se lee de /proc (incluye el arranque del intérprete y de
+    uvicorn); en otros sistemas se usa el momento en que se importó el módulo.
+    """
+    ahora = time.monotonic()
+    try:
+        with open("/proc/self/stat") as f:
+            # El nombre del proceso va entre paréntesis y puede tener espacios
+            campos = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        # starttime (campo 22) en ticks desde el arranque del sistema
+        iniciado_hace = uptime - int(campos[19]) / os.sysconf("SC_CLK_TCK")
+        return ahora - max(0.0, iniciado_hace)
+    except (OSError, ValueError, IndexError):
+        return ahora
+
+
+class InformeArranque:
+    """Hitos del arranque en segundos desde el inicio del proceso"""
+
+    def __init__(self):
+        self.inicio = _inicio_proceso()
+        self.hitos: Dict[str, float] = {}
+
+    def marcar(self, hito: str) -> Optional[float]:
+        """Registra el hito la primera vez; devuelve los segundos desde el inicio (None si ya estaba)"""
+        if hito in self.hitos:
+            return None
+        segundos = round(time.monotonic() - self.inicio, 3)
+        self.hitos[hito] = segundos
+        return segundos
+
+    def primera_respuesta(self) -> None:
+        """Marca la primera respuesta de /health e imprime el resumen del arranque"""
+        if self.marcar("primera_respuesta_health") is None:
+            return
+        detalle = ", ".join(f"{hito} {segundos:.2f} s" for hito, segundos in self.hitos.items())
+        bitacora.info("arranque", f"{detalle} (desde el inicio del proceso)", hitos=dict(self.hitos))
+
+    def obtener_estadisticas(self) -> Dict:
+        return dict(self.hitos)
+
+
+# Informe del proceso; app.main marca los hitos
+informe_arranque = InformeArranque()
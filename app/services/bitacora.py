@@ -0,0 +1,199 @@
+"""
+Bitácora estructurada sin bloqueos
+Los servicios registran eventos con bitacora.info/advertencia/error/debug:
+el registro se arma en el llamador y se encola; un hilo por proceso los
+escribe en stdout como líneas JSON. Si la cola está llena el registro se
+descarta y se cuenta, en lugar de frenar el request (o el event loop)
+esperando a un stdout lento.
+
+Las claves "severity", "message" y "time" son las que Cloud Logging
+reconoce en las líneas JSON de stdout; el resto de los campos van tal cual.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import threading
+import traceback
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from app.services import metricas
+
+
+NIVELES = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+BITACORA_NIVEL = os.getenv("BITACORA_NIVEL", "INFO").upper()
+BITACORA_FORMATO = os.getenv("BITACORA_FORMATO", "json")  # "json" o "texto" (desarrollo)
+BITACORA_COLA_MAX = int(os.getenv("BITACORA_COLA_MAX", "10000"))
+# Fracción de eventos que se registran, por evento: "cache_coleccion=0.01,cache_imagen=0.1"
+BITACORA_MUESTREO = os.getenv("BITACORA_MUESTREO", "cache_coleccion=0.01,cache_imagen=0.01")
+
+
+def _leer_muestreo(valor: str) -> Dict[str, float]:
+    muestreo = {}
+    for parte in valor.split(","):
+        if "=" in parte:
+            evento, fraccion = parte.split("=", 1)
+            muestreo[evento.strip()] = min(1.0, max(0.0, float(fraccion)))
+    return muestreo
+
+
+class Bitacora:
+    """
+    Cola acotada + hilo escritor, por proceso
+
+    - nivel: se descartan sin encolar los eventos de menor nivel
+    - muestreo: fracción de cada evento que se registra (1 si no figura)
+    - cola_max: registros en espera; con la cola llena se cuentan como descartados
+    """
+
+    def __init__(
+        self,
+        nivel: str = BITACORA_NIVEL,
+        formato: str = BITACORA_FORMATO,
+        cola_max: int = BITACORA_COLA_MAX,
+        muestreo: Optional[Dict[str, float]] = None
+    ):
+        self.nivel = NIVELES.get(nivel, NIVELES["INFO"])
+        self.formato = formato
+        self.cola_max = cola_max
+        self.muestreo = _leer_muestreo(BITACORA_MUESTREO) if muestreo is None else muestreo
+        self._cola: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=cola_max)
+        self._hilo: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+        self.escritos = 0
+        self.descartados = 0
+        self.omitidos_muestreo = 0
+        self._descartados_informados = 0
+
+    def habilitado(self, nivel: str) -> bool:
+        return NIVELES[nivel] >= self.nivel
+
+    def registrar(self, nivel: str, evento: str, mensaje: str = "", excepcion: Optional[BaseException] = None, **campos) -> None:
+        """Encola el evento sin esperar; nunca lanza ni bloquea"""
+        if NIVELES[nivel] < self.nivel:
+            return
+        fraccion = self.muestreo.get(evento)
+        if fraccion is not None and random.random() >= fraccion:
+            self.omitidos_muestreo += 1
+            return
+        registro = {"time": time.time(), "severity": nivel, "evento": evento, "message": mensaje, "pid": os.getpid()}
+        if campos:
+            registro.update(campos)
+        if excepcion is not None:
+            registro["excepcion"] = "".join(
+                traceback.format_exception(type(excepcion), excepcion, excepcion.__traceback__)
+            ).rstrip()
+        self._asegurar_hilo()
+        try:
+            self._cola.put_nowait(registro)
+        except queue.Full:
+            with self._lock:
+                self.descartados += 1
+            _descartados_total.incrementar()
+
+    def debug(self, evento: str, mensaje: str = "", **campos) -> None:
+        self.registrar("DEBUG", evento, mensaje, **campos)
+
+    def info(self, evento: str, mensaje: str = "", **campos) -> None:
+        self.registrar("INFO", evento, mensaje, **campos)
+
+    def advertencia(self, evento: str, mensaje: str = "", **campos) -> None:
+        self.registrar("WARNING", evento, mensaje, **campos)
+
+    def error(self, evento: str, mensaje: str = "", excepcion: Optional[BaseException] = None, **campos) -> None:
+        self.registrar("ERROR", evento, mensaje, excepcion=excepcion, **campos)
+
+    def _asegurar_hilo(self) -> None:
+        # Un hilo por proceso: los workers del pool de renderizado tienen el suyo
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._cola = queue.Queue(maxsize=self.cola_max)
+            self._hilo = threading.Thread(target=self._escribir, name="bitacora", daemon=True)
+            self._hilo.start()
+            self._pid = os.getpid()
+
+    def _formatear(self, registro: dict) -> str:
+        if self.formato == "texto":
+            extra = " ".join(
+                f"{clave}={valor}" for clave, valor in registro.items()
+                if clave not in ("time", "severity", "evento", "message", "pid", "excepcion")
+            )
+            linea = f"[{registro['severity']}] {registro['evento']}: {registro['message']}" + (f" ({extra})" if extra else "")
+            if "excepcion" in registro:
+                linea += "\n" + registro["excepcion"]
+            return linea
+        registro["time"] = datetime.fromtimestamp(registro["time"], timezone.utc).isoformat()
+        return json.dumps(registro, ensure_ascii=False, default=str)
+
+    def _escribir(self) -> None:
+        """Hilo escritor: toma todo lo que haya en la cola y lo escribe de una vez"""
+        while True:
+            registros = [self._cola.get()]
+            while len(registros) < 512:
+                try:
+                    registros.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            fin = None in registros
+            lineas = [self._formatear(r) for r in registros if r is not None]
+            if self.descartados > self._descartados_informados:
+                perdidos = self.descartados - self._descartados_informados
+                self._descartados_informados = self.descartados
+                lineas.append(self._formatear({
+                    "time": time.time(), "severity": "WARNING", "evento": "bitacora_descartados",
+                    "message": f"{perdidos} registros descartados (cola llena)", "pid": os.getpid(),
+                    "descartados": perdidos
+                }))
+            if lineas:
+                try:
+                    sys.stdout.write("\n".join(lineas) + "\n")
+                    sys.stdout.flush()
+                except (OSError, ValueError):
+                    pass
+                self.escritos += len(lineas)
+            if fin:
+                return
+
+    def cerrar(self, espera: float = 2.0) -> None:
+        """Escribe lo que quede en la cola (al terminar el proceso)"""
+        if self._pid != os.getpid() or self._hilo is None:
+            return
+        try:
+            self._cola.put(None, timeout=espera)
+        except queue.Full:
+            return
+        self._hilo.join(timeout=espera)
+        self._pid = None
+
+    def obtener_estadisticas(self) -> Dict:
+        nombres = {valor: nombre for nombre, valor in NIVELES.items()}
+        return {
+            "nivel": nombres.get(self.nivel),
+            "formato": self.formato,
+            "en_cola": self._cola.qsize(),
+            "cola_max": self.cola_max,
+            "escritos": self.escritos,
+            "descartados": self.descartados,
+            "omitidos_muestreo": self.omitidos_muestreo,
+            "muestreo": self.muestreo,
+        }
+
+
+_descartados_total = metricas.registro.registrar(metricas.Contador(
+    "rumbia_bitacora_descartados_total",
+    "Registros de la bitácora descartados porque la cola estaba llena"
+))
+
+# Bitácora del proceso
+bitacora = Bitacora()
+atexit.register(bitacora.cerrar)
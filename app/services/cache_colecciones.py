@@ -0,0 +1,315 @@
+"""
+Cache acotado para colecciones de cotizaciones
+LRU con límite de entradas y de bytes, TTL por entrada y métricas de uso,
+más un nivel compartido entre los workers de la misma máquina (SQLite)
+"""
+import os
+import mmap
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.bitacora import bitacora
+
+
+class _Entrada:
+    __slots__ = ("valor", "bytes", "expira_en")
+
+    def __init__(self, valor: Any, bytes_estimados: int, expira_en: float):
+        self.valor = valor
+        self.bytes = bytes_estimados
+        self.expira_en = expira_en
+
+
+class CacheColecciones:
+    """
+    Cache LRU acotado con expiración por entrada
+
+    - max_entradas / max_bytes: al superarse se expulsan las entradas usadas
+      hace más tiempo
+    - ttl_segundos: una entrada vencida no se sirve (las URLs temporales de
+      imagen que contienen las respuestas expiran en el servicio externo)
+    """
+
+    def __init__(self, max_entradas: int, max_bytes: int, ttl_segundos: float, muestras_latencia: int = 2048):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        self._entradas: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._latencias_ns: deque = deque(maxlen=muestras_latencia)
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.expiraciones = 0
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def _quitar(self, clave: str) -> _Entrada:
+        entrada = self._entradas.pop(clave)
+        self._bytes -= entrada.bytes
+        return entrada
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        """Devuelve el valor en cache o None si no está o ya venció"""
+        inicio = time.perf_counter_ns()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada.expira_en <= time.monotonic():
+                self._quitar(clave)
+                self.expiraciones += 1
+                entrada = None
+
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+
+            if entrada is None:
+                self.fallos += 1
+            else:
+                self.aciertos += 1
+            self._latencias_ns.append(time.perf_counter_ns() - inicio)
+
+        return entrada.valor if entrada is not None else None
+
+    def guardar(self, clave: str, valor: Any, bytes_estimados: int, ttl_segundos: Optional[float] = None) -> None:
+        """
+        Guarda un valor y expulsa las entradas menos usadas si se superan los límites
+
+        ttl_segundos acorta la vigencia de esta entrada (nunca la alarga más
+        allá del TTL del cache); se usa para no extender la de una entrada
+        traída del cache compartido.
+        """
+        if bytes_estimados > self.max_bytes or self.max_entradas <= 0:
+            return
+        ttl = self.ttl_segundos if ttl_segundos is None else min(ttl_segundos, self.ttl_segundos)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+
+            self._entradas[clave] = _Entrada(valor, bytes_estimados, time.monotonic() + ttl)
+            self._bytes += bytes_estimados
+
+            ahora = time.monotonic()
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                clave_antigua, entrada = next(iter(self._entradas.items()))
+                self._quitar(clave_antigua)
+                if entrada.expira_en <= ahora:
+                    self.expiraciones += 1
+                else:
+                    self.expulsiones += 1
+
+    def limpiar(self) -> int:
+        """Vacía el cache y devuelve cuántas entradas tenía"""
+        with self._lock:
+            cantidad = len(self._entradas)
+            self._entradas.clear()
+            self._bytes = 0
+        return cantidad
+
+    @staticmethod
+    def _percentil(muestras: list, percentil: float) -> Optional[float]:
+        if not muestras:
+            return None
+        idx = min(len(muestras) - 1, int(round(percentil / 100 * (len(muestras) - 1))))
+        return muestras[idx]
+
+    def obtener_estadisticas(self) -> Dict:
+        """Tamaño, límites, contadores y latencia de consulta (µs) del cache"""
+        with self._lock:
+            latencias = sorted(self._latencias_ns)
+            entradas = len(self._entradas)
+            bytes_estimados = self._bytes
+
+        consultas = self.aciertos + self.fallos
+        p50 = self._percentil(latencias, 50)
+        p99 = self._percentil(latencias, 99)
+        return {
+            "entradas": entradas,
+            "max_entradas": self.max_entradas,
+            "bytes_estimados": bytes_estimados,
+            "max_bytes": self.max_bytes,
+            "ttl_segundos": self.ttl_segundos,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else None,
+            "expulsiones": self.expulsiones,
+            "expiraciones": self.expiraciones,
+            "latencia_consulta_p50_us": round(p50 / 1000, 2) if p50 is not None else None,
+            "latencia_consulta_p99_us": round(p99 / 1000, 2) if p99 is not None else None,
+        }
+
+
+class CacheCompartido:
+    """
+    Nivel de cache compartido por todos los procesos que usan el mismo archivo
+
+    - Las entradas (JSON serializado) se guardan en SQLite en modo WAL, con
+      vencimiento por reloj de pared; al superar max_bytes se borran las más
+      antiguas
+    - limpiar() borra todo y sube una generación guardada en un archivo
+      mapeado en memoria (<ruta>.generacion); cada worker la lee antes de usar
+      su cache local y lo vacía si cambió, así la invalidación llega a todos
+    - La conexión se abre en el primer uso, en el proceso que la usa
+    """
+
+    def __init__(self, ruta: str, max_bytes: int, ttl_segundos: float, poda_cada: int = 100):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        self.poda_cada = poda_cada
+        self._lock = threading.Lock()
+        self._conexion: Optional[sqlite3.Connection] = None
+        self._generacion: Optional[mmap.mmap] = None
+        self._pid = None
+        self._escrituras = 0
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.guardadas = 0
+        self.errores = 0
+
+    def _iniciar(self) -> sqlite3.Connection:
+        """Abre la base y el archivo de generación en este proceso (una sola vez)"""
+        if self._pid == os.getpid():
+            return self._conexion
+        with self._lock:
+            if self._pid == os.getpid():
+                return self._conexion
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            conexion = sqlite3.connect(self.ruta, timeout=10, isolation_level=None, check_same_thread=False)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.executescript("""
+                CREATE TABLE IF NOT EXISTS colecciones (
+                    clave TEXT PRIMARY KEY,
+                    valor TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    guardada_en REAL NOT NULL,
+                    expira_en REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS colecciones_guardada_en ON colecciones (guardada_en);
+            """)
+
+            fd = os.open(f"{self.ruta}.generacion", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < 8:
+                    os.ftruncate(fd, 8)
+                self._generacion = mmap.mmap(fd, 8)
+            finally:
+                os.close(fd)
+            self._conexion = conexion
+            self._pid = os.getpid()
+            return conexion
+
+    def generacion(self) -> int:
+        """Generación actual (cambia cada vez que algún worker limpia el cache)"""
+        self._iniciar()
+        return int.from_bytes(self._generacion[:8], "little")
+
+    def obtener(self, clave: str) -> Optional[Tuple[str, float]]:
+        """(valor serializado, segundos que le quedan de vigencia) o None si no está o ya venció"""
+        conexion = self._iniciar()
+        ahora = time.time()
+        try:
+            with self._lock:
+                fila = conexion.execute(
+                    "SELECT valor, expira_en - ? FROM colecciones WHERE clave = ? AND expira_en > ?", (ahora, clave, ahora)
+                ).fetchone()
+        except sqlite3.Error as e:
+            self.errores += 1
+            bitacora.error("cache_compartido_error", f"Error al leer: {e}")
+            return None
+        if fila is None:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return fila[0], fila[1]
+
+    def guardar(self, clave: str, valor: str) -> None:
+        """Guarda el valor serializado; cada poda_cada escrituras borra vencidas y excedentes"""
+        tamano = len(valor.encode())
+        if tamano > self.max_bytes:
+            return
+        conexion = self._iniciar()
+        ahora = time.time()
+        try:
+            with self._lock:
+                conexion.execute(
+                    "INSERT OR REPLACE INTO colecciones (clave, valor, bytes, guardada_en, expira_en) VALUES (?, ?, ?, ?, ?)",
+                    (clave, valor, tamano, ahora, ahora + self.ttl_segundos)
+                )
+                self.guardadas += 1
+                self._escrituras += 1
+                if self._escrituras % self.poda_cada == 0:
+                    self._podar(conexion, ahora)
+        except sqlite3.Error as e:
+            self.errores += 1
+            bitacora.error("cache_compartido_error", f"Error al guardar: {e}")
+
+    def _podar(self, conexion: sqlite3.Connection, ahora: float) -> None:
+        """Borra las entradas vencidas y, si se supera max_bytes, las más antiguas"""
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            conexion.execute("DELETE FROM colecciones WHERE expira_en <= ?", (ahora,))
+            (total,) = conexion.execute("SELECT COALESCE(SUM(bytes), 0) FROM colecciones").fetchone()
+            if total > self.max_bytes:
+                # Las más antiguas cuyo acumulado previo todavía no cubre el exceso
+                conexion.execute("""
+                    DELETE FROM colecciones WHERE clave IN (
+                        SELECT clave FROM (
+                            SELECT clave, bytes, SUM(bytes) OVER (ORDER BY guardada_en) AS acumulado FROM colecciones
+                        ) WHERE acumulado - bytes < ?
+                    )
+                """, (total - self.max_bytes,))
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+
+    def limpiar(self) -> int:
+        """Vacía el cache compartido y avisa a todos los workers (nueva generación)"""
+        conexion = self._iniciar()
+        with self._lock:
+            conexion.execute("BEGIN IMMEDIATE")
+            try:
+                cantidad = conexion.execute("DELETE FROM colecciones").rowcount
+                # La transacción serializa los incrementos entre procesos
+                generacion = int.from_bytes(self._generacion[:8], "little") + 1
+                self._generacion[:8] = generacion.to_bytes(8, "little")
+                conexion.execute("COMMIT")
+            except BaseException:
+                conexion.execute("ROLLBACK")
+                raise
+        return cantidad
+
+    def obtener_estadisticas(self) -> Dict:
+        """Tamaño y contadores del nivel compartido (los contadores son de este proceso)"""
+        conexion = self._iniciar()
+        with self._lock:
+            entradas, bytes_totales = conexion.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM colecciones WHERE expira_en > ?", (time.time(),)
+            ).fetchone()
+        consultas = self.aciertos + self.fallos
+        return {
+            "ruta": self.ruta,
+            "entradas": entradas,
+            "bytes": bytes_totales,
+            "max_bytes": self.max_bytes,
+            "ttl_segundos": self.ttl_segundos,
+            "generacion": self.generacion(),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else None,
+            "guardadas": self.guardadas,
+            "errores": self.errores,
+        }
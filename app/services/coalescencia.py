@@ -0,0 +1,58 @@
+"""
+Coalescencia de trabajos idénticos concurrentes (single-flight)
+Mientras un trabajo con cierta clave está en curso, las demás llamadas con la
+misma clave esperan ese resultado en lugar de repetir el trabajo.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class Coalescedor:
+    """
+    Un trabajo en curso por clave dentro del event loop
+
+    - El trabajo corre en su propia tarea: si el request que lo inició se
+      cancela (el cliente se desconecta), los demás lo siguen esperando
+    - Un error se propaga a todas las llamadas que esperaban y la clave se
+      libera, así la próxima llamada lo reintenta (no queda nada guardado)
+    """
+
+    def __init__(self):
+        self._en_curso: Dict[Hashable, asyncio.Future] = {}
+
+        self.ejecutadas = 0
+        self.coalescidas = 0
+        self.errores = 0
+
+    async def ejecutar(self, clave: Hashable, trabajo: Callable[[], Awaitable[T]]) -> T:
+        """Resultado de trabajo(), compartido con las llamadas concurrentes de la misma clave"""
+        futuro = self._en_curso.get(clave)
+        if futuro is None:
+            self.ejecutadas += 1
+            futuro = asyncio.ensure_future(trabajo())
+            self._en_curso[clave] = futuro
+            futuro.add_done_callback(lambda f: self._terminar(clave, f))
+        else:
+            self.coalescidas += 1
+        # shield: cancelar una de las esperas no cancela el trabajo compartido
+        return await asyncio.shield(futuro)
+
+    def _terminar(self, clave: Hashable, futuro: asyncio.Future) -> None:
+        if self._en_curso.get(clave) is futuro:
+            del self._en_curso[clave]
+        # Leer la excepción evita el aviso de "never retrieved" si nadie la esperaba
+        if not futuro.cancelled() and futuro.exception() is not None:
+            self.errores += 1
+
+    def obtener_estadisticas(self) -> Dict:
+        total = self.ejecutadas + self.coalescidas
+        return {
+            "en_curso": len(self._en_curso),
+            "ejecutadas": self.ejecutadas,
+            "coalescidas": self.coalescidas,
+            "tasa_coalescencia": round(self.coalescidas / total, 4) if total else None,
+            "errores": self.errores,
+        }
@@ -0,0 +1,62 @@
+"""
+Registro interno de una cotización por periodo
+El cálculo, el armado del gráfico y el envío al pool de renderizado usan
+CotizacionCalculada, con los valores numéricos ya redondeados. Los textos de
+CotizacionDetalle (los del esquema público) se generan solo al armar la
+respuesta, con a_periodo().
+"""
+from typing import Dict, List, NamedTuple, Union
+
+
+def formatear_tabla_devolucion(periodo_pago: int, porcentaje_texto: str) -> str:
+    """
+    Construye el mismo texto que json.dumps([60, 70, ..., porcentaje]) sin
+    armar la lista ni pasar por el serializador
+    """
+    if periodo_pago <= 1:
+        return "[60]"
+    return "[" + ", ".join(["60"] + ["70"] * (periodo_pago - 2) + [porcentaje_texto]) + "]"
+
+
+class CotizacionCalculada(NamedTuple):
+    """
+    Cotización de un periodo, redondeada a dos decimales
+
+    porcentaje_devolucion es int cuando el cálculo escalar lo devuelve entero
+    (los límites 110 y 140): así su texto es "140" y no "140.0", igual que antes.
+    """
+    periodo: int
+    porcentaje_devolucion: Union[float, int]
+    trea: float
+    aporte_total: float
+    ganancia_total: float
+    devolucion_total: float
+    rentabilidad: float
+
+    @property
+    def tabla_devolucion(self) -> List[Union[float, int]]:
+        """[60, 70, ..., porcentaje_devolucion], un valor por año de pago"""
+        if self.periodo <= 1:
+            return [60]
+        return [60] + [70] * (self.periodo - 2) + [self.porcentaje_devolucion]
+
+    def a_periodo(self) -> Dict:
+        """
+        Versión del esquema público (CotizacionPorPeriodo, valores como texto)
+
+        Se devuelve como diccionario: validarlo dentro de CotizacionColeccionResponse
+        es más rápido que armar los modelos con model_construct.
+        """
+        porcentaje_texto = str(self.porcentaje_devolucion)
+        return {
+            "periodo": self.periodo,
+            "cotizacion": {
+                "porcentaje_devolucion": porcentaje_texto,
+                "trea": str(self.trea),
+                "aporte_total": str(self.aporte_total),
+                "ganancia_total": str(self.ganancia_total),
+                "devolucion_total": str(self.devolucion_total),
+                "rentabilidad": str(self.rentabilidad),
+                "tabla_devolucion": formatear_tabla_devolucion(self.periodo, porcentaje_texto),
+            }
+        }
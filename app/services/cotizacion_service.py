@@ -4,36 +4,213 @@ Sin dependencia de Excel/LibreOffice
 """
 import os
 import json
-from typing import List, Optional, Dict
+import time
+import asyncio
+from typing import AsyncIterator, Iterator, List, Optional, Dict, Tuple
 from datetime import datetime
 import hashlib
+from pydantic import ValidationError
 from app.schemas.cotizacion import (
     CotizacionCreate, 
     CotizacionResponse,
     CotizacionColeccionRequest,
-    CotizacionColeccionResponse,
-    CotizacionPorPeriodo,
-    CotizacionDetalle
+    CotizacionColeccionResponse
 )
+from app.services.motor_vectorizado import MotorVectorizado, SEXOS
+from app.services.cotizacion_calculada import CotizacionCalculada
+from app.services.tabla_precalculada import TablaPrecalculada
+from app.services.exportacion_columnar import ExportadorSuperficie
+from app.services.periodos_config import RegistroPeriodos
+from app.services.cache_colecciones import CacheColecciones, CacheCompartido
+from app.services.coalescencia import Coalescedor
+from app.services.almacen_cotizaciones import almacen_cotizaciones, AlmacenSaturadoError
+from app.services.metricas import duracion_etapa, medir_etapa, registrar_cache
+from app.services.bitacora import bitacora
 
-# Simulación de base de datos en memoria
-cotizaciones_db: List[CotizacionResponse] = []
-contador_id = 1
+# Carga masiva (NDJSON): líneas procesadas por bloque y largo máximo de una línea
+COTIZACIONES_LOTE_BLOQUE = int(os.getenv("COTIZACIONES_LOTE_BLOQUE", "256"))
+COTIZACIONES_LOTE_MAX_LINEA = int(os.getenv("COTIZACIONES_LOTE_MAX_LINEA", str(64 * 1024)))
 
-# Cache para colecciones de cotizaciones
-_colecciones_cache: Dict[str, 'CotizacionColeccionResponse'] = {}
 
+def _linea_error(numero: int, error: str, detalle: Optional[list] = None) -> str:
+    """Línea NDJSON de error de la carga masiva"""
+    linea = {"linea": numero, "error": error}
+    if detalle is not None:
+        linea["detalle"] = detalle
+    return json.dumps(linea, ensure_ascii=False, default=str)
 
-def _generar_cache_key_coleccion(edad_actuarial: int, sexo: str, prima: float) -> str:
-    """Genera una clave única para el cache de colecciones"""
-    params_str = f"coleccion_{edad_actuarial}_{sexo}_{prima}"
+# Cache acotado (LRU + TTL) para colecciones de cotizaciones
+# El TTL por defecto no supera la vigencia de la URL temporal de la imagen
+_colecciones_cache = CacheColecciones(
+    max_entradas=int(os.getenv("COLECCIONES_CACHE_MAX_ENTRADAS", "1000")),
+    max_bytes=int(os.getenv("COLECCIONES_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    ttl_segundos=float(os.getenv("COLECCIONES_CACHE_TTL", "600"))
+)
+
+# Nivel compartido entre los workers de la máquina (opcional, para uvicorn --workers N)
+_cache_compartido: Optional[CacheCompartido] = None
+if os.getenv("CACHE_COMPARTIDO", "0") == "1":
+    _cache_compartido = CacheCompartido(
+        ruta=os.getenv(
+            "CACHE_COMPARTIDO_RUTA",
+            os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "datos", "cache_colecciones.sqlite3")
+        ),
+        max_bytes=int(os.getenv("CACHE_COMPARTIDO_MAX_BYTES", str(256 * 1024 * 1024))),
+        ttl_segundos=float(os.getenv("COLECCIONES_CACHE_TTL", "600"))
+    )
+# Generación del cache compartido con la que se llenó el cache local
+_generacion_local = 0
+
+# Colecciones que se están armando: los requests idénticos concurrentes esperan la misma
+_coalescedor_colecciones = Coalescedor()
+
+
+def _sincronizar_cache_local() -> None:
+    """Vacía el cache local si otro worker limpió el cache compartido"""
+    global _generacion_local
+    if _cache_compartido is None:
+        return
+    generacion = _cache_compartido.generacion()
+    if generacion != _generacion_local:
+        _colecciones_cache.limpiar()
+        _generacion_local = generacion
+
+
+def _cache_key_request(request: CotizacionColeccionRequest) -> str:
+    return _generar_cache_key_coleccion(
+        request.parametros.edad_actuarial,
+        request.parametros.sexo,
+        request.parametros.prima,
+        _variante_imagen(request)
+    )
+
+
+def _generar_cache_key_coleccion(edad_actuarial: int, sexo: str, prima: float, variante_imagen: Optional[str] = None) -> str:
+    """
+    Genera una clave única para el cache de colecciones
+    
+    Incluye la versión de la configuración de periodos para que una recarga
+    no siga sirviendo colecciones armadas con la configuración anterior, y el
+    renderizador y opciones de imagen si el request los eligió (la imagen es distinta).
+    """
+    params_str = f"coleccion_{edad_actuarial}_{sexo}_{prima}_{_periodos_config.actual().version}"
+    if variante_imagen:
+        params_str += f"_{variante_imagen}"
     return hashlib.md5(params_str.encode()).hexdigest()
 
 
+class ColeccionSerializada:
+    """
+    Colección con su JSON codificado y su ETag, listos para responder
+
+    El cuerpo se codifica una sola vez (la primera vez que se pide) y se
+    reutiliza en cada acierto de cache, sin volver a validar ni serializar el
+    modelo. El ETag combina la clave de cache (parámetros, variante de imagen
+    y versión de la configuración) con un hash del cuerpo: la URL temporal de
+    la imagen cambia cuando se vuelve a subir, y entonces cambia el ETag.
+    """
+    
+    __slots__ = ("response", "clave", "_cuerpo", "_etag")
+    
+    def __init__(self, response: CotizacionColeccionResponse, clave: str, cuerpo: Optional[bytes] = None):
+        self.response = response
+        self.clave = clave
+        self._cuerpo = cuerpo
+        self._etag = None
+    
+    @property
+    def cuerpo(self) -> bytes:
+        if self._cuerpo is None:
+            self._cuerpo = self.response.model_dump_json().encode()
+        return self._cuerpo
+    
+    @property
+    def etag(self) -> str:
+        if self._etag is None:
+            huella = hashlib.blake2b(self.cuerpo, digest_size=8).hexdigest()
+            self._etag = f'"{self.clave[:16]}-{huella}"'
+        return self._etag
+
+
+def _variante_imagen(request: CotizacionColeccionRequest) -> Optional[str]:
+    """Renderizador y opciones de imagen elegidos en el request (None si usa los por defecto)"""
+    partes = []
+    if request.renderizador:
+        partes.append(request.renderizador)
+    if request.imagen is not None:
+        partes.append(request.imagen.model_dump_json())
+    return "_".join(partes) or None
+
+
 # Ruta al archivo de configuración de periodos
 PERIODOS_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
                                     "assets", "configuracion_combinatorias", "periodos_cotizacion.json")
 
+# Configuración de periodos indexada; se recarga sola si el archivo cambia
+_periodos_config = RegistroPeriodos(
+    PERIODOS_CONFIG_PATH,
+    intervalo_revision=float(os.getenv("PERIODOS_CONFIG_INTERVALO_REVISION", "1.0"))
+)
+
+# Rango de edades por defecto para la superficie completa de cotizaciones
+GRILLA_EDAD_MIN = int(os.getenv("GRILLA_EDAD_MIN", "18"))
+GRILLA_EDAD_MAX = int(os.getenv("GRILLA_EDAD_MAX", "65"))
+# Edades que se calculan y envían juntas en la exportación columnar
+EXPORTACION_EDADES_POR_BLOQUE = int(os.getenv("EXPORTACION_EDADES_POR_BLOQUE", "8"))
+
+# Tabla precalculada (opcional): se activa con TABLA_PRECALCULADA=1
+TABLA_PRECALCULADA_HABILITADA = os.getenv("TABLA_PRECALCULADA", "0") == "1"
+TABLA_PRECALCULADA_RUTA = os.getenv("TABLA_PRECALCULADA_RUTA")
+
+_tabla_precalculada: Optional[TablaPrecalculada] = None
+
+
+def cargar_tabla_precalculada(
+    ruta: Optional[str] = TABLA_PRECALCULADA_RUTA,
+    edad_min: int = GRILLA_EDAD_MIN,
+    edad_max: int = GRILLA_EDAD_MAX
+) -> TablaPrecalculada:
+    """
+    Activa la tabla precalculada para crear y crear_cotizacion_coleccion
+    
+    Si se indica una ruta a una tabla prearmada (ver app/cli/construir_tabla.py)
+    se mapea en memoria; si no existe o fue construida con otra configuración de
+    periodos, se construye en memoria a partir de la configuración actual.
+    """
+    global _tabla_precalculada
+    
+    config_actual = _periodos_config.actual()
+    
+    tabla = None
+    if ruta and os.path.exists(ruta):
+        tabla = TablaPrecalculada.cargar(ruta)
+        if tabla.huella_config != config_actual.version:
+            bitacora.advertencia("tabla_precalculada", f"{ruta} no corresponde a la configuración actual, se reconstruye", ruta=ruta)
+            tabla = None
+    
+    if tabla is None:
+        tabla = TablaPrecalculada.construir(config_actual.config, edades=range(edad_min, edad_max + 1), sexos=SEXOS)
+    
+    _tabla_precalculada = tabla
+    bitacora.info(
+        "tabla_precalculada", f"Activa: edades {tabla.edad_min}-{tabla.edad_max}",
+        edad_min=tabla.edad_min, edad_max=tabla.edad_max, bytes=tabla.valores.nbytes
+    )
+    return tabla
+
+
+def _tabla_vigente() -> Optional[TablaPrecalculada]:
+    """
+    La tabla precalculada, reconstruida si la configuración de periodos cambió
+    desde que se armó (None si la tabla no está activa)
+    """
+    tabla = _tabla_precalculada
+    if tabla is None:
+        return None
+    if tabla.huella_config != _periodos_config.actual().version:
+        tabla = cargar_tabla_precalculada(ruta=None, edad_min=tabla.edad_min, edad_max=tabla.edad_max)
+    return tabla
+
 
 class CotizacionService:
     """Servicio para manejar la lógica de negocio de cotizaciones"""
@@ -113,9 +290,10 @@ class CotizacionService:
         trea: float,
         prima: float,
         periodo_pago: int
-    ) -> Dict[str, str]:
+    ) -> Dict[str, float]:
         """
-        Calcula todos los campos necesarios para la cotización
+        Calcula todos los campos necesarios para la cotización, redondeados a
+        dos decimales (el texto del esquema público se arma en CotizacionCalculada)
         """
         # Aporte total = prima * 12 meses * periodo_pago
         aporte_total = prima * 12 * periodo_pago
@@ -130,57 +308,81 @@ class CotizacionService:
         rentabilidad = aporte_total - ganancia_total
         
         return {
-            "porcentaje_devolucion": str(round(porcentaje_devolucion, 2)),
-            "trea": str(round(trea, 2)),
-            "aporte_total": str(round(aporte_total, 2)),
-            "ganancia_total": str(round(ganancia_total, 2)),
-            "devolucion_total": str(round(devolucion_total, 2)),
-            "rentabilidad": str(round(rentabilidad, 2))
+            "porcentaje_devolucion": round(porcentaje_devolucion, 2),
+            "trea": round(trea, 2),
+            "aporte_total": round(aporte_total, 2),
+            "ganancia_total": round(ganancia_total, 2),
+            "devolucion_total": round(devolucion_total, 2),
+            "rentabilidad": round(rentabilidad, 2)
         }
     
     def _cargar_periodos_config(self) -> List[Dict]:
-        """Carga la configuración de periodos desde el archivo JSON"""
-        with open(PERIODOS_CONFIG_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        """Obtiene la configuración de periodos activa (sin leer el archivo en cada llamada)"""
+        return _periodos_config.actual().config
     
     def _obtener_periodos_para_prima(self, prima: float) -> List[int]:
         """Obtiene los periodos disponibles para una prima específica"""
-        config = self._cargar_periodos_config()
-        
-        for item in config:
-            if prima in item["primas"]:
-                return item["periodos"]
-        
-        return []
+        return _periodos_config.actual().periodos_para_prima(prima)
+    
+    def obtener_version_config(self) -> Dict:
+        """Versión de la configuración de periodos activa"""
+        return _periodos_config.obtener_estadisticas()
     
     def crear(self, cotizacion_data: CotizacionCreate) -> CotizacionResponse:
-        """Crear una nueva cotización individual"""
-        global contador_id
-        
-        # Generar porcentaje de devolución
-        porcentaje_devolucion = self._generar_porcentaje_devolucion(
-            periodo=cotizacion_data.parametros.periodo_pago,
-            prima=cotizacion_data.parametros.prima,
-            edad=cotizacion_data.parametros.edad_actuarial,
-            sexo=cotizacion_data.parametros.sexo
-        )
-        
-        # Generar TREA
-        trea = self._generar_trea(porcentaje_devolucion, cotizacion_data.parametros.periodo_pago)
+        """
+        Crear una nueva cotización individual
+
+        Puede bloquear (reserva de IDs en SQLite): desde el event loop se llama
+        en un hilo. AlmacenSaturadoError si el buffer de escritura está lleno.
+        """
+        nueva_cotizacion = self.cotizar(cotizacion_data, almacen_cotizaciones.reservar_ids(1))
+        almacen_cotizaciones.guardar([nueva_cotizacion])
+        return nueva_cotizacion
+    
+    def cotizar(self, cotizacion_data: CotizacionCreate, id_cotizacion: int) -> CotizacionResponse:
+        """Calcula la cotización individual con el ID indicado (sin guardarla ni reservar el ID)"""
+        parametros = cotizacion_data.parametros
+        inicio = time.perf_counter()
+        
+        # Consultar la tabla precalculada si está activa
+        fila = None
+        tabla = _tabla_vigente()
+        if tabla is not None:
+            fila = tabla.buscar(
+                parametros.edad_actuarial, parametros.sexo, parametros.prima, parametros.periodo_pago
+            )
+            registrar_cache("tabla_precalculada", fila is not None)
         
-        # Generar tabla de devolución
-        tabla_devolucion = self._generar_tabla_devolucion(
-            porcentaje_devolucion=porcentaje_devolucion,
-            periodo_pago=cotizacion_data.parametros.periodo_pago
-        )
+        if fila is not None:
+            porcentaje_devolucion, trea, aporte_total, devolucion_total, tabla_devolucion = fila
+        else:
+            # Generar porcentaje de devolución
+            porcentaje_devolucion = self._generar_porcentaje_devolucion(
+                periodo=parametros.periodo_pago,
+                prima=parametros.prima,
+                edad=parametros.edad_actuarial,
+                sexo=parametros.sexo
+            )
+            
+            # Generar TREA
+            trea = self._generar_trea(porcentaje_devolucion, parametros.periodo_pago)
+            
+            # Generar tabla de devolución
+            tabla_devolucion = self._generar_tabla_devolucion(
+                porcentaje_devolucion=porcentaje_devolucion,
+                periodo_pago=parametros.periodo_pago
+            )
+            
+            # Calcular campos adicionales
+            aporte_total = parametros.prima * 12 * parametros.periodo_pago
+            devolucion_total = aporte_total * (porcentaje_devolucion / 100)
         
-        # Calcular campos adicionales
-        aporte_total = cotizacion_data.parametros.prima * 12 * cotizacion_data.parametros.periodo_pago
-        devolucion_total = aporte_total * (porcentaje_devolucion / 100)
+        calculada = time.perf_counter()
+        duracion_etapa.observar(calculada - inicio, "calculo_cotizacion")
         
         # Crear la cotización
-        nueva_cotizacion = CotizacionResponse(
-            id=contador_id,
+        cotizacion = CotizacionResponse(
+            id=id_cotizacion,
             producto=cotizacion_data.producto,
             parametros=cotizacion_data.parametros,
             fecha_creacion=datetime.now(),
@@ -191,11 +393,106 @@ class CotizacionService:
             prima_anual=cotizacion_data.parametros.prima * 12,
             tabla_devolucion=tabla_devolucion
         )
+        duracion_etapa.observar(time.perf_counter() - calculada, "construccion_modelo")
+        return cotizacion
+    
+    def crear_lote(self, lineas: List[Tuple[int, Optional[bytes]]]) -> List[str]:
+        """
+        Crea las cotizaciones de un bloque de líneas NDJSON (CotizacionCreate)
         
-        cotizaciones_db.append(nueva_cotizacion)
-        contador_id += 1
+        Los IDs se reservan en un solo bloque y las cotizaciones se guardan con
+        una sola llamada al almacén. Una línea inválida o que no se puede
+        cotizar produce una línea de error ({"linea", "error", "detalle"}) sin
+        cortar el lote; su ID reservado queda sin usar.
         
-        return nueva_cotizacion
+        Args:
+            lineas: Tuplas (número de línea, contenido); None marca una línea
+                que superó COTIZACIONES_LOTE_MAX_LINEA
+        
+        Returns:
+            Una línea JSON por línea de entrada, en el mismo orden
+        """
+        salida: List[Optional[str]] = [None] * len(lineas)
+        validas = []
+        for posicion, (numero, linea) in enumerate(lineas):
+            if linea is None:
+                salida[posicion] = _linea_error(numero, f"La línea supera {COTIZACIONES_LOTE_MAX_LINEA} bytes")
+                continue
+            try:
+                validas.append((posicion, numero, CotizacionCreate.model_validate_json(linea)))
+            except ValidationError as e:
+                salida[posicion] = _linea_error(
+                    numero, "Cotización inválida", e.errors(include_url=False, include_input=False)
+                )
+        
+        primer_id = almacen_cotizaciones.reservar_ids(len(validas))
+        nuevas = []
+        nuevas_por_linea = []
+        for desplazamiento, (posicion, numero, cotizacion_data) in enumerate(validas):
+            try:
+                nueva_cotizacion = self.cotizar(cotizacion_data, primer_id + desplazamiento)
+            except Exception as e:
+                salida[posicion] = _linea_error(numero, f"No se pudo calcular la cotización: {e}")
+                continue
+            nuevas.append(nueva_cotizacion)
+            nuevas_por_linea.append((posicion, numero, nueva_cotizacion))
+            salida[posicion] = nueva_cotizacion.model_dump_json()
+        
+        try:
+            almacen_cotizaciones.guardar(nuevas)
+        except AlmacenSaturadoError as e:
+            # Las que no entraron al buffer se informan como error de su línea
+            for posicion, numero, nueva_cotizacion in nuevas_por_linea[e.guardadas:]:
+                salida[posicion] = _linea_error(numero, f"No se pudo guardar la cotización {nueva_cotizacion.id}: {e}")
+        return salida
+    
+    async def crear_lote_ndjson(self, contenido: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Procesa un stream NDJSON de CotizacionCreate y va devolviendo las
+        respuestas (NDJSON) por bloques de COTIZACIONES_LOTE_BLOQUE líneas
+        
+        Solo se mantiene en memoria el bloque en curso, sin importar el tamaño
+        de la entrada. Cada bloque se calcula en un hilo para no bloquear el
+        event loop. Las líneas vacías se ignoran (pero cuentan en la numeración).
+        """
+        pendiente = b""
+        bloque: List[Tuple[int, Optional[bytes]]] = []
+        numero = 0
+        descartando = False  # resto de una línea demasiado larga
+        
+        async def procesar() -> bytes:
+            salida = await asyncio.to_thread(self.crear_lote, bloque)
+            return ("\n".join(salida) + "\n").encode()
+        
+        async for fragmento in contenido:
+            pendiente += fragmento
+            *lineas, pendiente = pendiente.split(b"\n")
+            for linea in lineas:
+                if descartando:
+                    descartando = False
+                    continue
+                numero += 1
+                if len(linea) > COTIZACIONES_LOTE_MAX_LINEA:
+                    bloque.append((numero, None))
+                elif linea.strip():
+                    bloque.append((numero, linea))
+                if len(bloque) >= COTIZACIONES_LOTE_BLOQUE:
+                    yield await procesar()
+                    bloque = []
+            if len(pendiente) > COTIZACIONES_LOTE_MAX_LINEA:
+                if not descartando:
+                    numero += 1
+                    bloque.append((numero, None))
+                    descartando = True
+                pendiente = b""
+            if len(bloque) >= COTIZACIONES_LOTE_BLOQUE:
+                yield await procesar()
+                bloque = []
+        
+        if pendiente.strip() and not descartando:
+            bloque.append((numero + 1, pendiente))
+        if bloque:
+            yield await procesar()
     
     def crear_cotizacion_coleccion(
         self,
@@ -205,30 +502,186 @@ class CotizacionService:
     ) -> CotizacionColeccionResponse:
         """
         Crea cotizaciones para todos los periodos disponibles de una prima específica
-        """
-        global _colecciones_cache
         
+        La imagen se genera en el mismo hilo; desde la API usar
+        crear_cotizacion_coleccion_async, que la delega al pool de renderizado.
+        """
         # Verificar cache primero
         if usar_cache:
-            cache_key = _generar_cache_key_coleccion(request.parametros.edad_actuarial, request.parametros.sexo, request.parametros.prima)
-            if cache_key in _colecciones_cache:
-                print(f"[CACHE COLECCIÓN] Encontrado: prima={request.parametros.prima}, edad={request.parametros.edad_actuarial}, sexo={request.parametros.sexo}")
-                return _colecciones_cache[cache_key]
+            en_cache = self._buscar_coleccion_en_cache(request)
+            if en_cache is not None:
+                return en_cache.response
         
-        # Obtener periodos disponibles para la prima
-        periodos_disponibles = self._obtener_periodos_para_prima(request.parametros.prima)
+        periodos_disponibles, cotizaciones = self._calcular_coleccion(request)
         
         if not periodos_disponibles:
-            return CotizacionColeccionResponse(
-                prima=request.parametros.prima,
-                periodos_disponibles=[],
-                cotizaciones=[],
-                total_cotizaciones=0,
-                imagen_base64=None
+            return self._armar_respuesta_coleccion(request, [], [], None, usar_cache=False).response
+        
+        # Generar imagen si se solicita
+        imagen_url = None
+        miniatura_url = None
+        if generar_imagen and cotizaciones:
+            try:
+                from app.services.image_service import ImageService
+                image_service = ImageService()
+                
+                data = self._datos_grafico(request, periodos_disponibles, cotizaciones)
+                imagen = image_service.generar_imagen(data, renderizador=request.renderizador, opciones=request.imagen)
+                imagen_url = image_service.subir_o_reutilizar(imagen.ruta)
+                if imagen.miniatura is not None:
+                    miniatura_url = image_service.subir_o_reutilizar(imagen.miniatura.ruta)
+            except Exception as e:
+                bitacora.error("imagen_no_generada", f"No se pudo generar la imagen: {e}", excepcion=e)
+        
+        # Una colección sin la imagen pedida no se guarda en cache
+        guardar = usar_cache and (imagen_url is not None or not generar_imagen)
+        return self._armar_respuesta_coleccion(
+            request, periodos_disponibles, cotizaciones, imagen_url, guardar, miniatura_url=miniatura_url
+        ).response
+    
+    async def crear_cotizacion_coleccion_async(
+        self,
+        request: CotizacionColeccionRequest,
+        generar_imagen: bool = True,
+        usar_cache: bool = True
+    ) -> CotizacionColeccionResponse:
+        """
+        Igual que crear_cotizacion_coleccion, pero la imagen se genera en el pool
+        de procesos de renderizado y se espera sin bloquear el event loop
+        
+        Los requests idénticos que llegan mientras una colección se está
+        armando (misma clave de cache) esperan ese mismo resultado en lugar de
+        calcular, renderizar y subir la imagen otra vez.
+        """
+        coleccion = await self.crear_cotizacion_coleccion_serializada_async(request, generar_imagen, usar_cache)
+        return coleccion.response
+    
+    async def crear_cotizacion_coleccion_serializada_async(
+        self,
+        request: CotizacionColeccionRequest,
+        generar_imagen: bool = True,
+        usar_cache: bool = True
+    ) -> ColeccionSerializada:
+        """
+        Igual que crear_cotizacion_coleccion_async, con el JSON ya codificado y
+        el ETag de la respuesta (un acierto de cache no vuelve a serializar)
+        """
+        if usar_cache:
+            en_cache = self._buscar_coleccion_en_cache(request)
+            if en_cache is not None:
+                return en_cache
+        
+        clave = (_cache_key_request(request), generar_imagen, usar_cache)
+        return await _coalescedor_colecciones.ejecutar(
+            clave, lambda: self._armar_coleccion_async(request, generar_imagen, usar_cache)
+        )
+    
+    async def _armar_coleccion_async(
+        self,
+        request: CotizacionColeccionRequest,
+        generar_imagen: bool,
+        usar_cache: bool
+    ) -> ColeccionSerializada:
+        """Calcula la colección, renderiza en el pool y sube la imagen (sin consultar el cache)"""
+        from app.services.ejecutor_render import ejecutor_render
+        
+        periodos_disponibles, cotizaciones = self._calcular_coleccion(request)
+        
+        if not periodos_disponibles:
+            return self._armar_respuesta_coleccion(request, [], [], None, usar_cache=False)
+        
+        if not (generar_imagen and cotizaciones):
+            return self._armar_respuesta_coleccion(request, periodos_disponibles, cotizaciones, None, usar_cache)
+        
+        # El worker solo renderiza; la subida se hace aquí con el cliente HTTP async compartido
+        imagen = None
+        try:
+            data = self._datos_grafico(request, periodos_disponibles, cotizaciones)
+            imagen = await ejecutor_render.renderizar(data=data, renderizador=request.renderizador, opciones=request.imagen)
+        except Exception as e:
+            bitacora.error("imagen_no_generada", f"No se pudo generar la imagen: {e}", excepcion=e)
+        
+        if imagen is None:
+            return self._armar_respuesta_coleccion(request, periodos_disponibles, cotizaciones, None, usar_cache=False)
+        
+        # La miniatura solo se sube si el request la pidió en sus opciones de imagen
+        subidas = [self._subir_imagen(imagen.ruta)]
+        if imagen.miniatura is not None:
+            subidas.append(self._subir_imagen(imagen.miniatura.ruta))
+        
+        urls = await asyncio.gather(*subidas)
+        guardar = usar_cache and urls[0] is not None
+        return self._armar_respuesta_coleccion(
+            request, periodos_disponibles, cotizaciones, urls[0], guardar,
+            miniatura_url=urls[1] if len(urls) > 1 else None
+        )
+    
+    async def _subir_imagen(self, ruta_archivo: str) -> Optional[str]:
+        """Sube la imagen o reutiliza la URL vigente (mismo archivo en el almacén)"""
+        from app.services.subida_imagenes import cliente_subida
+        from app.services.almacen_imagenes import almacen_imagenes
+        
+        imagen_url = almacen_imagenes.url_vigente(ruta_archivo)
+        if imagen_url is None:
+            imagen_url = await cliente_subida.subir(ruta_archivo)
+            almacen_imagenes.registrar_url(ruta_archivo, imagen_url)
+        return imagen_url
+    
+    def _buscar_coleccion_en_cache(self, request: CotizacionColeccionRequest) -> Optional[ColeccionSerializada]:
+        """Busca la colección en cache"""
+        cache_key = _cache_key_request(request)
+        _sincronizar_cache_local()
+        en_cache = _colecciones_cache.obtener(cache_key)
+        registrar_cache("colecciones", en_cache is not None)
+        if en_cache is None and _cache_compartido is not None:
+            compartida = _cache_compartido.obtener(cache_key)
+            registrar_cache("colecciones_compartido", compartida is not None)
+            if compartida is not None:
+                # Calculada por otro worker: queda también en el cache local, solo
+                # por lo que le quedaba de vigencia en el compartido
+                serializada, vigencia = compartida
+                en_cache = ColeccionSerializada(
+                    CotizacionColeccionResponse.model_validate_json(serializada), cache_key, serializada.encode()
+                )
+                _colecciones_cache.guardar(
+                    cache_key, en_cache, bytes_estimados=len(en_cache.cuerpo), ttl_segundos=vigencia
+                )
+        # Con BITACORA_NIVEL=DEBUG; muestreado (ver BITACORA_MUESTREO)
+        bitacora.debug(
+            "cache_coleccion",
+            resultado="acierto" if en_cache is not None else "fallo",
+            prima=request.parametros.prima,
+            edad=request.parametros.edad_actuarial,
+            sexo=request.parametros.sexo
+        )
+        return en_cache
+    
+    def _calcular_coleccion(self, request: CotizacionColeccionRequest) -> Tuple[List[int], List[CotizacionCalculada]]:
+        """
+        Calcula las cotizaciones de todos los periodos disponibles para la prima
+        
+        Returns:
+            Tupla (periodos_disponibles, cotizaciones); ambas vacías si la prima
+            no está configurada
+        """
+        # Consultar la tabla precalculada si está activa
+        tabla = _tabla_vigente()
+        if tabla is not None:
+            filas = tabla.buscar_coleccion(
+                request.parametros.edad_actuarial, request.parametros.sexo, request.parametros.prima
             )
+            registrar_cache("tabla_precalculada", filas is not None)
+            if filas is not None:
+                return [cotizacion.periodo for cotizacion in filas], filas
+        
+        # Obtener periodos disponibles para la prima
+        with medir_etapa("consulta_config"):
+            periodos_disponibles = self._obtener_periodos_para_prima(request.parametros.prima)
         
-        # Generar cotizaciones para cada periodo
+        # Generar cotizaciones para cada periodo (los modelos Pydantic se
+        # construyen recién al armar la respuesta)
         cotizaciones = []
+        inicio = time.perf_counter()
         
         for periodo in periodos_disponibles:
             # Generar porcentaje de devolución (incremental con el periodo)
@@ -250,84 +703,190 @@ class CotizacionService:
                 periodo_pago=periodo
             )
             
-            # Generar tabla de devolución
-            tabla_devolucion = self._generar_tabla_devolucion(
-                porcentaje_devolucion=porcentaje_devolucion,
-                periodo_pago=periodo
-            )
-            
-            # Crear detalle de cotización
-            cotizacion_detalle = CotizacionDetalle(
-                porcentaje_devolucion=campos["porcentaje_devolucion"],
-                trea=campos["trea"],
-                aporte_total=campos["aporte_total"],
-                ganancia_total=campos["ganancia_total"],
-                devolucion_total=campos["devolucion_total"],
-                rentabilidad=campos["rentabilidad"],
-                tabla_devolucion=tabla_devolucion
-            )
-            
-            cotizaciones.append(CotizacionPorPeriodo(
-                periodo=periodo,
-                cotizacion=cotizacion_detalle
+            # La tabla de devolución se deriva del periodo y el porcentaje
+            cotizaciones.append(CotizacionCalculada(
+                periodo,
+                campos["porcentaje_devolucion"],
+                campos["trea"],
+                campos["aporte_total"],
+                campos["ganancia_total"],
+                campos["devolucion_total"],
+                campos["rentabilidad"]
             ))
         
-        # Generar imagen si se solicita
-        imagen_base64 = None
-        if generar_imagen and cotizaciones:
-            try:
-                from app.services.image_service import ImageService
-                image_service = ImageService()
-                
-                data = {
-                    "prima": request.parametros.prima,
-                    "periodos_disponibles": periodos_disponibles,
-                    "cotizaciones": [
-                        {
-                            "periodo": cot.periodo,
-                            "cotizacion": cot.cotizacion.model_dump()
-                        }
-                        for cot in cotizaciones
-                    ]
-                }
-                
-                _, imagen_url = image_service.generar_grafico_cotizacion(
-                    data=data,
-                    nombre_archivo=f"cotizacion_prima{int(request.parametros.prima)}_edad{request.parametros.edad_actuarial}_{request.parametros.sexo}",
-                    subir_temporal=True
-                )
-            except Exception as e:
-                import traceback
-                print(f"[ERROR] No se pudo generar la imagen: {str(e)}")
-                traceback.print_exc()
+        duracion_etapa.observar(time.perf_counter() - inicio, "calculo_cotizacion")
+        return periodos_disponibles, cotizaciones
+    
+    def _datos_grafico(
+        self,
+        request: CotizacionColeccionRequest,
+        periodos_disponibles: List[int],
+        cotizaciones: List[CotizacionCalculada]
+    ) -> Dict:
+        """
+        Arma la entrada de ImageService.generar_grafico_cotizacion
+
+        Las cotizaciones van como CotizacionCalculada, sin pasar a texto (así
+        también viajan al pool de renderizado).
+        """
+        return {
+            "prima": request.parametros.prima,
+            "periodos_disponibles": periodos_disponibles,
+            "cotizaciones": cotizaciones
+        }
+    
+    def datos_grafico_coleccion(self, request: CotizacionColeccionRequest) -> Optional[Dict]:
+        """
+        Calcula la colección y arma la entrada del gráfico para generar la imagen
+        por separado (sin imagen embebida ni cache de colecciones)
         
-        response = CotizacionColeccionResponse(
-            prima=request.parametros.prima,
-            periodos_disponibles=periodos_disponibles,
-            cotizaciones=cotizaciones,
-            total_cotizaciones=len(cotizaciones),
-            imagen_base64=imagen_url  # Ahora contiene la URL temporal
-        )
+        Args:
+            request: Parámetros de la colección
+        
+        Returns:
+            Entrada de ImageService.generar_grafico_cotizacion o None si la prima
+            no tiene periodos configurados
+        """
+        periodos_disponibles, cotizaciones = self._calcular_coleccion(request)
+        if not cotizaciones:
+            return None
+        return self._datos_grafico(request, periodos_disponibles, cotizaciones)
+    
+    def coleccion_con_datos_grafico(
+        self,
+        request: CotizacionColeccionRequest
+    ) -> Tuple[CotizacionColeccionResponse, Optional[Dict]]:
+        """
+        Respuesta de la colección (sin imagen ni cache) y entrada del gráfico,
+        a partir de un solo cálculo
+        
+        Returns:
+            Tupla (respuesta, datos del gráfico); los datos son None si la prima
+            no tiene periodos configurados
+        """
+        periodos_disponibles, cotizaciones = self._calcular_coleccion(request)
+        respuesta = self._armar_respuesta_coleccion(
+            request, periodos_disponibles, cotizaciones, None, usar_cache=False
+        ).response
+        if not cotizaciones:
+            return respuesta, None
+        return respuesta, self._datos_grafico(request, periodos_disponibles, cotizaciones)
+    
+    def _armar_respuesta_coleccion(
+        self,
+        request: CotizacionColeccionRequest,
+        periodos_disponibles: List[int],
+        cotizaciones: List[CotizacionCalculada],
+        imagen_url: Optional[str],
+        usar_cache: bool,
+        miniatura_url: Optional[str] = None
+    ) -> ColeccionSerializada:
+        """Arma la respuesta de la colección (aquí se pasa al esquema público) y la guarda en cache"""
+        with medir_etapa("construccion_modelo"):
+            response = CotizacionColeccionResponse(
+                prima=request.parametros.prima,
+                periodos_disponibles=periodos_disponibles,
+                cotizaciones=[cotizacion.a_periodo() for cotizacion in cotizaciones],
+                total_cotizaciones=len(cotizaciones),
+                imagen_base64=imagen_url,  # Ahora contiene la URL temporal
+                miniatura_url=miniatura_url
+            )
+        
+        coleccion = ColeccionSerializada(response, _cache_key_request(request))
         
         # Guardar en cache
         if usar_cache:
-            cache_key = _generar_cache_key_coleccion(request.parametros.edad_actuarial, request.parametros.sexo, request.parametros.prima)
-            _colecciones_cache[cache_key] = response
-            print(f"[CACHE COLECCIÓN] Guardado: prima={request.parametros.prima}, edad={request.parametros.edad_actuarial}, sexo={request.parametros.sexo}")
+            self._guardar_coleccion_en_cache(coleccion)
+        
+        return coleccion
+    
+    def _guardar_coleccion_en_cache(self, coleccion: ColeccionSerializada) -> None:
+        """Guarda la colección en cache (se codifica aquí; el acierto reutiliza el cuerpo)"""
+        # El tamaño serializado sirve como estimación de la memoria que ocupa
+        _sincronizar_cache_local()
+        _colecciones_cache.guardar(coleccion.clave, coleccion, bytes_estimados=len(coleccion.cuerpo))
+        if _cache_compartido is not None:
+            _cache_compartido.guardar(coleccion.clave, coleccion.cuerpo.decode())
+    
+    def generar_grilla(
+        self,
+        edad_min: int = GRILLA_EDAD_MIN,
+        edad_max: int = GRILLA_EDAD_MAX
+    ) -> Dict[str, list]:
+        """
+        Genera la superficie completa de cotizaciones (edad × sexo × prima × periodo)
+        usando el motor vectorizado, en una sola pasada y sin construir un modelo
+        Pydantic por cotización
+        
+        Returns:
+            Columnas con la forma de CotizacionGridResponse
+        """
+        superficie = MotorVectorizado().generar_superficie(
+            config=self._cargar_periodos_config(),
+            edades=range(edad_min, edad_max + 1),
+            sexos=SEXOS
+        )
         
-        return response
+        columnas = {nombre: valores.tolist() for nombre, valores in superficie.items()}
+        return {"total_cotizaciones": len(columnas["prima"]), **columnas}
+    
+    def exportar_superficie(
+        self,
+        edad_min: int = GRILLA_EDAD_MIN,
+        edad_max: int = GRILLA_EDAD_MAX,
+        edades_por_bloque: int = EXPORTACION_EDADES_POR_BLOQUE
+    ) -> Tuple[ExportadorSuperficie, Iterator[bytes]]:
+        """
+        Superficie completa en formato binario columnar (ver exportacion_columnar)
+        
+        Returns:
+            El exportador (encabezado y total de filas) y el iterador de bytes,
+            que calcula cada bloque de edades recién cuando se le pide
+        """
+        config = _periodos_config.actual()
+        exportador = ExportadorSuperficie(
+            config.config,
+            edades=range(edad_min, edad_max + 1),
+            sexos=SEXOS,
+            edades_por_bloque=edades_por_bloque,
+            huella_config=config.version
+        )
+        
+        def bloques() -> Iterator[bytes]:
+            inicio = time.perf_counter()
+            total = 0
+            for bloque in exportador.bloques():
+                total += len(bloque)
+                yield bloque
+            segundos = time.perf_counter() - inicio
+            bitacora.info(
+                "exportacion_superficie",
+                f"{exportador.total_filas} cotizaciones, {total} bytes en {segundos:.3f} s",
+                filas=exportador.total_filas, bytes=total, segundos=round(segundos, 3)
+            )
+        
+        return exportador, bloques()
     
     def limpiar_cache_colecciones(self) -> int:
-        """Limpia el cache de colecciones"""
-        global _colecciones_cache
-        cantidad = len(_colecciones_cache)
-        _colecciones_cache.clear()
-        print(f"[CACHE COLECCIÓN] Cache limpiado: {cantidad} elementos")
+        """
+        Limpia el cache de colecciones
+        
+        Con el cache compartido se limpia también ese nivel y los demás
+        workers vacían su cache local en su próxima consulta.
+        """
+        cantidad = _colecciones_cache.limpiar()
+        if _cache_compartido is not None:
+            cantidad = max(cantidad, _cache_compartido.limpiar())
+        bitacora.info("cache_limpiado", f"Cache limpiado: {cantidad} elementos", elementos=cantidad)
         return cantidad
     
     def obtener_estadisticas_cache(self) -> Dict:
         """Obtiene estadísticas del cache"""
         return {
-            "cache_colecciones": len(_colecciones_cache)
+            "cache_colecciones": _colecciones_cache.obtener_estadisticas(),
+            "cache_compartido": _cache_compartido.obtener_estadisticas() if _cache_compartido is not None else None,
+            "coalescencia_colecciones": _coalescedor_colecciones.obtener_estadisticas(),
+            "config_periodos": _periodos_config.obtener_estadisticas(),
+            "tabla_precalculada": _tabla_precalculada.obtener_estadisticas() if _tabla_precalculada is not None else None
         }
 
@@ -0,0 +1,79 @@
+"""
+Datos y estilo comunes del gráfico de cotizaciones
+Todos los renderizadores dibujan lo mismo: una línea por periodo con su
+tabla de devolución y una tabla resumen de cinco columnas
+"""
+import json
+from typing import Dict, List, NamedTuple
+
+from app.services.cotizacion_calculada import CotizacionCalculada
+
+
+COLORES = ['#FF6B35', '#004E89', '#1B998B']  # Colores modernos
+COLUMNAS = ["Años de pago", "Aporte Total", "Devolución", "Ganancia total", "% devolución"]
+ANCHOS_COLUMNAS = [0.15, 0.22, 0.22, 0.22, 0.15]
+COLOR_ENCABEZADO = '#004E89'
+COLORES_FILAS = ('#FFFFFF', '#F0F0F0')  # filas impares / pares
+
+# Layout fijo de los renderizadores "plantilla" y "rapido" (pulgadas y
+# fracción de la figura, origen abajo a la izquierda como en matplotlib):
+# gráfico arriba, tabla abajo
+TAMANO_FIGURA = (10.1, 8.35)
+POSICION_GRAFICO = (0.075, 0.42, 0.91, 0.52)
+POSICION_TABLA = (0.02, 0.02, 0.96, 0.28)
+
+
+class Serie(NamedTuple):
+    """Línea del gráfico para un periodo"""
+    etiqueta: str
+    años: List[int]
+    valores: List[float]
+
+
+class DatosGrafico(NamedTuple):
+    """Todo lo que cambia entre un gráfico y otro"""
+    titulo: str
+    series: List[Serie]
+    filas: List[List[str]]
+
+
+def formatear_numero(num: float) -> str:
+    """Formatea un número con separador de miles (espacio) y dos decimales"""
+    return f"{num:,.2f}".replace(",", " ")
+
+
+def preparar_datos_grafico(data: Dict) -> DatosGrafico:
+    """
+    Extrae título, series y filas de la tabla a partir de la estructura de
+    cotización por colección
+
+    Args:
+        data: Diccionario con prima y cotizaciones: CotizacionCalculada (lo que
+            arma CotizacionService) o diccionarios con el formato de
+            CotizacionColeccionResponse (p. ej. response.model_dump())
+    """
+    series = []
+    filas = []
+    for cotizacion in data["cotizaciones"]:
+        if isinstance(cotizacion, CotizacionCalculada):
+            periodo = cotizacion.periodo
+            tabla_dev = cotizacion.tabla_devolucion
+            aporte, devolucion, ganancia = cotizacion.aporte_total, cotizacion.devolucion_total, cotizacion.ganancia_total
+            porcentaje = cotizacion.porcentaje_devolucion
+        else:
+            periodo = cotizacion["periodo"]
+            cot = cotizacion["cotizacion"]
+            tabla_dev = json.loads(cot["tabla_devolucion"])
+            aporte, devolucion, ganancia = float(cot["aporte_total"]), float(cot["devolucion_total"]), float(cot["ganancia_total"])
+            porcentaje = cot["porcentaje_devolucion"]
+        series.append(Serie(f"{periodo} años", list(range(1, len(tabla_dev) + 1)), tabla_dev))
+        filas.append([
+            str(periodo),
+            f"S/ {formatear_numero(aporte)}",
+            f"S/ {formatear_numero(devolucion)}",
+            f"S/ {formatear_numero(ganancia)}",
+            f"{porcentaje}%"
+        ])
+
+    titulo = f"Evolución de devolución por periodo para una prima de S/ {data['prima']:.0f} mensual"
+    return DatosGrafico(titulo, series, filas)
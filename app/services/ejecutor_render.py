@@ -0,0 +1,310 @@
+"""
+Ejecutor de renderizado de imágenes en procesos separados
+Los gráficos de matplotlib consumen segundos de CPU; correrlos en un pool
+de procesos precalentados evita bloquear el event loop de la API. Con
+IMAGE_RENDERER=rapido los workers no cargan matplotlib (solo Pillow).
+"""
+import os
+import time
+import asyncio
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+from app.schemas.cotizacion import OpcionesImagen
+from app.services import metricas
+from app.services.bitacora import bitacora
+from app.services.limpieza_imagenes import limpiador_imagenes
+from app.services.perfilado import perfilar, ruta_perfil_render
+from app.services.image_service import ImageService, ImagenGenerada, IMAGE_RENDERER
+
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_COLA_MAX = int(os.getenv("RENDER_COLA_MAX", "8"))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "30"))
+# Si es 1, la API no atiende requests hasta que el pool está precalentado
+RENDER_INICIO_BLOQUEANTE = os.getenv("RENDER_INICIO_BLOQUEANTE", "0") == "1"
+
+
+class RenderSaturadoError(Exception):
+    """No hay lugar en la cola de renderizado"""
+
+
+class RenderTimeoutError(Exception):
+    """El renderizado superó el tiempo máximo permitido"""
+
+
+class RenderCaidoError(Exception):
+    """Un proceso del pool murió (OOM, segfault); el pool se está recreando"""
+
+
+# Estado propio de cada proceso worker
+_image_service = None
+
+
+def _inicializar_worker() -> None:
+    """
+    Precalienta el proceso worker: importa matplotlib, fija el backend Agg y
+    carga el cache de fuentes para que el primer gráfico no pague ese costo
+
+    Si el renderizador por defecto es "rapido" solo se cargan las fuentes de
+    Pillow; matplotlib se importará en el worker si algún request lo pide.
+    """
+    global _image_service
+    _image_service = ImageService()
+
+    if IMAGE_RENDERER == "rapido":
+        from app.services.render_rapido import precargar_fuentes
+        precargar_fuentes()
+        return
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401
+    from matplotlib import font_manager
+    for peso in ("normal", "bold"):
+        font_manager.findfont(font_manager.FontProperties(family=matplotlib.rcParams["font.family"], weight=peso))
+
+
+def _precalentar() -> int:
+    """Tarea breve usada para levantar todos los procesos del pool al iniciar"""
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def _renderizar(
+    data: Dict,
+    nombre_archivo: Optional[str],
+    renderizador: Optional[str],
+    opciones: Optional[OpcionesImagen],
+    perfil: Optional[str] = None
+) -> Tuple[ImagenGenerada, Dict]:
+    """
+    Genera el gráfico dentro del proceso worker
+
+    Args:
+        perfil: Si el request se está perfilando, ruta donde guardar el perfil del render
+
+    Returns:
+        Tupla (imagen, métricas observadas en el worker desde el último render)
+    """
+    with perfilar(perfil) if perfil is not None else nullcontext():
+        imagen = _image_service.generar_imagen(
+            data=data,
+            nombre_archivo=nombre_archivo,
+            renderizador=renderizador,
+            opciones=opciones
+        )
+    return imagen, metricas.registro.extraer()
+
+
+class EjecutorRender:
+    """
+    Pool de procesos para generar imágenes sin bloquear el event loop
+
+    - workers: procesos que renderizan en paralelo
+    - cola_max: renders que pueden esperar turno; más allá se rechaza con
+      RenderSaturadoError en lugar de acumular trabajo
+    - timeout: segundos máximos de espera por un render (RenderTimeoutError).
+      Un proceso no se puede interrumpir a mitad de un render, así que el
+      trabajo sigue ocupando su lugar en la cola hasta terminar.
+
+    Si un worker muere, el pool queda inutilizable (BrokenProcessPool): se
+    descarta, los renders afectados fallan con RenderCaidoError y se crea y
+    precalienta un pool nuevo en segundo plano. Mientras tanto listo es False.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS, cola_max: int = RENDER_COLA_MAX, timeout: float = RENDER_TIMEOUT):
+        self.workers = max(1, workers)
+        self.cola_max = max(0, cola_max)
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pendientes = 0
+        self._inicio: Optional[asyncio.Task] = None
+        self.listo = False
+        self.roto = False
+        # Solo para consultar el almacén desde el proceso principal
+        self._image_service = ImageService()
+
+        self.completados = 0
+        self.rechazados = 0
+        self.vencidos = 0
+        self.fallidos = 0
+        self.reutilizados = 0
+        self.reinicios = 0
+
+    def _crear_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: no heredar hilos ni sockets del servidor en los workers
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_inicializar_worker
+            )
+        return self._pool
+
+    async def iniciar(self, espera_max: float = 60.0) -> None:
+        """
+        Crea el pool y espera a que todos los procesos worker estén inicializados
+
+        Los procesos se crean bajo demanda y el primero puede tomar todas las
+        tareas mientras los demás se inicializan, así que se envían rondas
+        hasta que respondan todos (o se agote espera_max).
+        """
+        pool = self._crear_pool()
+        loop = asyncio.get_running_loop()
+        inicio = time.monotonic()
+        limite = inicio + espera_max
+        pids = set()
+        while len(pids) < self.workers and time.monotonic() < limite:
+            pids.update(await asyncio.gather(*[
+                loop.run_in_executor(pool, _precalentar) for _ in range(self.workers)
+            ]))
+        self.listo = True
+        self.roto = False
+        bitacora.info(
+            "pool_render",
+            f"Pool iniciado: {len(pids)} procesos en {time.monotonic() - inicio:.2f} s, cola máxima {self.cola_max}",
+            procesos=len(pids), cola_max=self.cola_max
+        )
+
+    def iniciar_en_segundo_plano(self) -> asyncio.Task:
+        """
+        Precalienta el pool sin demorar el arranque de la API
+
+        Los requests que no generan imágenes se atienden de inmediato; un
+        render pedido antes de que termine espera a que su worker se inicialice.
+        """
+        if self._inicio is None:
+            self._inicio = asyncio.get_running_loop().create_task(self.iniciar())
+        return self._inicio
+
+    @property
+    def ocupado(self) -> bool:
+        """Hay renders en curso o esperando turno"""
+        return self._pendientes > 0
+
+    def detener(self) -> None:
+        """Detiene el pool descartando los renders en espera"""
+        if self._inicio is not None:
+            self._inicio.cancel()
+            self._inicio = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _descartar_pool_roto(self, pool: ProcessPoolExecutor) -> None:
+        """Descarta el pool roto (una sola vez aunque fallen varios renders) y lo recrea en segundo plano"""
+        if self._pool is not pool:
+            return
+        pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        self.listo = False
+        self.roto = True
+        self.reinicios += 1
+        bitacora.error("pool_render_roto", "Un worker de renderizado murió; se recrea el pool", reinicios=self.reinicios)
+        if self._inicio is not None:
+            self._inicio.cancel()
+        self._inicio = None
+        self.iniciar_en_segundo_plano()
+
+    def _al_terminar(self, loop: asyncio.AbstractEventLoop, futuro) -> None:
+        # El callback corre en un hilo del pool; el contador se actualiza en el loop
+        try:
+            loop.call_soon_threadsafe(self._liberar, futuro)
+        except RuntimeError:
+            # El loop ya se cerró (apagado del servidor)
+            pass
+
+    def _liberar(self, futuro) -> None:
+        self._pendientes -= 1
+        if futuro.cancelled():
+            return
+        if futuro.exception() is not None:
+            self.fallidos += 1
+        else:
+            self.completados += 1
+
+    async def renderizar(
+        self,
+        data: Dict,
+        nombre_archivo: Optional[str] = None,
+        renderizador: Optional[str] = None,
+        opciones: Optional[OpcionesImagen] = None
+    ) -> ImagenGenerada:
+        """
+        Genera el gráfico en el pool y espera el resultado sin bloquear el event loop
+
+        Si la imagen (y su miniatura) ya está en el almacén por contenido y no
+        hay que publicarla con otro nombre, se responde sin pasar por el pool.
+
+        Returns:
+            ImagenGenerada, igual que ImageService.generar_imagen
+        """
+        if not nombre_archivo:
+            imagen = self._image_service.buscar_imagen(data, renderizador, opciones)
+            if imagen is not None:
+                self.reutilizados += 1
+                return imagen
+
+        if self._pendientes >= self.workers + self.cola_max:
+            self.rechazados += 1
+            raise RenderSaturadoError(f"Cola de renderizado llena ({self._pendientes} pendientes)")
+
+        pool = self._crear_pool()
+        try:
+            futuro = pool.submit(_renderizar, data, nombre_archivo, renderizador, opciones, ruta_perfil_render())
+        except BrokenProcessPool:
+            # No llegó a encolarse, así que _liberar no lo cuenta
+            self.fallidos += 1
+            self._descartar_pool_roto(pool)
+            raise RenderCaidoError("El pool de renderizado se está reiniciando")
+        self._pendientes += 1
+        loop = asyncio.get_running_loop()
+        futuro.add_done_callback(lambda f: self._al_terminar(loop, f))
+
+        try:
+            imagen, observaciones = await asyncio.wait_for(asyncio.wrap_future(futuro), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.vencidos += 1
+            raise RenderTimeoutError(f"El renderizado superó {self.timeout} s")
+        except BrokenProcessPool:
+            # _liberar ya lo contó como fallido
+            self._descartar_pool_roto(pool)
+            raise RenderCaidoError("Un proceso de renderizado murió durante el render; reintentar")
+        # Las etapas del render (figura, savefig, disco, subida) se midieron en el worker
+        metricas.registro.combinar(observaciones)
+        # Los archivos que escribió el worker entran al índice de la limpieza de este proceso
+        limpiador_imagenes.registrar(imagen.ruta)
+        if imagen.miniatura is not None:
+            limpiador_imagenes.registrar(imagen.miniatura.ruta)
+        return imagen
+
+    def obtener_estadisticas(self) -> Dict:
+        """Estado del pool de renderizado"""
+        return {
+            "workers": self.workers,
+            "listo": self.listo,
+            "roto": self.roto,
+            "reinicios": self.reinicios,
+            "cola_max": self.cola_max,
+            "timeout_segundos": self.timeout,
+            "pendientes": self._pendientes,
+            "completados": self.completados,
+            "fallidos": self.fallidos,
+            "rechazados": self.rechazados,
+            "vencidos": self.vencidos,
+            "reutilizados": self.reutilizados,
+        }
+
+
+# Instancia compartida por la aplicación (se inicia en el lifespan de app.main)
+ejecutor_render = EjecutorRender()
+
+metricas.registro.registrar(metricas.GaugeFuncion(
+    "rumbia_render_pendientes",
+    "Renders en curso o esperando turno en el pool",
+    lambda: ejecutor_render._pendientes
+))
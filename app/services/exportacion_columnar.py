@@ -0,0 +1,177 @@
+"""
+Exportación binaria columnar de la superficie de cotizaciones
+La superficie completa (edad × sexo × prima × periodo) se genera con el motor
+vectorizado por bloques (grupo de la configuración × rango de edades) y se
+escribe a medida que se calcula, sin armar el archivo entero en memoria ni
+convertir los números a texto.
+
+Formato (todo en little-endian):
+    b"RCOL"                     firma
+    uint32                      largo del encabezado
+    encabezado                  JSON UTF-8: version, columnas (nombre, tipo NumPy,
+                                forma por fila), diccionarios, total_filas, ...
+    bloques                     uint32 filas, y a continuación cada columna en el
+                                orden del encabezado (filas × forma valores contiguos)
+    uint32 0                    fin del archivo
+
+El texto de sexo se guarda como código uint8 (ver diccionarios["sexo"]) y
+tabla_devolucion como un arreglo de ancho fijo (el periodo máximo de la
+configuración) relleno con NaN después del periodo de cada fila.
+"""
+import json
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Sequence
+
+import numpy as np
+
+from app.services.motor_vectorizado import MotorVectorizado, SEXOS
+
+
+FIRMA = b"RCOL"
+VERSION_FORMATO = 1
+TIPO_MEDIO = "application/vnd.rumbia.columnar"
+
+# Nombre y tipo NumPy de cada columna, en el orden en que se escriben
+COLUMNAS = (
+    ("edad_actuarial", "<u1"),
+    ("sexo", "<u1"),
+    ("prima", "<f8"),
+    ("periodo", "<u1"),
+    ("porcentaje_devolucion", "<f8"),
+    ("trea", "<f8"),
+    ("aporte_total", "<f8"),
+    ("ganancia_total", "<f8"),
+    ("devolucion_total", "<f8"),
+    ("rentabilidad", "<f8"),
+    ("tabla_devolucion", "<f8"),
+)
+
+_FILAS = struct.Struct("<I")
+
+
+def tabla_devolucion(periodo: np.ndarray, porcentaje: np.ndarray, ancho: int) -> np.ndarray:
+    """
+    Equivalente de ancho fijo de _generar_tabla_devolucion: [60, 70, ..., porcentaje]
+    con NaN desde la posición periodo en adelante
+    """
+    posiciones = np.arange(ancho)
+    periodo = np.asarray(periodo)[:, None]
+    tabla = np.where(posiciones < periodo, 70.0, np.nan)
+    tabla = np.where((posiciones == 0) & (periodo >= 1), 60.0, tabla)
+    ultimo = (posiciones == periodo - 1) & (periodo > 1)
+    return np.where(ultimo, np.asarray(porcentaje, dtype=np.float64)[:, None], tabla)
+
+
+class ExportadorSuperficie:
+    """Genera el archivo columnar bloque por bloque"""
+
+    def __init__(
+        self,
+        config: List[Dict],
+        edades: Sequence[int],
+        sexos: Sequence[str] = SEXOS,
+        edades_por_bloque: int = 8,
+        huella_config: str = ""
+    ):
+        self.config = config
+        self.edades = list(edades)
+        self.sexos = list(sexos)
+        self.edades_por_bloque = max(1, edades_por_bloque)
+        self.huella_config = huella_config
+        periodos = [int(p) for item in config if item["primas"] for p in item["periodos"]]
+        self.ancho_tabla = max(periodos, default=0)
+        combinaciones_por_edad = sum(len(item["primas"]) * len(item["periodos"]) for item in config)
+        self.total_filas = len(self.edades) * len(self.sexos) * combinaciones_por_edad
+
+    def encabezado(self) -> Dict:
+        return {
+            "version": VERSION_FORMATO,
+            "total_filas": self.total_filas,
+            "columnas": [
+                {"nombre": nombre, "tipo": tipo, "forma": [self.ancho_tabla] if nombre == "tabla_devolucion" else []}
+                for nombre, tipo in COLUMNAS
+            ],
+            "diccionarios": {"sexo": self.sexos},
+            "edad_min": self.edades[0] if self.edades else None,
+            "edad_max": self.edades[-1] if self.edades else None,
+            "huella_config": self.huella_config,
+        }
+
+    def _bloque(self, grupo: Dict, edades: Sequence[int]) -> bytes:
+        superficie = MotorVectorizado().generar_superficie([grupo], edades=edades, sexos=self.sexos)
+        filas = len(superficie["prima"])
+        codigos = {sexo: i for i, sexo in enumerate(self.sexos)}
+        columnas = dict(superficie)
+        columnas["sexo"] = np.fromiter((codigos[s] for s in superficie["sexo"]), dtype=np.uint8, count=filas)
+        columnas["tabla_devolucion"] = tabla_devolucion(
+            superficie["periodo"], superficie["porcentaje_devolucion"], self.ancho_tabla
+        )
+        partes = [_FILAS.pack(filas)]
+        for nombre, tipo in COLUMNAS:
+            partes.append(np.ascontiguousarray(columnas[nombre], dtype=tipo).tobytes())
+        return b"".join(partes)
+
+    def bloques(self) -> Iterator[bytes]:
+        """
+        Firma + encabezado, un bloque por grupo de la configuración y cada
+        edades_por_bloque edades, y la marca de fin
+
+        Las filas quedan en el mismo orden que generar_superficie (y /cotizaciones/grid).
+        """
+        encabezado = json.dumps(self.encabezado(), ensure_ascii=False).encode("utf-8")
+        yield FIRMA + _FILAS.pack(len(encabezado)) + encabezado
+        for grupo in self.config:
+            if not grupo["primas"] or not grupo["periodos"]:
+                continue
+            for inicio in range(0, len(self.edades), self.edades_por_bloque):
+                yield self._bloque(grupo, self.edades[inicio:inicio + self.edades_por_bloque])
+        yield _FILAS.pack(0)
+
+
+def _leer_exacto(archivo: BinaryIO, cantidad: int) -> bytes:
+    datos = archivo.read(cantidad)
+    if len(datos) != cantidad:
+        raise ValueError("Archivo columnar truncado")
+    return datos
+
+
+def leer_encabezado(archivo: BinaryIO) -> Dict:
+    """Lee la firma y el encabezado; el archivo queda posicionado en el primer bloque"""
+    if _leer_exacto(archivo, len(FIRMA)) != FIRMA:
+        raise ValueError("No es un archivo columnar de cotizaciones")
+    (largo,) = _FILAS.unpack(_leer_exacto(archivo, _FILAS.size))
+    encabezado = json.loads(_leer_exacto(archivo, largo))
+    if encabezado.get("version") != VERSION_FORMATO:
+        raise ValueError(f"Versión de formato no soportada: {encabezado.get('version')}")
+    return encabezado
+
+
+def iterar_bloques(archivo: BinaryIO, encabezado: Dict) -> Iterator[Dict[str, np.ndarray]]:
+    """Columnas de cada bloque, de a uno (para recorrer el archivo sin cargarlo entero)"""
+    while True:
+        (filas,) = _FILAS.unpack(_leer_exacto(archivo, _FILAS.size))
+        if filas == 0:
+            return
+        bloque = {}
+        for columna in encabezado["columnas"]:
+            tipo = np.dtype(columna["tipo"])
+            forma = (filas, *columna["forma"])
+            cantidad = int(np.prod(forma))
+            bloque[columna["nombre"]] = np.frombuffer(
+                _leer_exacto(archivo, cantidad * tipo.itemsize), dtype=tipo
+            ).reshape(forma)
+        yield bloque
+
+
+def leer_superficie(ruta: str) -> Dict[str, np.ndarray]:
+    """Carga el archivo completo como columnas NumPy (sexo decodificado a texto)"""
+    with open(ruta, "rb") as archivo:
+        encabezado = leer_encabezado(archivo)
+        bloques = list(iterar_bloques(archivo, encabezado))
+    columnas = {}
+    for columna in encabezado["columnas"]:
+        forma = (0, *columna["forma"])
+        partes = [bloque[columna["nombre"]] for bloque in bloques]
+        columnas[columna["nombre"]] = np.concatenate(partes) if partes else np.empty(forma, dtype=columna["tipo"])
+    columnas["sexo"] = np.asarray(encabezado["diccionarios"]["sexo"], dtype=object)[columnas["sexo"]]
+    return columnas
@@ -1,13 +1,76 @@
 import os
-import json
+import time
 import base64
-from io import BytesIO
-from typing import Dict, List, Optional
-from datetime import datetime
-import matplotlib.pyplot as plt
-import matplotlib
-import requests
-matplotlib.use('Agg')  # Backend sin GUI para entornos de servidor
+from typing import Dict, NamedTuple, Optional
+
+from app.schemas.cotizacion import OpcionesImagen
+from app.services.metricas import medir_etapa
+from app.services.subida_imagenes import cliente_subida
+from app.services.almacen_imagenes import almacen_imagenes, huella_grafico
+from app.services.datos_grafico import (
+    COLORES,
+    COLUMNAS,
+    ANCHOS_COLUMNAS,
+    COLOR_ENCABEZADO,
+    COLORES_FILAS,
+    TAMANO_FIGURA,
+    DatosGrafico,
+    formatear_numero,
+    preparar_datos_grafico
+)
+
+
+# Renderizador por defecto: "matplotlib" (figura completa en cada llamada),
+# "plantilla" (figura preconstruida por proceso, solo se actualizan los datos)
+# o "rapido" (Pillow, sin matplotlib). matplotlib se importa solo si se usa.
+RENDERIZADORES = ("matplotlib", "plantilla", "rapido")
+IMAGE_RENDERER = os.getenv("IMAGE_RENDERER", "matplotlib")
+
+# Salida por defecto y miniatura
+DPI_POR_DEFECTO = 300
+ANCHO_MINIATURA = int(os.getenv("ANCHO_MINIATURA", "480"))
+EXTENSIONES = {"jpeg": "jpg", "png": "png", "webp": "webp", "svg": "svg"}
+
+
+def resolver_renderizador(renderizador: Optional[str] = None) -> str:
+    """Renderizador efectivo del request (por defecto IMAGE_RENDERER)"""
+    renderizador = renderizador or IMAGE_RENDERER
+    if renderizador not in RENDERIZADORES:
+        raise ValueError(f"Renderizador desconocido: {renderizador}")
+    return renderizador
+
+
+class ImagenGenerada(NamedTuple):
+    """Archivo generado (o reutilizado del almacén) y sus características"""
+    ruta: str
+    formato: str
+    bytes: int
+    ancho: Optional[int]
+    alto: Optional[int]
+    tiempo_render_ms: float
+    reutilizada: bool
+    miniatura: Optional["ImagenGenerada"] = None
+
+
+class _Pedido(NamedTuple):
+    """Gráfico a generar con las opciones ya resueltas"""
+    datos: DatosGrafico
+    renderizador: str
+    formato: str
+    dpi: float
+    calidad: Optional[int]
+    miniatura: bool
+    huella: str
+
+
+def _describir(ruta: str, formato: str, tiempo_render_ms: float, reutilizada: bool) -> ImagenGenerada:
+    """Tamaño en bytes y en píxeles del archivo (sin decodificar la imagen)"""
+    ancho = alto = None
+    if formato != "svg":
+        from PIL import Image
+        with Image.open(ruta) as imagen:
+            ancho, alto = imagen.size
+    return ImagenGenerada(ruta, formato, os.path.getsize(ruta), ancho, alto, round(tiempo_render_ms, 1), reutilizada)
 
 
 class ImageService:
@@ -21,72 +84,232 @@ class ImageService:
         )
         # Crear carpeta db si no existe
         os.makedirs(self.output_dir, exist_ok=True)
+        self.almacen = almacen_imagenes
     
     def subir_imagen_temporal(self, ruta_archivo: str) -> Optional[str]:
         """
-        Sube una imagen a tmpfiles.org y devuelve la URL pública
+        Sube una imagen al servicio temporal (UPLOAD_URL, por defecto tmpfiles.org)
+        y devuelve la URL pública
         El archivo expira automáticamente después de 1 hora
         
+        Usa el cliente HTTP compartido del proceso (conexiones reutilizadas y
+        reintentos); desde código async usar cliente_subida.subir.
+        
         Args:
             ruta_archivo: Ruta al archivo de imagen
             
         Returns:
             URL pública de la imagen o None si falla
         """
-        try:
-            # Abrir el archivo
-            with open(ruta_archivo, "rb") as file:
-                files = {
-                    'file': ('cotizacion.jpg', file, 'image/jpeg')
-                }
-                
-                # Subir a tmpfiles.org (sin necesidad de API key)
-                response = requests.post(
-                    'https://tmpfiles.org/api/v1/upload',
-                    files=files,
-                    timeout=15
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("status") == "success":
-                        # tmpfiles.org devuelve una URL que necesita ser ajustada
-                        url = data["data"]["url"]
-                        # Convertir de https://tmpfiles.org/123456 a https://tmpfiles.org/dl/123456
-                        url = url.replace("tmpfiles.org/", "tmpfiles.org/dl/")
-                        print(f"[INFO] Imagen subida exitosamente a: {url}")
-                        return url
-                
-                print(f"[ERROR] Error al subir imagen a tmpfiles: {response.text}")
-                return None
-                
-        except Exception as e:
-            import traceback
-            print(f"[ERROR] Excepción al subir imagen: {str(e)}")
-            traceback.print_exc()
-            return None
+        return cliente_subida.subir_sync(ruta_archivo)
     
-    def generar_grafico_cotizacion(self, data: Dict, nombre_archivo: str = None, retornar_base64: bool = False, subir_temporal: bool = False) -> tuple[str, Optional[str]]:
+    def subir_o_reutilizar(self, ruta_archivo: str) -> Optional[str]:
+        """Sube la imagen, salvo que ya tenga una URL temporal vigente"""
+        url = self.almacen.url_vigente(ruta_archivo)
+        if url is None:
+            url = self.subir_imagen_temporal(ruta_archivo)
+            self.almacen.registrar_url(ruta_archivo, url)
+        return url
+    
+    def generar_grafico_cotizacion(
+        self,
+        data: Dict,
+        nombre_archivo: str = None,
+        retornar_base64: bool = False,
+        subir_temporal: bool = False,
+        renderizador: Optional[str] = None,
+        opciones: Optional[OpcionesImagen] = None
+    ) -> tuple[str, Optional[str]]:
         """
-        Genera un gráfico de cotización con tabla resumen y lo guarda como JPEG
+        Genera un gráfico de cotización con tabla resumen y lo guarda (JPEG por defecto)
+        
+        La imagen se guarda en el almacén por contenido: si ya se generó un
+        gráfico con los mismos datos, renderizador y opciones, se reutiliza el
+        archivo (y la URL temporal, si sigue vigente) sin volver a renderizar.
         
         Args:
             data: Diccionario con la estructura de cotización por colección
-            nombre_archivo: Nombre opcional para el archivo (sin extensión)
+            nombre_archivo: Nombre opcional para el archivo (sin extensión); si se
+                indica, la imagen también se publica con ese nombre en db/
             retornar_base64: Si True, también devuelve la imagen en base64
             subir_temporal: Si True, sube la imagen a un servicio temporal y devuelve la URL
+            renderizador: "matplotlib", "plantilla" o "rapido" (por defecto IMAGE_RENDERER)
+            opciones: Formato, resolución, calidad y miniatura (por defecto JPEG a 300 dpi)
         
         Returns:
             Tupla (ruta_archivo, base64_string/url_temporal o None)
         """
-        # Generar nombre de archivo si no se proporciona
-        if nombre_archivo is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            nombre_archivo = f"cotizacion_{timestamp}"
+        archivo_salida = self.generar_imagen(data, nombre_archivo, renderizador, opciones).ruta
+        
+        # Generar base64 o URL temporal según se solicite
+        resultado = None
+        if subir_temporal:
+            # Subir a servicio temporal (o reutilizar la URL ya subida)
+            resultado = self.subir_o_reutilizar(archivo_salida)
+        elif retornar_base64:
+            # Leer archivo y convertir a base64
+            with open(archivo_salida, 'rb') as f:
+                resultado = base64.b64encode(f.read()).decode('utf-8')
+        
+        return archivo_salida, resultado
+    
+    def generar_imagen(
+        self,
+        data: Dict,
+        nombre_archivo: Optional[str] = None,
+        renderizador: Optional[str] = None,
+        opciones: Optional[OpcionesImagen] = None
+    ) -> ImagenGenerada:
+        """
+        Genera (o reutiliza del almacén) la imagen y su miniatura
+        
+        Sin opciones se genera la imagen por defecto (JPEG a 300 dpi) y sin
+        miniatura, como generar_grafico_cotizacion. Con ancho, el dpi se
+        calcula para ese ancho en píxeles (aproximado con el renderizador
+        matplotlib, que recorta la figura).
+        
+        Returns:
+            ImagenGenerada con ruta, bytes, píxeles y tiempo de render
+        """
+        pedido = self._pedido(data, renderizador, opciones)
+        imagen = self._buscar(pedido)
+        if imagen is None:
+            inicio = time.perf_counter()
+            ruta = self.almacen.guardar(
+                pedido.huella,
+                lambda temporal: self.renderizar(
+                    pedido.datos, temporal, pedido.renderizador, pedido.formato, pedido.dpi, pedido.calidad
+                ),
+                EXTENSIONES[pedido.formato]
+            )
+            imagen = _describir(ruta, pedido.formato, (time.perf_counter() - inicio) * 1000, reutilizada=False)
+            if pedido.miniatura:
+                imagen = imagen._replace(miniatura=self._generar_miniatura(pedido, ruta))
         
-        # Asegurar que no tiene extensión
-        nombre_base = nombre_archivo.replace(".jpg", "").replace(".jpeg", "")
-        archivo_salida = os.path.join(self.output_dir, f"{nombre_base}.jpg")
+        # Publicar con el nombre pedido (sin extensión)
+        if nombre_archivo is not None:
+            nombre_base, extension = os.path.splitext(nombre_archivo)
+            if extension.lstrip(".").lower() not in ("jpg", *EXTENSIONES):
+                nombre_base = nombre_archivo
+            imagen = imagen._replace(ruta=self.almacen.publicar(
+                imagen.ruta, os.path.join(self.output_dir, f"{nombre_base}.{EXTENSIONES[pedido.formato]}")
+            ))
+            if imagen.miniatura is not None:
+                extension = os.path.splitext(imagen.miniatura.ruta)[1]
+                imagen = imagen._replace(miniatura=imagen.miniatura._replace(ruta=self.almacen.publicar(
+                    imagen.miniatura.ruta, os.path.join(self.output_dir, f"{nombre_base}_min{extension}")
+                )))
+        return imagen
+    
+    def buscar_imagen(
+        self,
+        data: Dict,
+        renderizador: Optional[str] = None,
+        opciones: Optional[OpcionesImagen] = None
+    ) -> Optional[ImagenGenerada]:
+        """Imagen (y miniatura, si se pide) ya guardada en el almacén, sin renderizar nada"""
+        return self._buscar(self._pedido(data, renderizador, opciones), completar=False)
+    
+    def _pedido(self, data: Dict, renderizador: Optional[str], opciones: Optional[OpcionesImagen]) -> _Pedido:
+        """Resuelve renderizador y opciones y calcula la huella del gráfico"""
+        opciones = opciones or OpcionesImagen(miniatura=False)
+        renderizador = resolver_renderizador(renderizador)
+        if opciones.formato == "svg" and renderizador == "rapido":
+            # Pillow solo genera imágenes raster
+            renderizador = "plantilla"
+        dpi = opciones.ancho / TAMANO_FIGURA[0] if opciones.ancho else (opciones.dpi or DPI_POR_DEFECTO)
+        datos = preparar_datos_grafico(data)
+        huella = huella_grafico(datos, renderizador, opciones.formato, dpi, opciones.calidad)
+        return _Pedido(datos, renderizador, opciones.formato, dpi, opciones.calidad, opciones.miniatura, huella)
+    
+    def _formato_miniatura(self, pedido: _Pedido) -> str:
+        return "png" if pedido.formato == "svg" else pedido.formato
+    
+    def _buscar(self, pedido: _Pedido, completar: bool = True) -> Optional[ImagenGenerada]:
+        """Imagen del almacén; con completar, genera la miniatura si es lo único que falta"""
+        ruta = self.almacen.buscar(pedido.huella, EXTENSIONES[pedido.formato])
+        if ruta is None:
+            return None
+        imagen = _describir(ruta, pedido.formato, 0.0, reutilizada=True)
+        if pedido.miniatura:
+            formato_miniatura = self._formato_miniatura(pedido)
+            ruta_miniatura = self.almacen.buscar(f"{pedido.huella}_min", EXTENSIONES[formato_miniatura])
+            if ruta_miniatura is None:
+                if not completar:
+                    return None
+                miniatura = self._generar_miniatura(pedido, ruta)
+            else:
+                miniatura = _describir(ruta_miniatura, formato_miniatura, 0.0, reutilizada=True)
+            imagen = imagen._replace(miniatura=miniatura)
+        return imagen
+    
+    def _generar_miniatura(self, pedido: _Pedido, ruta: str) -> ImagenGenerada:
+        """
+        Miniatura de ANCHO_MINIATURA píxeles de ancho: se reduce la imagen ya
+        generada (un SVG se vuelve a dibujar como PNG a baja resolución)
+        """
+        formato = self._formato_miniatura(pedido)
+        
+        def escribir(temporal: str) -> None:
+            if pedido.formato == "svg":
+                self.renderizar(pedido.datos, temporal, pedido.renderizador, "png", ANCHO_MINIATURA / TAMANO_FIGURA[0])
+                return
+            from PIL import Image
+            with Image.open(ruta) as imagen:
+                # En JPEG decodifica directamente a una escala reducida
+                imagen.draft("RGB", (ANCHO_MINIATURA, ANCHO_MINIATURA))
+                imagen.thumbnail((ANCHO_MINIATURA, imagen.height), Image.LANCZOS)
+                extra = {"quality": pedido.calidad} if pedido.calidad is not None and formato in ("jpeg", "webp") else {}
+                imagen.save(temporal, format=formato.upper(), **extra)
+        
+        inicio = time.perf_counter()
+        ruta_miniatura = self.almacen.guardar(f"{pedido.huella}_min", escribir, EXTENSIONES[formato])
+        return _describir(ruta_miniatura, formato, (time.perf_counter() - inicio) * 1000, reutilizada=False)
+    
+    def renderizar(
+        self,
+        datos: DatosGrafico,
+        archivo_salida: str,
+        renderizador: str,
+        formato: str = "jpeg",
+        dpi: float = DPI_POR_DEFECTO,
+        calidad: Optional[int] = None
+    ) -> None:
+        """Dibuja el gráfico con el renderizador indicado, sin pasar por el almacén"""
+        if renderizador == "plantilla":
+            from app.services.plantilla_grafico import renderizar_con_plantilla
+            renderizar_con_plantilla(datos, archivo_salida, formato, dpi, calidad)
+        elif renderizador == "rapido":
+            from app.services.render_rapido import renderizar_rapido
+            renderizar_rapido(datos, archivo_salida, formato, dpi, calidad)
+        else:
+            self._renderizar_matplotlib(datos, archivo_salida, formato, dpi, calidad)
+    
+    def _renderizar_matplotlib(
+        self,
+        datos: DatosGrafico,
+        archivo_salida: str,
+        formato: str = "jpeg",
+        dpi: float = DPI_POR_DEFECTO,
+        calidad: Optional[int] = None
+    ) -> None:
+        """Arma la figura completa desde cero y la guarda (renderizador original)"""
+        import matplotlib.pyplot as plt
+        from app.services.plantilla_grafico import opciones_guardado
+        
+        with medir_etapa("construccion_figura"):
+            fig = self._construir_figura_matplotlib(datos)
+        try:
+            with medir_etapa("savefig"):
+                fig.savefig(archivo_salida, format=formato, dpi=dpi, bbox_inches='tight', **opciones_guardado(formato, calidad))
+        finally:
+            plt.close(fig)
+    
+    def _construir_figura_matplotlib(self, datos: DatosGrafico):
+        """Figura de matplotlib con el gráfico y la tabla, lista para guardar"""
+        import matplotlib
+        matplotlib.use('Agg')  # Backend sin GUI para entornos de servidor
+        import matplotlib.pyplot as plt
         
         # Crear figura con diseño vertical (gráfico arriba, tabla abajo)
         fig = plt.figure(figsize=(12, 10))
@@ -99,19 +322,14 @@ class ImageService:
         ax_plot = fig.add_subplot(gs[0])
         
         # Graficar cada periodo
-        colores = ['#FF6B35', '#004E89', '#1B998B']  # Colores modernos
-        for idx, cotizacion in enumerate(data["cotizaciones"]):
-            periodo = cotizacion["periodo"]
-            tabla_dev = json.loads(cotizacion["cotizacion"]["tabla_devolucion"])
-            años = list(range(1, len(tabla_dev) + 1))
-            
+        for idx, serie in enumerate(datos.series):
             # Seleccionar color de la lista (ciclar si hay más de 3)
-            color = colores[idx % len(colores)]
+            color = COLORES[idx % len(COLORES)]
             
             ax_plot.plot(
-                años, 
-                tabla_dev, 
-                label=f"{periodo} años",
+                serie.años, 
+                serie.valores, 
+                label=serie.etiqueta,
                 marker='o',
                 linewidth=2.5,
                 markersize=6,
@@ -123,8 +341,7 @@ class ImageService:
         ax_plot.set_ylabel("Porcentaje de devolución", fontsize=12, fontweight='bold')
         
         # Título con la prima
-        titulo = f"Evolución de devolución por periodo para una prima de S/ {data['prima']:.0f} mensual"
-        ax_plot.set_title(titulo, fontsize=14, fontweight='bold', pad=20)
+        ax_plot.set_title(datos.titulo, fontsize=14, fontweight='bold', pad=20)
         ax_plot.legend(fontsize=10, loc='upper left')
         ax_plot.grid(True, alpha=0.3, linestyle='--')
         
@@ -136,27 +353,13 @@ class ImageService:
         ax_table = fig.add_subplot(gs[1])
         ax_table.axis("off")
         
-        # Preparar datos de la tabla
-        rows = []
-        for cotizacion in data["cotizaciones"]:
-            cot = cotizacion["cotizacion"]
-            rows.append([
-                cotizacion["periodo"],
-                f"S/ {self._format_number(float(cot['aporte_total']))}",
-                f"S/ {self._format_number(float(cot['devolucion_total']))}",
-                f"S/ {self._format_number(float(cot['ganancia_total']))}",
-                f"{cot['porcentaje_devolucion']}%"
-            ])
-        
-        columns = ["Años de pago", "Aporte Total", "Devolución", "Ganancia total", "% devolución"]
-        
         # Crear tabla
         table = ax_table.table(
-            cellText=rows,
-            colLabels=columns,
+            cellText=datos.filas,
+            colLabels=COLUMNAS,
             loc="center",
             cellLoc="center",
-            colWidths=[0.15, 0.22, 0.22, 0.22, 0.15]
+            colWidths=ANCHOS_COLUMNAS
         )
         
         # Estilizar tabla
@@ -165,38 +368,20 @@ class ImageService:
         table.scale(1, 2.5)  # Aumentar altura de las celdas
         
         # Estilizar encabezados
-        for i in range(len(columns)):
+        for i in range(len(COLUMNAS)):
             cell = table[(0, i)]
-            cell.set_facecolor('#004E89')
+            cell.set_facecolor(COLOR_ENCABEZADO)
             cell.set_text_props(weight='bold', color='white')
         
         # Estilizar filas (alternar colores)
-        for i in range(1, len(rows) + 1):
-            for j in range(len(columns)):
+        for i in range(1, len(datos.filas) + 1):
+            for j in range(len(COLUMNAS)):
                 cell = table[(i, j)]
-                if i % 2 == 0:
-                    cell.set_facecolor('#F0F0F0')
-                else:
-                    cell.set_facecolor('#FFFFFF')
+                cell.set_facecolor(COLORES_FILAS[i % 2 == 0])
         
-        # Ajustar layout y guardar
+        # Ajustar layout
         plt.tight_layout()
-        
-        # Guardar archivo
-        plt.savefig(archivo_salida, format='jpeg', dpi=300, bbox_inches='tight')
-        plt.close(fig)
-        
-        # Generar base64 o URL temporal según se solicite
-        resultado = None
-        if subir_temporal:
-            # Subir a servicio temporal y obtener URL
-            resultado = self.subir_imagen_temporal(archivo_salida)
-        elif retornar_base64:
-            # Leer archivo y convertir a base64
-            with open(archivo_salida, 'rb') as f:
-                resultado = base64.b64encode(f.read()).decode('utf-8')
-        
-        return archivo_salida, resultado
+        return fig
     
     def _format_number(self, num: float) -> str:
         """
@@ -208,7 +393,7 @@ class ImageService:
         Returns:
             String formateado
         """
-        return f"{num:,.2f}".replace(",", " ")
+        return formatear_numero(num)
     
     def generar_grafico_desde_endpoint(self, prima: float, edad_actuarial: int, sexo: str, retornar_base64: bool = False) -> tuple[str, Optional[str]]:
         """
@@ -224,25 +409,23 @@ class ImageService:
             Tupla (ruta_archivo, base64_string o None)
         """
         from app.services.cotizacion_service import CotizacionService
-        from app.schemas.cotizacion import CotizacionColeccionRequest
+        from app.schemas.cotizacion import CotizacionColeccionRequest, ParametrosCotizacionSinPeriodo
         
         # Crear request
         request = CotizacionColeccionRequest(
-            prima=prima,
-            edad_actuarial=edad_actuarial,
-            sexo=sexo
+            producto="RUMBO",
+            parametros=ParametrosCotizacionSinPeriodo(
+                prima=prima,
+                edad_actuarial=edad_actuarial,
+                sexo=sexo
+            )
         )
         
-        # Obtener cotizaciones
+        # Obtener cotizaciones (la imagen se genera aquí, no dentro de la colección)
         cotizacion_service = CotizacionService()
-        response = cotizacion_service.crear_cotizacion_coleccion(request)
-        
-        # Convertir a diccionario
-        data = response.model_dump()
-        
-        # Generar nombre de archivo con información relevante
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        nombre = f"cotizacion_prima{int(prima)}_edad{edad_actuarial}_{sexo}_{timestamp}"
+        data = cotizacion_service.datos_grafico_coleccion(request)
+        if data is None:
+            raise ValueError(f"No hay periodos configurados para la prima {prima}")
         
-        # Generar gráfico
-        return self.generar_grafico_cotizacion(data, nombre, retornar_base64=retornar_base64)
+        # Generar gráfico (se reutiliza si ya existe uno con los mismos datos)
+        return self.generar_grafico_cotizacion(data, retornar_base64=retornar_base64)
@@ -0,0 +1,365 @@
+"""
+Limpieza del directorio de imágenes (db/)
+Cada render deja un archivo en db/ (servido en /images) y nada los borraba;
+en Cloud Run ese directorio vive en memoria (tmpfs). Un hilo en segundo plano
+borra las imágenes sin uso por más de un TTL y, si se supera la cuota de
+bytes, las menos usadas recientemente.
+
+El índice de archivos vive en memoria: se arma con un recorrido del
+directorio al iniciar (y cada LIMPIEZA_IMAGENES_REESCANEO segundos, para ver
+lo que escriben otros procesos) y se actualiza con cada imagen guardada,
+reutilizada o servida, sin recorrer el directorio en cada request.
+
+Con varios workers de uvicorn limpia uno solo por máquina: el que toma el
+flock de LIMPIEZA_IMAGENES_BLOQUEO (los demás reintentan en cada intervalo,
+por si el dueño termina). Los demás marcan el uso de las imágenes que sirven
+o reutilizan actualizando su mtime, y el barrido revisa el mtime antes de
+borrar, así que una imagen usada desde otro worker no se da por vencida.
+"""
+import os
+import time
+import fcntl
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.services import metricas
+from app.services.bitacora import bitacora
+
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LIMPIEZA_IMAGENES = os.getenv("LIMPIEZA_IMAGENES", "1") == "1"
+LIMPIEZA_IMAGENES_DIR = os.getenv("LIMPIEZA_IMAGENES_DIR", os.path.join(_RAIZ, "db"))
+LIMPIEZA_IMAGENES_MAX_BYTES = int(os.getenv("LIMPIEZA_IMAGENES_MAX_BYTES", str(256 * 1024 * 1024)))
+LIMPIEZA_IMAGENES_TTL = float(os.getenv("LIMPIEZA_IMAGENES_TTL", "86400"))
+LIMPIEZA_IMAGENES_INTERVALO = float(os.getenv("LIMPIEZA_IMAGENES_INTERVALO", "60"))
+# Una imagen usada hace menos de esto no se borra (puede estar subiéndose o sirviéndose)
+LIMPIEZA_IMAGENES_EDAD_MINIMA = float(os.getenv("LIMPIEZA_IMAGENES_EDAD_MINIMA", "300"))
+LIMPIEZA_IMAGENES_REESCANEO = float(os.getenv("LIMPIEZA_IMAGENES_REESCANEO", "900"))
+LIMPIEZA_IMAGENES_BLOQUEO = os.getenv(
+    "LIMPIEZA_IMAGENES_BLOQUEO", os.path.join(_RAIZ, "datos", "limpieza_imagenes.lock")
+)
+# Archivos (relativos al directorio) que nunca se borran: los versionados en el repo
+LIMPIEZA_IMAGENES_EXCLUIR = [
+    n.strip() for n in os.getenv("LIMPIEZA_IMAGENES_EXCLUIR", "cotizacion_prima300_edad35_M.jpg").split(",")
+    if n.strip()
+]
+
+EXTENSIONES_IMAGEN = (".jpg", ".jpeg", ".png", ".webp", ".svg")
+
+
+class _Archivo:
+    __slots__ = ("bytes", "inodo", "ultimo_acceso")
+
+    def __init__(self, bytes_: int, inodo: Tuple[int, int], ultimo_acceso: float):
+        self.bytes = bytes_
+        self.inodo = inodo
+        self.ultimo_acceso = ultimo_acceso
+
+
+class LimpiadorImagenes:
+    """
+    Índice LRU de las imágenes del directorio con cuota de bytes y TTL
+
+    - El orden del índice es el de último acceso: el primero es el menos usado
+    - Los hard links (imágenes publicadas con nombre desde el almacén) ocupan
+      el disco una sola vez y se cuentan una sola vez
+    - Mientras no está iniciado (p. ej. en los workers de renderizado) registrar
+      y tocar no hacen nada; el proceso de la API registra lo que ellos generan
+    - Iniciado sin el flock (otro worker limpia), tocar actualiza el mtime del
+      archivo para que el dueño del flock vea el uso
+    """
+
+    def __init__(
+        self,
+        directorio: str = LIMPIEZA_IMAGENES_DIR,
+        max_bytes: int = LIMPIEZA_IMAGENES_MAX_BYTES,
+        ttl: float = LIMPIEZA_IMAGENES_TTL,
+        intervalo: float = LIMPIEZA_IMAGENES_INTERVALO,
+        edad_minima: float = LIMPIEZA_IMAGENES_EDAD_MINIMA,
+        reescaneo: float = LIMPIEZA_IMAGENES_REESCANEO,
+        bloqueo: str = LIMPIEZA_IMAGENES_BLOQUEO,
+        excluir: List[str] = LIMPIEZA_IMAGENES_EXCLUIR
+    ):
+        self.directorio = os.path.abspath(directorio)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.intervalo = intervalo
+        self.edad_minima = edad_minima
+        self.reescaneo = reescaneo
+        self.bloqueo = bloqueo
+        self._excluidas = {os.path.join(self.directorio, nombre) for nombre in excluir}
+        self._fd_bloqueo: Optional[int] = None
+        self._indice: "OrderedDict[str, _Archivo]" = OrderedDict()
+        # Rutas por inodo: los bytes de un inodo cuentan mientras tenga alguna ruta
+        self._inodos: Dict[Tuple[int, int], int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+        self._al_eliminar: List[Callable[[str], None]] = []
+        self.activo = False
+        self.estado = "detenido"
+
+        self.eliminadas_ttl = 0
+        self.eliminadas_cuota = 0
+        self.bytes_liberados = 0
+        self.barridos = 0
+        self.ultimo_barrido: Optional[float] = None
+        self.duracion_ultimo_barrido_ms: Optional[float] = None
+        self.ultimo_escaneo: Optional[float] = None
+
+    def iniciar(self) -> None:
+        """
+        Arranca el hilo de limpieza; limpia solo si toma el flock (el primer
+        recorrido del directorio se hace en ese hilo)
+        """
+        if self._hilo is not None:
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        self.estado = "pendiente"
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ejecutar, name="limpieza-imagenes", daemon=True)
+        self._hilo.start()
+
+    def al_eliminar(self, funcion: Callable[[str], None]) -> None:
+        """Registra una función que se llama con la ruta de cada imagen borrada"""
+        self._al_eliminar.append(funcion)
+
+    def detener(self) -> None:
+        self.activo = False
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+            self._hilo = None
+        self._liberar_bloqueo()
+        self.estado = "detenido"
+
+    def _tomar_bloqueo(self) -> bool:
+        """True si este proceso queda a cargo de la limpieza"""
+        os.makedirs(os.path.dirname(self.bloqueo) or ".", exist_ok=True)
+        fd = os.open(self.bloqueo, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd_bloqueo = fd
+        return True
+
+    def _liberar_bloqueo(self) -> None:
+        if self._fd_bloqueo is not None:
+            os.close(self._fd_bloqueo)  # cerrar el descriptor libera el flock
+            self._fd_bloqueo = None
+
+    def _ejecutar(self) -> None:
+        proximo_escaneo = 0.0
+        while not self._detener.is_set():
+            try:
+                if self._fd_bloqueo is None:
+                    if not self._tomar_bloqueo():
+                        self.estado = "en_otro_proceso"
+                        self._detener.wait(self.intervalo)
+                        continue
+                    self.activo = True
+                    self.estado = "activo"
+                    proximo_escaneo = 0.0
+                if time.monotonic() >= proximo_escaneo:
+                    self.escanear()
+                    proximo_escaneo = time.monotonic() + self.reescaneo
+                self.barrer()
+            except Exception as e:
+                bitacora.error("limpieza_imagenes_error", str(e), excepcion=e)
+            self._detener.wait(self.intervalo)
+
+    # Índice
+
+    def _agregar(self, ruta: str, archivo: _Archivo) -> None:
+        anterior = self._indice.pop(ruta, None)
+        if anterior is not None:
+            self._quitar_inodo(anterior)
+        self._indice[ruta] = archivo
+        if self._inodos.get(archivo.inodo, 0) == 0:
+            self._bytes += archivo.bytes
+        self._inodos[archivo.inodo] = self._inodos.get(archivo.inodo, 0) + 1
+
+    def _quitar_inodo(self, archivo: _Archivo) -> bool:
+        """Descuenta una ruta del inodo; True si era la última (el espacio se libera)"""
+        restantes = self._inodos.get(archivo.inodo, 1) - 1
+        if restantes > 0:
+            self._inodos[archivo.inodo] = restantes
+            return False
+        self._inodos.pop(archivo.inodo, None)
+        self._bytes -= archivo.bytes
+        return True
+
+    def registrar(self, ruta: str) -> None:
+        """Agrega (o actualiza) una imagen recién escrita como la más reciente"""
+        if not self.activo:
+            return
+        ruta = os.path.abspath(ruta)
+        if ruta in self._excluidas:
+            return
+        try:
+            stat = os.stat(ruta)
+        except OSError:
+            return
+        with self._lock:
+            self._agregar(ruta, _Archivo(stat.st_size, (stat.st_dev, stat.st_ino), time.time()))
+
+    def tocar(self, ruta: str) -> None:
+        """Marca la imagen como usada ahora (reutilizada del almacén o servida en /images)"""
+        if not self.activo:
+            if self.estado == "en_otro_proceso":
+                self._marcar_uso(ruta)
+            return
+        ruta = os.path.abspath(ruta)
+        with self._lock:
+            archivo = self._indice.get(ruta)
+            if archivo is not None:
+                archivo.ultimo_acceso = time.time()
+                self._indice.move_to_end(ruta)
+                return
+        # La escribió otro proceso después del último recorrido
+        self.registrar(ruta)
+
+    def _marcar_uso(self, ruta: str) -> None:
+        """Actualiza el mtime (a lo sumo una vez cada media edad mínima) para el worker que limpia"""
+        try:
+            if time.time() - os.stat(ruta).st_mtime > self.edad_minima / 2:
+                os.utime(ruta)
+        except OSError:
+            pass
+
+    def escanear(self) -> None:
+        """
+        Recorre el directorio y rehace el índice: conserva el último acceso
+        conocido y toma la fecha de modificación de los archivos nuevos
+        """
+        encontrados: List[Tuple[float, str, _Archivo]] = []
+        for raiz, _, nombres in os.walk(self.directorio):
+            for nombre in nombres:
+                # Los temporales del almacén empiezan con punto
+                if nombre.startswith(".") or not nombre.lower().endswith(EXTENSIONES_IMAGEN):
+                    continue
+                ruta = os.path.join(raiz, nombre)
+                if ruta in self._excluidas:
+                    continue
+                try:
+                    stat = os.stat(ruta)
+                except OSError:
+                    continue
+                encontrados.append((stat.st_mtime, ruta, _Archivo(stat.st_size, (stat.st_dev, stat.st_ino), stat.st_mtime)))
+
+        with self._lock:
+            for _, ruta, archivo in encontrados:
+                conocido = self._indice.get(ruta)
+                if conocido is not None and conocido.inodo == archivo.inodo:
+                    archivo.ultimo_acceso = max(archivo.ultimo_acceso, conocido.ultimo_acceso)
+            encontrados.sort(key=lambda e: e[2].ultimo_acceso)
+            self._indice = OrderedDict()
+            self._inodos = {}
+            self._bytes = 0
+            for _, ruta, archivo in encontrados:
+                self._agregar(ruta, archivo)
+        self.ultimo_escaneo = time.time()
+
+    # Barrido
+
+    def barrer(self) -> Dict:
+        """Borra las imágenes vencidas y, si se supera la cuota, las menos usadas"""
+        inicio = time.perf_counter()
+        ahora = time.time()
+        victimas: List[Tuple[str, _Archivo, str]] = []
+        with self._lock:
+            while self._indice:
+                ruta, archivo = next(iter(self._indice.items()))
+                sin_uso = ahora - archivo.ultimo_acceso
+                if sin_uso < self.edad_minima:
+                    break
+                if sin_uso > self.ttl:
+                    motivo = "ttl"
+                elif self._bytes > self.max_bytes:
+                    motivo = "cuota"
+                else:
+                    break
+                try:
+                    mtime = os.stat(ruta).st_mtime
+                except OSError:
+                    mtime = 0.0
+                if mtime > archivo.ultimo_acceso:
+                    # Otro worker la usó (o la reescribió): vuelve al final del índice
+                    archivo.ultimo_acceso = mtime
+                    self._indice.move_to_end(ruta)
+                    continue
+                del self._indice[ruta]
+                liberado = self._quitar_inodo(archivo)
+                victimas.append((ruta, archivo if liberado else None, motivo))
+
+        eliminadas = {"ttl": 0, "cuota": 0}
+        for ruta, archivo, motivo in victimas:
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                bitacora.advertencia("limpieza_imagenes_error", f"No se pudo borrar {ruta}: {e}", ruta=ruta)
+                continue
+            for funcion in self._al_eliminar:
+                funcion(ruta)
+            eliminadas[motivo] += 1
+            if archivo is not None:
+                self.bytes_liberados += archivo.bytes
+            _eliminadas_total.incrementar(motivo)
+
+        self.eliminadas_ttl += eliminadas["ttl"]
+        self.eliminadas_cuota += eliminadas["cuota"]
+        self.barridos += 1
+        self.ultimo_barrido = ahora
+        self.duracion_ultimo_barrido_ms = round((time.perf_counter() - inicio) * 1000, 3)
+        if victimas:
+            bitacora.info(
+                "limpieza_imagenes",
+                f"Eliminadas {eliminadas['ttl']} por TTL y {eliminadas['cuota']} por cuota",
+                eliminadas_ttl=eliminadas["ttl"], eliminadas_cuota=eliminadas["cuota"], bytes_en_uso=self._bytes
+            )
+        return eliminadas
+
+    @property
+    def bytes_en_uso(self) -> int:
+        return self._bytes
+
+    def obtener_estadisticas(self) -> Dict:
+        """Uso del directorio de imágenes según el índice"""
+        return {
+            "activo": self.activo,
+            "estado": self.estado,
+            "directorio": self.directorio,
+            "archivos": len(self._indice),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "uso": round(self._bytes / self.max_bytes, 4) if self.max_bytes else None,
+            "ttl_segundos": self.ttl,
+            "eliminadas_ttl": self.eliminadas_ttl,
+            "eliminadas_cuota": self.eliminadas_cuota,
+            "bytes_liberados": self.bytes_liberados,
+            "barridos": self.barridos,
+            "duracion_ultimo_barrido_ms": self.duracion_ultimo_barrido_ms,
+            "ultimo_escaneo": self.ultimo_escaneo,
+        }
+
+
+# Limpiador del proceso (se inicia en el lifespan de app.main)
+limpiador_imagenes = LimpiadorImagenes()
+
+_eliminadas_total = metricas.registro.registrar(metricas.Contador(
+    "rumbia_imagenes_eliminadas_total",
+    "Imágenes borradas de db/ por la limpieza",
+    ("motivo",)
+))
+metricas.registro.registrar(metricas.GaugeFuncion(
+    "rumbia_imagenes_bytes",
+    "Bytes de imágenes en db/ según el índice de la limpieza",
+    lambda: limpiador_imagenes.bytes_en_uso
+))
@@ -0,0 +1,241 @@
+"""
+Métricas de latencia y contadores en formato de texto de Prometheus
+Registro en memoria del proceso, sin dependencias externas: histogramas,
+contadores y gauges con etiquetas, expuestos por GET /metrics.
+
+Observar un valor es un bisect y dos sumas bajo un lock (~1 µs). Los
+procesos del pool de renderizado acumulan sus observaciones y las devuelven
+junto con cada imagen (extraer / combinar), así las etapas del render
+aparecen en las métricas del proceso de la API.
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+# Límites de los buckets de duración (segundos): de 10 µs a 30 s
+BUCKETS_SEGUNDOS = (
+    0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _etiquetas(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = "") -> str:
+    partes = [f'{nombre}="{valor}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histograma:
+    """Histograma acumulativo por combinación de etiquetas"""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        # etiquetas → [conteo por bucket (+Inf al final), suma, cantidad]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *etiquetas: str) -> None:
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def medir(self, *etiquetas: str) -> Iterator[None]:
+        """Observa la duración del bloque (también si termina con excepción)"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, *etiquetas)
+
+    def extraer(self) -> Dict:
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def combinar(self, series: Dict) -> None:
+        with self._lock:
+            for etiquetas, (conteos, suma, cantidad) in series.items():
+                serie = self._series.get(etiquetas)
+                if serie is None:
+                    self._series[etiquetas] = [list(conteos), suma, cantidad]
+                    continue
+                serie[0] = [a + b for a, b in zip(serie[0], conteos)]
+                serie[1] += suma
+                serie[2] += cantidad
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            series = {etiquetas: (list(c), s, n) for etiquetas, (c, s, n) in self._series.items()}
+        lineas = []
+        for etiquetas, (conteos, suma, cantidad) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip((*self.buckets, float("inf")), conteos):
+                acumulado += conteo
+                le = 'le="' + _numero(limite) + '"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {cantidad}")
+        return lineas
+
+
+class Contador:
+    """Contador monótono por combinación de etiquetas"""
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, *etiquetas: str, cantidad: float = 1) -> None:
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + cantidad
+
+    def extraer(self) -> Dict:
+        with self._lock:
+            valores, self._valores = self._valores, {}
+        return valores
+
+    def combinar(self, valores: Dict) -> None:
+        with self._lock:
+            for etiquetas, valor in valores.items():
+                self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            valores = dict(self._valores)
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, e)} {_numero(v)}" for e, v in sorted(valores.items())]
+
+
+class Gauge:
+    """Valor que sube y baja (p. ej. requests en curso)"""
+
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, delta: float, *etiquetas: str) -> None:
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + delta
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            valores = dict(self._valores)
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, e)} {_numero(v)}" for e, v in sorted(valores.items())]
+
+
+class GaugeFuncion:
+    """Gauge cuyo valor se calcula al exponer las métricas"""
+
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, funcion: Callable[[], float]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+
+    def exponer(self) -> List[str]:
+        return [f"{self.nombre} {_numero(self.funcion())}"]
+
+
+class Registro:
+    """Conjunto de métricas del proceso"""
+
+    def __init__(self):
+        self._metricas: Dict[str, object] = {}
+
+    def registrar(self, metrica):
+        self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def extraer(self) -> Dict:
+        """Observaciones acumuladas desde la última extracción (para enviarlas a otro proceso)"""
+        return {
+            nombre: metrica.extraer()
+            for nombre, metrica in self._metricas.items()
+            if hasattr(metrica, "extraer")
+        }
+
+    def combinar(self, observaciones: Dict) -> None:
+        """Suma las observaciones extraídas en otro proceso"""
+        for nombre, valores in observaciones.items():
+            metrica = self._metricas.get(nombre)
+            if metrica is not None and valores:
+                metrica.combinar(valores)
+
+    def exponer(self) -> str:
+        """Todas las métricas en formato de texto de Prometheus (0.0.4)"""
+        lineas = []
+        for metrica in self._metricas.values():
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+# Registro y métricas del proceso
+registro = Registro()
+
+duracion_etapa = registro.registrar(Histograma(
+    "rumbia_etapa_duracion_segundos",
+    "Duración de cada etapa de una cotización o imagen",
+    ("etapa",)
+))
+consultas_cache = registro.registrar(Contador(
+    "rumbia_cache_consultas_total",
+    "Consultas a los caches por resultado (acierto o fallo)",
+    ("cache", "resultado")
+))
+duracion_request = registro.registrar(Histograma(
+    "rumbia_request_duracion_segundos",
+    "Duración de los requests HTTP",
+    ("ruta", "metodo")
+))
+requests_total = registro.registrar(Contador(
+    "rumbia_requests_total",
+    "Requests HTTP atendidos por código de estado",
+    ("ruta", "metodo", "codigo")
+))
+requests_en_curso = registro.registrar(Gauge(
+    "rumbia_requests_en_curso",
+    "Requests HTTP en curso (la ruta se conoce recién al terminar)",
+    ("metodo",)
+))
+
+
+def medir_etapa(etapa: str):
+    """Context manager que observa la duración de la etapa"""
+    return duracion_etapa.medir(etapa)
+
+
+def registrar_cache(cache: str, acierto: bool) -> None:
+    consultas_cache.incrementar(cache, "acierto" if acierto else "fallo")
@@ -0,0 +1,164 @@
+"""
+Motor de cotizaciones vectorizado con NumPy
+Calcula superficies completas de cotizaciones en una sola pasada,
+replicando exactamente las fórmulas escalares de CotizacionService
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+SEXOS = ("M", "F")
+
+
+def redondear(valores: np.ndarray, decimales: int = 2) -> np.ndarray:
+    """
+    Redondea un arreglo con el mismo resultado que round() de Python
+
+    np.round escala y aplica rint, lo que puede diferir de round() cuando el
+    valor escalado cae justo en la mitad. Esos casos frontera (muy pocos) se
+    resuelven elemento a elemento con round() para garantizar paridad exacta.
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    escala = 10.0 ** decimales
+    escalado = valores * escala
+    resultado = np.rint(escalado) / escala
+
+    frontera = np.abs(escalado - np.floor(escalado) - 0.5) < 1e-6
+    if frontera.any():
+        indices = np.nonzero(frontera)
+        resultado[indices] = [round(float(v), decimales) for v in valores[indices]]
+
+    return resultado
+
+
+class MotorVectorizado:
+    """Versión vectorizada de las fórmulas de cotización"""
+
+    def _porcentaje_sin_acotar(self, periodo: np.ndarray, prima: np.ndarray, edad: np.ndarray) -> np.ndarray:
+        """Porcentaje de devolución antes de acotarlo al rango 110%-140%"""
+        periodo = np.asarray(periodo, dtype=np.float64)
+        prima = np.asarray(prima, dtype=np.float64)
+        edad = np.asarray(edad, dtype=np.float64)
+
+        base = 108 + (periodo - 4) * 5.0
+        incremento_exponencial = (periodo - 4) ** 1.3 * 1.8
+        ajuste_prima = (prima / 100) * 0.3
+        ajuste_edad = np.maximum(0, (45 - edad) * 0.08)
+        bonus_largo_plazo = np.where(periodo >= 6, (periodo - 5) * 2.5, 0.0)
+
+        # Mismo orden de suma que la versión escalar para obtener los mismos bits
+        return base + incremento_exponencial + ajuste_prima + ajuste_edad + bonus_largo_plazo
+
+    def generar_porcentaje_devolucion(self, periodo: np.ndarray, prima: np.ndarray, edad: np.ndarray) -> np.ndarray:
+        """Equivalente vectorizado de CotizacionService._generar_porcentaje_devolucion"""
+        porcentaje = self._porcentaje_sin_acotar(periodo, prima, edad)
+        porcentaje = np.maximum(110, np.minimum(porcentaje, 140))
+
+        return redondear(porcentaje, 2)
+
+    def porcentaje_es_entero(self, periodo: np.ndarray, prima: np.ndarray, edad: np.ndarray) -> np.ndarray:
+        """
+        Indica dónde la versión escalar devuelve el porcentaje como int
+
+        max(110, min(p, 140)) devuelve los límites enteros cuando p queda fuera
+        del rango (o p == 110 exacto), y eso cambia su representación en texto
+        ("140" en lugar de "140.0") tanto en los campos como en la tabla.
+        """
+        porcentaje = self._porcentaje_sin_acotar(periodo, prima, edad)
+        return (porcentaje > 140) | (porcentaje <= 110)
+
+    def generar_trea(self, porcentaje_devolucion: np.ndarray, periodo: np.ndarray) -> np.ndarray:
+        """Equivalente vectorizado de CotizacionService._generar_trea"""
+        periodo = np.asarray(periodo, dtype=np.float64)
+
+        tasa_total = porcentaje_devolucion / 100
+        trea = (np.power(tasa_total, 1 / periodo) - 1) * 100
+
+        ajuste_periodo = 1.0 + (periodo - 4) * 0.02
+        trea = trea * ajuste_periodo
+
+        return redondear(np.maximum(1.0, np.minimum(trea, 10.0)), 2)
+
+    def calcular_campos_adicionales(
+        self,
+        porcentaje_devolucion: np.ndarray,
+        trea: np.ndarray,
+        prima: np.ndarray,
+        periodo_pago: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """
+        Equivalente vectorizado de CotizacionService._calcular_campos_adicionales
+
+        Devuelve arreglos ya redondeados en lugar de números sueltos.
+        """
+        prima = np.asarray(prima, dtype=np.float64)
+        periodo_pago = np.asarray(periodo_pago, dtype=np.float64)
+
+        aporte_total = prima * 12 * periodo_pago
+        devolucion_total = aporte_total * (porcentaje_devolucion / 100)
+        ganancia_total = devolucion_total - aporte_total
+        rentabilidad = aporte_total - ganancia_total
+
+        return {
+            "porcentaje_devolucion": redondear(porcentaje_devolucion, 2),
+            "trea": redondear(trea, 2),
+            "aporte_total": redondear(aporte_total, 2),
+            "ganancia_total": redondear(ganancia_total, 2),
+            "devolucion_total": redondear(devolucion_total, 2),
+            "rentabilidad": redondear(rentabilidad, 2)
+        }
+
+    def generar_superficie(
+        self,
+        config: List[Dict],
+        edades: Sequence[int],
+        sexos: Sequence[str] = SEXOS
+    ) -> Dict[str, np.ndarray]:
+        """
+        Genera todas las combinaciones edad × sexo × prima × periodo permitidas
+        por la configuración de periodos y las cotiza en una sola pasada
+
+        Args:
+            config: Configuración de periodos (lista de grupos primas/periodos)
+            edades: Edades actuariales a incluir
+            sexos: Sexos a incluir
+
+        Returns:
+            Diccionario de columnas (arreglos de igual longitud)
+        """
+        edades_arr = np.asarray(list(edades), dtype=np.int64)
+        sexos_arr = np.arange(len(sexos), dtype=np.int64)
+
+        bloques = []
+        for item in config:
+            primas_grupo = np.asarray(item["primas"], dtype=np.float64)
+            periodos_grupo = np.asarray(item["periodos"], dtype=np.int64)
+            if not len(primas_grupo) or not len(periodos_grupo):
+                continue
+            bloques.append(
+                np.meshgrid(edades_arr, sexos_arr, primas_grupo, periodos_grupo, indexing="ij")
+            )
+
+        if bloques:
+            edad = np.concatenate([b[0].ravel() for b in bloques])
+            sexo_idx = np.concatenate([b[1].ravel() for b in bloques])
+            prima = np.concatenate([b[2].ravel() for b in bloques])
+            periodo = np.concatenate([b[3].ravel() for b in bloques])
+        else:
+            edad = np.empty(0, dtype=np.int64)
+            sexo_idx = np.empty(0, dtype=np.int64)
+            prima = np.empty(0, dtype=np.float64)
+            periodo = np.empty(0, dtype=np.int64)
+
+        porcentaje = self.generar_porcentaje_devolucion(periodo, prima, edad)
+        trea = self.generar_trea(porcentaje, periodo)
+        campos = self.calcular_campos_adicionales(porcentaje, trea, prima, periodo)
+
+        return {
+            "edad_actuarial": edad,
+            "sexo": np.asarray(sexos, dtype=object)[sexo_idx] if len(sexos) else np.empty(0, dtype=object),
+            "prima": prima,
+            "periodo": periodo,
+            **campos
+        }
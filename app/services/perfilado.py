@@ -0,0 +1,199 @@
+"""
+Perfilado opcional de requests individuales
+Con PERFILADO=1 se instala un middleware que corre cProfile durante un
+request cuando este lo pide (header X-Perfilar o parámetro ?perfilar=) o le
+toca por muestreo (1 de cada PERFILADO_MUESTREO requests). Sin PERFILADO el
+middleware no se instala y no hay costo alguno.
+
+Modos:
+    archivo     el perfil se guarda en PERFILADO_DIR como .prof (pstats; se abre
+                con `python -m pstats` o snakeviz) y el nombre va en el header X-Perfil
+    texto       la respuesta se reemplaza por el resumen de pstats en texto plano
+
+Si el request renderiza una imagen en el pool, el worker perfila ese render
+por separado (<nombre>_render.prof), porque corre en otro proceso.
+
+cProfile perfila el hilo del event loop: mientras el request espera, lo que
+hagan otros requests en el mismo loop también aparece en el perfil. Se
+perfila un request a la vez por proceso; los demás pedidos mientras tanto se
+atienden sin perfil (se cuentan como omitidos).
+"""
+import io
+import os
+import time
+import uuid
+import cProfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+from urllib.parse import parse_qs
+
+from app.services.bitacora import bitacora
+
+
+PERFILADO = os.getenv("PERFILADO", "0") == "1"
+PERFILADO_DIR = os.getenv("PERFILADO_DIR", "perfiles")
+# Perfilar 1 de cada N requests sin que lo pidan (0 = solo a pedido)
+PERFILADO_MUESTREO = int(os.getenv("PERFILADO_MUESTREO", "0"))
+# Funciones que se listan en el modo texto
+PERFILADO_TOP = int(os.getenv("PERFILADO_TOP", "40"))
+
+MODOS = ("archivo", "texto")
+
+# Ruta base (sin extensión) del perfil del request en curso
+_perfil_en_curso: ContextVar[Optional[str]] = ContextVar("perfil_en_curso", default=None)
+
+
+def ruta_perfil_render() -> Optional[str]:
+    """Ruta donde el worker debe guardar el perfil del render (None si el request no se perfila)"""
+    base = _perfil_en_curso.get()
+    return None if base is None else f"{base}_render.prof"
+
+
+@contextmanager
+def perfilar(ruta: str) -> Iterator[None]:
+    """Perfila el bloque y guarda el resultado en ruta (se usa en los workers de renderizado)"""
+    perfil = cProfile.Profile()
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        perfil.dump_stats(ruta)
+
+
+class Perfilador:
+    """Decide qué requests se perfilan y lleva la cuenta"""
+
+    def __init__(self, directorio: str = PERFILADO_DIR, muestreo: int = PERFILADO_MUESTREO, top: int = PERFILADO_TOP):
+        self.directorio = directorio
+        self.muestreo = max(0, muestreo)
+        self.top = top
+        self.ocupado = False
+        self._requests = 0
+
+        self.perfilados = 0
+        self.omitidos = 0
+        self.ultimo_perfil: Optional[str] = None
+
+    def modo(self, scope) -> Optional[str]:
+        """Modo pedido por el request (header o query) o por muestreo; None si no se perfila"""
+        for nombre, valor in scope["headers"]:
+            if nombre == b"x-perfilar":
+                valor = valor.decode("latin-1").strip().lower()
+                return valor if valor in MODOS else "archivo"
+        query = scope.get("query_string", b"")
+        if b"perfilar" in query:
+            valor = parse_qs(query.decode("latin-1")).get("perfilar", [""])[0].lower()
+            return valor if valor in MODOS else "archivo"
+        if self.muestreo:
+            self._requests += 1
+            if self._requests % self.muestreo == 0:
+                return "archivo"
+        return None
+
+    def nueva_ruta(self, scope) -> str:
+        """Ruta base del perfil: fecha, endpoint e identificador"""
+        os.makedirs(self.directorio, exist_ok=True)
+        endpoint = scope["path"].strip("/").replace("/", "_") or "raiz"
+        nombre = f"{time.strftime('%Y%m%dT%H%M%S')}_{endpoint}_{uuid.uuid4().hex[:8]}"
+        return os.path.join(self.directorio, nombre)
+
+    def resumen(self, perfil: cProfile.Profile, base: str) -> str:
+        """Resumen en texto del perfil del request y, si lo hubo, del render en el worker"""
+        import pstats
+
+        salida = io.StringIO()
+        salida.write("# Proceso de la API\n")
+        pstats.Stats(perfil, stream=salida).sort_stats("cumulative").print_stats(self.top)
+        render = f"{base}_render.prof"
+        if os.path.exists(render):
+            salida.write("\n# Worker de renderizado\n")
+            pstats.Stats(render, stream=salida).sort_stats("cumulative").print_stats(self.top)
+        return salida.getvalue()
+
+    def obtener_estadisticas(self) -> Dict:
+        return {
+            "directorio": os.path.abspath(self.directorio),
+            "muestreo": self.muestreo,
+            "perfilados": self.perfilados,
+            "omitidos": self.omitidos,
+            "ultimo_perfil": self.ultimo_perfil,
+        }
+
+
+class PerfiladoMiddleware:
+    """
+    Middleware ASGI puro que perfila los requests elegidos por el perfilador
+
+    Solo se instala con PERFILADO=1 (ver app.main).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.perfilador = perfilador
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        modo = self.perfilador.modo(scope)
+        if modo is None:
+            await self.app(scope, receive, send)
+            return
+        if self.perfilador.ocupado:
+            self.perfilador.omitidos += 1
+            await self.app(scope, receive, send)
+            return
+
+        base = self.perfilador.nueva_ruta(scope)
+        nombre = os.path.basename(base) + ".prof"
+        respuesta = {"status": 500}
+
+        async def enviar(mensaje):
+            if modo == "texto":
+                # La respuesta original se descarta; solo se guarda su estado
+                if mensaje["type"] == "http.response.start":
+                    respuesta["status"] = mensaje["status"]
+                return
+            if mensaje["type"] == "http.response.start":
+                mensaje = {**mensaje, "headers": [*mensaje.get("headers", []), (b"x-perfil", nombre.encode())]}
+            await send(mensaje)
+
+        self.perfilador.ocupado = True
+        token = _perfil_en_curso.set(base)
+        perfil = cProfile.Profile()
+        inicio = time.perf_counter()
+        perfil.enable()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            perfil.disable()
+            _perfil_en_curso.reset(token)
+            self.perfilador.ocupado = False
+            self.perfilador.perfilados += 1
+            segundos = round(time.perf_counter() - inicio, 3)
+            if modo == "archivo":
+                perfil.dump_stats(base + ".prof")
+                self.perfilador.ultimo_perfil = nombre
+                bitacora.info("perfil", f"{scope['method']} {scope['path']} en {segundos} s: {nombre}", archivo=nombre, segundos=segundos)
+
+        if modo == "texto":
+            cuerpo = self.perfilador.resumen(perfil, base).encode("utf-8")
+            # El perfil del render ya va en el texto; no queda nada en el directorio
+            if os.path.exists(f"{base}_render.prof"):
+                os.remove(f"{base}_render.prof")
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(cuerpo)).encode()),
+                    (b"x-estado-original", str(respuesta["status"]).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": cuerpo})
+
+
+# Perfilador del proceso
+perfilador = Perfilador()
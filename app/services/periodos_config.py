@@ -0,0 +1,118 @@
+"""
+Configuración de periodos indexada y recargable en caliente
+Carga periodos_cotizacion.json una sola vez en un índice prima → periodos
+y solo lo vuelve a leer cuando el archivo cambia en disco
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.services.bitacora import bitacora
+
+
+def clave_prima(prima: float) -> int:
+    """Clave canónica de una prima: su valor en céntimos (300, 300.0 y 300.001 → 30000)"""
+    return int(round(float(prima) * 100))
+
+
+def huella_config(config: List[Dict]) -> str:
+    """Huella estable del contenido de la configuración (independiente del formato del archivo)"""
+    contenido = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(contenido.encode()).hexdigest()[:16]
+
+
+class ConfiguracionPeriodos:
+    """Foto inmutable de la configuración de periodos con su índice"""
+
+    __slots__ = ("config", "version", "indice", "cargada_en")
+
+    def __init__(self, config: List[Dict]):
+        self.config = config
+        self.version = huella_config(config)
+        self.cargada_en = datetime.now()
+
+        indice: Dict[int, Tuple[int, ...]] = {}
+        for item in config:
+            periodos = tuple(item["periodos"])
+            for prima in item["primas"]:
+                # Igual que el recorrido lineal original: gana el primer grupo
+                indice.setdefault(clave_prima(prima), periodos)
+        self.indice = indice
+
+    def periodos_para_prima(self, prima: float) -> List[int]:
+        """Periodos disponibles para la prima (lista vacía si no está configurada)"""
+        return list(self.indice.get(clave_prima(prima), ()))
+
+
+class RegistroPeriodos:
+    """
+    Mantiene la configuración de periodos activa
+
+    Revisa el mtime del archivo como máximo una vez por intervalo_revision
+    segundos; si cambió, lo vuelve a leer y solo reemplaza la configuración
+    activa cuando cambia el contenido. El reemplazo es una sola asignación,
+    así que un request nunca ve una configuración a medio cargar.
+    """
+
+    def __init__(self, ruta: str, intervalo_revision: float = 1.0):
+        self.ruta = ruta
+        self.intervalo_revision = intervalo_revision
+        self._lock = threading.Lock()
+        self._actual: Optional[ConfiguracionPeriodos] = None
+        self._mtime: Optional[int] = None
+        self._ultima_revision = 0.0
+        self.recargas = 0
+
+    def _leer(self) -> Tuple[List[Dict], int]:
+        mtime = os.stat(self.ruta).st_mtime_ns
+        with open(self.ruta, 'r', encoding='utf-8') as f:
+            return json.load(f), mtime
+
+    def _revisar(self) -> None:
+        """Recarga la configuración si el archivo cambió desde la última revisión"""
+        with self._lock:
+            ahora = time.monotonic()
+            if self._actual is not None and ahora - self._ultima_revision < self.intervalo_revision:
+                return
+            self._ultima_revision = ahora
+
+            try:
+                if self._actual is not None and os.stat(self.ruta).st_mtime_ns == self._mtime:
+                    return
+                config, mtime = self._leer()
+            except (OSError, ValueError) as e:
+                if self._actual is None:
+                    raise
+                bitacora.error("config_periodos_error", f"No se pudo recargar {self.ruta}, se mantiene la versión {self._actual.version}: {e}")
+                return
+
+            self._mtime = mtime
+            nueva = ConfiguracionPeriodos(config)
+            if self._actual is not None and nueva.version == self._actual.version:
+                # Cambió el mtime pero no el contenido
+                return
+
+            if self._actual is not None:
+                self.recargas += 1
+                bitacora.info("config_periodos", f"Recargada: versión {self._actual.version} → {nueva.version}", version=nueva.version)
+            self._actual = nueva
+
+    def actual(self) -> ConfiguracionPeriodos:
+        """Configuración activa (recargándola antes si el archivo cambió)"""
+        if self._actual is None or time.monotonic() - self._ultima_revision >= self.intervalo_revision:
+            self._revisar()
+        return self._actual
+
+    def obtener_estadisticas(self) -> Dict:
+        """Versión activa y datos de la última carga"""
+        actual = self.actual()
+        return {
+            "version": actual.version,
+            "cargada_en": actual.cargada_en.isoformat(),
+            "total_primas": len(actual.indice),
+            "recargas": self.recargas,
+        }
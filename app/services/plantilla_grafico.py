@@ -0,0 +1,142 @@
+"""
+Renderizador de gráficos basado en plantillas
+Arma y estiliza la figura una sola vez por proceso (por cantidad de periodos);
+en cada request solo actualiza los datos de las líneas, el título, la leyenda
+y el texto de la tabla antes de rasterizar. El layout es fijo, así que no hace
+falta tight_layout ni bbox_inches='tight' (que dibujan la figura dos veces).
+"""
+import threading
+from typing import Dict, Optional
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from app.services.datos_grafico import (
+    COLORES,
+    COLUMNAS,
+    ANCHOS_COLUMNAS,
+    COLOR_ENCABEZADO,
+    COLORES_FILAS,
+    TAMANO_FIGURA,
+    POSICION_GRAFICO,
+    POSICION_TABLA,
+    DatosGrafico
+)
+from app.services.metricas import medir_etapa
+
+
+def opciones_guardado(formato: str, calidad: Optional[int]) -> Dict:
+    """Argumentos extra de savefig (calidad de JPEG/WebP vía Pillow)"""
+    if calidad is not None and formato in ("jpeg", "webp"):
+        return {"pil_kwargs": {"quality": calidad}}
+    return {}
+
+
+class PlantillaGrafico:
+    """Figura preconstruida para una cantidad fija de periodos"""
+
+    def __init__(self, cantidad_series: int):
+        self.cantidad_series = cantidad_series
+        self.fig = Figure(figsize=TAMANO_FIGURA)
+        self.canvas = FigureCanvasAgg(self.fig)
+
+        # Gráfico
+        self.ax_plot = self.fig.add_axes(POSICION_GRAFICO)
+        self.lineas = [
+            self.ax_plot.plot(
+                [], [],
+                label=" ",
+                marker='o',
+                linewidth=2.5,
+                markersize=6,
+                color=COLORES[idx % len(COLORES)]
+            )[0]
+            for idx in range(cantidad_series)
+        ]
+        self.ax_plot.set_xlabel("Años", fontsize=12, fontweight='bold')
+        self.ax_plot.set_ylabel("Porcentaje de devolución", fontsize=12, fontweight='bold')
+        self.titulo = self.ax_plot.set_title(" ", fontsize=14, fontweight='bold', pad=20)
+        self.leyenda = self.ax_plot.legend(fontsize=10, loc='upper left')
+        self.ax_plot.grid(True, alpha=0.3, linestyle='--')
+        self.ax_plot.spines['top'].set_visible(False)
+        self.ax_plot.spines['right'].set_visible(False)
+
+        # Tabla
+        ax_table = self.fig.add_axes(POSICION_TABLA)
+        ax_table.axis("off")
+        self.tabla = ax_table.table(
+            cellText=[[""] * len(COLUMNAS) for _ in range(cantidad_series)],
+            colLabels=COLUMNAS,
+            loc="center",
+            cellLoc="center",
+            colWidths=ANCHOS_COLUMNAS
+        )
+        self.tabla.auto_set_font_size(False)
+        self.tabla.set_fontsize(10)
+        self.tabla.scale(1, 2.5)
+
+        for j in range(len(COLUMNAS)):
+            cell = self.tabla[(0, j)]
+            cell.set_facecolor(COLOR_ENCABEZADO)
+            cell.set_text_props(weight='bold', color='white')
+
+        for i in range(1, cantidad_series + 1):
+            for j in range(len(COLUMNAS)):
+                self.tabla[(i, j)].set_facecolor(COLORES_FILAS[i % 2 == 0])
+
+        self._lock = threading.Lock()
+
+    def renderizar(
+        self,
+        datos: DatosGrafico,
+        archivo_salida: str,
+        formato: str = "jpeg",
+        dpi: float = 300,
+        calidad: Optional[int] = None
+    ) -> None:
+        """Actualiza la plantilla con los datos del request y guarda la imagen"""
+        with self._lock:
+            with medir_etapa("construccion_figura"):
+                for linea, texto_leyenda, serie in zip(self.lineas, self.leyenda.get_texts(), datos.series):
+                    linea.set_data(serie.años, serie.valores)
+                    linea.set_label(serie.etiqueta)
+                    texto_leyenda.set_text(serie.etiqueta)
+
+                self.ax_plot.relim()
+                self.ax_plot.autoscale_view()
+                self.titulo.set_text(datos.titulo)
+
+                for i, fila in enumerate(datos.filas, start=1):
+                    for j, valor in enumerate(fila):
+                        self.tabla[(i, j)].get_text().set_text(valor)
+
+            with medir_etapa("savefig"):
+                self.fig.savefig(archivo_salida, format=formato, dpi=dpi, **opciones_guardado(formato, calidad))
+
+
+# Plantillas de este proceso, una por cantidad de periodos
+_plantillas: Dict[int, PlantillaGrafico] = {}
+_plantillas_lock = threading.Lock()
+
+
+def obtener_plantilla(cantidad_series: int) -> PlantillaGrafico:
+    """Devuelve (creándola la primera vez) la plantilla para esa cantidad de periodos"""
+    plantilla = _plantillas.get(cantidad_series)
+    if plantilla is None:
+        with _plantillas_lock:
+            plantilla = _plantillas.get(cantidad_series)
+            if plantilla is None:
+                plantilla = PlantillaGrafico(cantidad_series)
+                _plantillas[cantidad_series] = plantilla
+    return plantilla
+
+
+def renderizar_con_plantilla(
+    datos: DatosGrafico,
+    archivo_salida: str,
+    formato: str = "jpeg",
+    dpi: float = 300,
+    calidad: Optional[int] = None
+) -> None:
+    """Renderiza el gráfico reutilizando la plantilla del proceso"""
+    obtener_plantilla(len(datos.series)).renderizar(datos, archivo_salida, formato=formato, dpi=dpi, calidad=calidad)
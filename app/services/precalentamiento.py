@@ -0,0 +1,264 @@
+"""
+Precalentamiento del almacén de imágenes (y opcionalmente del cache de colecciones)
+Con PRECALENTAMIENTO=1, al iniciar la API se renderizan en segundo plano los
+gráficos de las combinaciones configuradas (primas de periodos_cotizacion.json
+× edades × sexos), para que el primer request de cada una no pague el render.
+El almacén de imágenes se comparte entre procesos y no vence con el TTL del
+cache de colecciones, así que lo precalentado sigue sirviendo después.
+
+Con PRECALENTAMIENTO_SUBIR=1 además se sube cada imagen y la colección queda
+en el cache; como esas entradas vencen a los COLECCIONES_CACHE_TTL segundos,
+en ese modo el recorrido se corta al cumplirse ese tiempo.
+
+Lo ejecuta un solo proceso por máquina (el que toma el bloqueo de archivo
+PRECALENTAMIENTO_BLOQUEO); los demás workers de uvicorn no lo repiten. No
+retiene /ready, que solo informa el avance. Cede ante el tráfico real (espera
+mientras hay renders en curso) y limita el tiempo de render que consume a la
+fracción PRECALENTAMIENTO_CPU (la espera de red de la subida no cuenta).
+"""
+import os
+import time
+import fcntl
+import asyncio
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.schemas.cotizacion import CotizacionColeccionRequest, ParametrosCotizacionSinPeriodo
+from app.services.cotizacion_service import CotizacionService, GRILLA_EDAD_MIN, GRILLA_EDAD_MAX
+from app.services.ejecutor_render import ejecutor_render
+from app.services.bitacora import bitacora
+from app.services.almacen_imagenes import DIRECTORIO_PUBLICACION
+
+
+PRECALENTAMIENTO_HABILITADO = os.getenv("PRECALENTAMIENTO", "0") == "1"
+PRECALENTAMIENTO_EDAD_MIN = int(os.getenv("PRECALENTAMIENTO_EDAD_MIN", str(GRILLA_EDAD_MIN)))
+PRECALENTAMIENTO_EDAD_MAX = int(os.getenv("PRECALENTAMIENTO_EDAD_MAX", str(GRILLA_EDAD_MAX)))
+PRECALENTAMIENTO_SEXOS = [s.strip() for s in os.getenv("PRECALENTAMIENTO_SEXOS", "M,F").split(",") if s.strip()]
+# Primas más pedidas primero (las demás siguen en el orden de la configuración)
+PRECALENTAMIENTO_PRIMAS = [float(p) for p in os.getenv("PRECALENTAMIENTO_PRIMAS", "").split(",") if p.strip()]
+# Fracción de CPU que puede usar (0-1): tras cada render descansa en proporción a lo que tardó
+PRECALENTAMIENTO_CPU = float(os.getenv("PRECALENTAMIENTO_CPU", "0.25"))
+# Máximo de combinaciones: 200 imágenes JPEG a 300 dpi (~0,4 MB c/u) ocupan
+# menos de un tercio de la cuota de LIMPIEZA_IMAGENES_MAX_BYTES
+PRECALENTAMIENTO_MAX = int(os.getenv("PRECALENTAMIENTO_MAX", "200"))
+PRECALENTAMIENTO_ESPERA_INICIAL = float(os.getenv("PRECALENTAMIENTO_ESPERA_INICIAL", "2"))
+# Si es 1 también sube las imágenes y guarda las colecciones en cache (por
+# defecto no: cada arranque subiría cientos de archivos al servicio externo)
+PRECALENTAMIENTO_SUBIR = os.getenv("PRECALENTAMIENTO_SUBIR", "0") == "1"
+# Con subida, las colecciones precalentadas vencen a los COLECCIONES_CACHE_TTL
+# segundos: más allá de ese tiempo se estaría reemplazando lo ya precalentado
+PRECALENTAMIENTO_DURACION_MAX = float(os.getenv(
+    "PRECALENTAMIENTO_DURACION_MAX", os.getenv("COLECCIONES_CACHE_TTL", "600")
+))
+# Archivo de bloqueo: solo un proceso de la máquina precalienta
+PRECALENTAMIENTO_BLOQUEO = os.getenv(
+    "PRECALENTAMIENTO_BLOQUEO",
+    os.path.join(os.path.dirname(DIRECTORIO_PUBLICACION), "datos", "precalentamiento.lock")
+)
+
+
+def ordenar_primas(config: List[Dict], prioridad: List[float]) -> List[float]:
+    """Primas de la configuración, primero las de prioridad (en ese orden)"""
+    primas = []
+    for grupo in config:
+        for prima in grupo.get("primas", []):
+            if prima not in primas:
+                primas.append(prima)
+    primeras = [p for p in prioridad if p in primas]
+    return primeras + [p for p in primas if p not in primeras]
+
+
+class Precalentador:
+    """
+    Recorre las combinaciones en orden de prioridad y renderiza cada gráfico
+    en el pool (con subir, además arma la colección con
+    CotizacionService.crear_cotizacion_coleccion_async, que reutiliza la imagen)
+
+    - Antes de cada combinación espera a que el pool de renderizado esté
+      libre, para no quitarle lugar a los requests reales
+    - Tras cada render descansa tiempo_render * (1 / cpu - 1)
+    - Con subir, no empieza combinaciones nuevas pasados duracion_max segundos
+    """
+
+    def __init__(
+        self,
+        habilitado: bool = PRECALENTAMIENTO_HABILITADO,
+        edades: range = range(PRECALENTAMIENTO_EDAD_MIN, PRECALENTAMIENTO_EDAD_MAX + 1),
+        sexos: List[str] = PRECALENTAMIENTO_SEXOS,
+        prioridad: List[float] = PRECALENTAMIENTO_PRIMAS,
+        cpu: float = PRECALENTAMIENTO_CPU,
+        maximo: int = PRECALENTAMIENTO_MAX,
+        subir: bool = PRECALENTAMIENTO_SUBIR,
+        duracion_max: float = PRECALENTAMIENTO_DURACION_MAX,
+        bloqueo: str = PRECALENTAMIENTO_BLOQUEO
+    ):
+        self.habilitado = habilitado
+        self.edades = edades
+        self.sexos = sexos
+        self.prioridad = prioridad
+        self.cpu = min(1.0, max(0.01, cpu))
+        self.maximo = maximo
+        self.subir = subir
+        self.duracion_max = duracion_max
+        self.bloqueo = bloqueo
+        self._tarea: Optional[asyncio.Task] = None
+        self._fd_bloqueo: Optional[int] = None
+
+        self.estado = "deshabilitado" if not habilitado else "pendiente"
+        self.total = 0
+        self.completadas = 0
+        self.errores = 0
+        self.omitidas = 0
+        self.esperas_trafico = 0
+        self.segundos_render = 0.0
+        self._inicio: Optional[float] = None
+        self._fin: Optional[float] = None
+
+    def combinaciones(self, service: CotizacionService) -> Iterator[Tuple[float, int, str]]:
+        """(prima, edad, sexo) en orden de prioridad, hasta maximo combinaciones"""
+        primas = ordenar_primas(service._cargar_periodos_config(), self.prioridad)
+        cantidad = 0
+        for prima in primas:
+            for edad in self.edades:
+                for sexo in self.sexos:
+                    if cantidad >= self.maximo:
+                        return
+                    cantidad += 1
+                    yield prima, edad, sexo
+
+    def iniciar(self) -> None:
+        """Lanza el precalentamiento en segundo plano (no bloquea el arranque)"""
+        if self.habilitado and self._tarea is None:
+            self._tarea = asyncio.get_running_loop().create_task(self._ejecutar())
+
+    async def detener(self) -> None:
+        if self._tarea is not None and not self._tarea.done():
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+        self._liberar_bloqueo()
+
+    def _tomar_bloqueo(self) -> bool:
+        """True si este proceso queda a cargo del precalentamiento"""
+        os.makedirs(os.path.dirname(self.bloqueo) or ".", exist_ok=True)
+        fd = os.open(self.bloqueo, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd_bloqueo = fd
+        return True
+
+    def _liberar_bloqueo(self) -> None:
+        if self._fd_bloqueo is not None:
+            os.close(self._fd_bloqueo)  # cerrar el descriptor libera el flock
+            self._fd_bloqueo = None
+
+    async def _esperar_trafico(self) -> None:
+        """Espera mientras haya renders en curso (de requests reales)"""
+        if ejecutor_render.ocupado:
+            self.esperas_trafico += 1
+            while ejecutor_render.ocupado:
+                await asyncio.sleep(0.05)
+
+    async def _ejecutar(self) -> None:
+        try:
+            await self._precalentar()
+        except asyncio.CancelledError:
+            self.estado = "cancelado"
+            raise
+        except Exception as e:
+            self.estado = "error"
+            bitacora.error("precalentamiento_error", str(e), excepcion=e)
+        finally:
+            self._liberar_bloqueo()
+
+    async def _precalentar_combinacion(self, service: CotizacionService, request: CotizacionColeccionRequest) -> float:
+        """Renderiza el gráfico (y con subir arma la colección); devuelve los segundos de render"""
+        inicio = time.perf_counter()
+        data = service.datos_grafico_coleccion(request)
+        if data is None:
+            return 0.0
+        imagen = await ejecutor_render.renderizar(data=data, renderizador=request.renderizador, opciones=request.imagen)
+        segundos = time.perf_counter() - inicio
+        if not imagen.reutilizada:
+            # El tiempo en el worker, no la espera del pool
+            segundos = imagen.tiempo_render_ms / 1000
+        if self.subir:
+            # Reutiliza la imagen recién guardada; solo se suma la subida (red, no cuenta)
+            await service.crear_cotizacion_coleccion_async(request)
+        return segundos
+
+    async def _precalentar(self) -> None:
+        service = CotizacionService()
+        # Dejar pasar los primeros requests (health checks) antes de empezar
+        await asyncio.sleep(PRECALENTAMIENTO_ESPERA_INICIAL)
+
+        if not self._tomar_bloqueo():
+            self.estado = "en_otro_proceso"
+            bitacora.info("precalentamiento", "Otro proceso ya está precalentando", bloqueo=self.bloqueo)
+            return
+
+        combinaciones = list(self.combinaciones(service))
+        self.total = len(combinaciones)
+        self.estado = "precalentando"
+        self._inicio = time.monotonic()
+        bitacora.info(
+            "precalentamiento",
+            f"Iniciado: {self.total} combinaciones, CPU máxima {self.cpu:.0%}, subida {'sí' if self.subir else 'no'}",
+            combinaciones=self.total, subir=self.subir
+        )
+
+        for prima, edad, sexo in combinaciones:
+            if self.subir and time.monotonic() - self._inicio >= self.duracion_max:
+                # Las primeras colecciones ya empiezan a vencer en el cache
+                self.omitidas = self.total - self.completadas
+                break
+            await self._esperar_trafico()
+            segundos = 0.0
+            try:
+                segundos = await self._precalentar_combinacion(service, CotizacionColeccionRequest(
+                    producto="RUMBO",
+                    parametros=ParametrosCotizacionSinPeriodo(prima=prima, edad_actuarial=edad, sexo=sexo)
+                ))
+            except Exception as e:
+                self.errores += 1
+                bitacora.advertencia("precalentamiento_error", str(e), prima=prima, edad=edad, sexo=sexo)
+            self.completadas += 1
+            self.segundos_render += segundos
+            await asyncio.sleep(segundos * (1 / self.cpu - 1))
+
+        self._fin = time.monotonic()
+        self.estado = "listo"
+        bitacora.info(
+            "precalentamiento",
+            f"Listo: {self.completadas} combinaciones en {self._fin - self._inicio:.1f} s "
+            f"({self.errores} errores, {self.omitidas} omitidas por vencimiento)",
+            combinaciones=self.completadas, errores=self.errores, omitidas=self.omitidas,
+            segundos=round(self._fin - self._inicio, 3)
+        )
+
+    def obtener_estadisticas(self) -> Dict:
+        """Estado y avance del precalentamiento"""
+        duracion = None
+        if self._inicio is not None:
+            duracion = round((self._fin or time.monotonic()) - self._inicio, 1)
+        return {
+            "estado": self.estado,
+            "total": self.total,
+            "completadas": self.completadas,
+            "porcentaje": round(100 * self.completadas / self.total, 1) if self.total else None,
+            "errores": self.errores,
+            "omitidas": self.omitidas,
+            "esperas_trafico": self.esperas_trafico,
+            "cpu_maxima": self.cpu,
+            "segundos_render": round(self.segundos_render, 3),
+            "subir": self.subir,
+            "duracion_s": duracion,
+        }
+
+
+# Precalentador del proceso
+precalentador = Precalentador()
@@ -0,0 +1,321 @@
+"""
+Renderizador rápido de gráficos con Pillow
+Dibuja el mismo gráfico y tabla que los renderizadores de matplotlib (mismo
+layout que plantilla_grafico) directamente sobre una imagen, sin importar
+matplotlib: unos milisegundos por imagen y mucha menos memoria por worker.
+Las medidas están en puntos (1/72 de pulgada) y se escalan según el dpi.
+"""
+import os
+import math
+import importlib.util
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from app.services.datos_grafico import (
+    COLORES,
+    COLUMNAS,
+    ANCHOS_COLUMNAS,
+    COLOR_ENCABEZADO,
+    COLORES_FILAS,
+    TAMANO_FIGURA,
+    POSICION_GRAFICO,
+    POSICION_TABLA,
+    DatosGrafico
+)
+from app.services.metricas import medir_etapa
+
+
+# Estilo por defecto de matplotlib, en puntos
+ANCHO_LINEA = 2.5
+DIAMETRO_MARCADOR = 7.0          # markersize 6 + borde de 1
+ANCHO_EJE = 0.8
+LARGO_MARCA = 3.5
+SEPARACION_MARCA = 3.5
+SEPARACION_ETIQUETA = 4.0
+SEPARACION_ETIQUETA_X = 7.0
+BORDE_TABLA = 0.5                # cada celda tapa la mitad del borde de la anterior
+SEPARACION_TITULO = 20.0
+COLOR_GRILLA = (231, 231, 231)  # '#b0b0b0' con alpha 0.3 sobre blanco
+TRAZO_GRILLA = (2.96, 1.28)     # '--' para un ancho de 0.8
+ALTO_FILA_TABLA = 29.8
+MARGEN_EJES = 0.05
+PASOS_EJE = (1, 2, 2.5, 5, 10)
+MAX_INTERVALOS_EJE = 8
+
+# Fuentes: variables de entorno, DejaVu/Liberation del sistema o las que trae matplotlib
+FUENTE_GRAFICO = os.getenv("FUENTE_GRAFICO")
+FUENTE_GRAFICO_NEGRITA = os.getenv("FUENTE_GRAFICO_NEGRITA")
+_FUENTES_SISTEMA = {
+    False: (
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    ),
+    True: (
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    ),
+}
+
+Punto = Tuple[float, float]
+
+
+def _fuentes_matplotlib(negrita: bool) -> Optional[str]:
+    """Ruta de DejaVu dentro del paquete matplotlib, sin importarlo"""
+    spec = importlib.util.find_spec("matplotlib")
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    nombre = "DejaVuSans-Bold.ttf" if negrita else "DejaVuSans.ttf"
+    return os.path.join(spec.submodule_search_locations[0], "mpl-data", "fonts", "ttf", nombre)
+
+
+@lru_cache(maxsize=2)
+def _ruta_fuente(negrita: bool) -> Optional[str]:
+    candidatas = [FUENTE_GRAFICO_NEGRITA if negrita else FUENTE_GRAFICO, *_FUENTES_SISTEMA[negrita], _fuentes_matplotlib(negrita)]
+    for ruta in candidatas:
+        if ruta and os.path.exists(ruta):
+            return ruta
+    return None
+
+
+@lru_cache(maxsize=32)
+def _fuente(tamano_px: int, negrita: bool = False) -> ImageFont.FreeTypeFont:
+    ruta = _ruta_fuente(negrita)
+    if ruta is None:
+        return ImageFont.load_default(tamano_px)
+    return ImageFont.truetype(ruta, tamano_px)
+
+
+def _color(hexadecimal: str) -> Tuple[int, int, int]:
+    hexadecimal = hexadecimal.lstrip("#")
+    return tuple(int(hexadecimal[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def _marcas_eje(minimo: float, maximo: float) -> Tuple[float, float, List[float]]:
+    """
+    Límites con margen del 5% y marcas "redondas" (como el AutoLocator de
+    matplotlib: paso 1, 2, 2.5 o 5 por potencia de 10)
+    """
+    if maximo == minimo:
+        minimo, maximo = minimo - 1, maximo + 1
+    margen = (maximo - minimo) * MARGEN_EJES
+    minimo, maximo = minimo - margen, maximo + margen
+
+    base = 10 ** math.floor(math.log10((maximo - minimo) / MAX_INTERVALOS_EJE))
+    for paso in PASOS_EJE:
+        paso *= base
+        if math.floor(maximo / paso) - math.ceil(minimo / paso) <= MAX_INTERVALOS_EJE:
+            break
+    marcas = [i * paso for i in range(math.ceil(minimo / paso), math.floor(maximo / paso) + 1)]
+    return minimo, maximo, marcas
+
+
+def _texto_marca(valor: float) -> str:
+    valor = round(valor, 10)
+    return f"{valor:g}" if valor != int(valor) else str(int(valor))
+
+
+class LienzoRapido:
+    """Imagen de la figura con conversión de puntos y fracciones a píxeles"""
+
+    def __init__(self, dpi: float):
+        self.escala = dpi / 72
+        self.ancho = round(TAMANO_FIGURA[0] * dpi)
+        self.alto = round(TAMANO_FIGURA[1] * dpi)
+        self.imagen = Image.new("RGB", (self.ancho, self.alto), "white")
+        self.draw = ImageDraw.Draw(self.imagen)
+
+    def pt(self, puntos: float) -> int:
+        return max(1, round(puntos * self.escala))
+
+    def caja(self, posicion) -> Tuple[float, float, float, float]:
+        """(izquierda, arriba, derecha, abajo) en píxeles de una posición de ejes"""
+        izq, abajo, ancho, alto = posicion
+        return (
+            izq * self.ancho,
+            (1 - abajo - alto) * self.alto,
+            (izq + ancho) * self.ancho,
+            (1 - abajo) * self.alto,
+        )
+
+    def fuente(self, puntos: float, negrita: bool = False) -> ImageFont.FreeTypeFont:
+        return _fuente(self.pt(puntos), negrita)
+
+    def texto(self, xy: Punto, texto: str, fuente, ancla: str, color="black") -> None:
+        self.draw.text(xy, texto, font=fuente, fill=color, anchor=ancla)
+
+    def texto_vertical(self, xy: Punto, texto: str, fuente, color="black") -> None:
+        """Texto rotado 90° centrado en xy (etiqueta del eje Y)"""
+        izq, arriba, der, abajo = fuente.getbbox(texto, anchor="lt")
+        capa = Image.new("L", (der, abajo), 0)
+        ImageDraw.Draw(capa).text((0, 0), texto, font=fuente, fill=255, anchor="lt")
+        capa = capa.rotate(90, expand=True)
+        x = round(xy[0] - capa.width / 2)
+        y = round(xy[1] - capa.height / 2)
+        self.imagen.paste(Image.new("RGB", capa.size, color), (x, y), capa)
+
+    def linea_discontinua(self, inicio: Punto, fin: Punto, color, ancho: int) -> None:
+        (x0, y0), (x1, y1) = inicio, fin
+        largo = math.hypot(x1 - x0, y1 - y0)
+        trazo, hueco = (self.pt(p) for p in TRAZO_GRILLA)
+        t = 0.0
+        while t < largo:
+            t_fin = min(t + trazo, largo)
+            self.draw.line(
+                [(x0 + (x1 - x0) * t / largo, y0 + (y1 - y0) * t / largo),
+                 (x0 + (x1 - x0) * t_fin / largo, y0 + (y1 - y0) * t_fin / largo)],
+                fill=color,
+                width=ancho
+            )
+            t = t_fin + hueco
+
+
+def _dibujar_grafico(lienzo: LienzoRapido, datos: DatosGrafico) -> None:
+    izq, arriba, der, abajo = lienzo.caja(POSICION_GRAFICO)
+    todos_x = [x for serie in datos.series for x in serie.años] or [0]
+    todos_y = [y for serie in datos.series for y in serie.valores] or [0]
+    x_min, x_max, marcas_x = _marcas_eje(min(todos_x), max(todos_x))
+    y_min, y_max, marcas_y = _marcas_eje(min(todos_y), max(todos_y))
+
+    def a_pixel(x: float, y: float) -> Punto:
+        return (
+            izq + (x - x_min) / (x_max - x_min) * (der - izq),
+            abajo - (y - y_min) / (y_max - y_min) * (abajo - arriba),
+        )
+
+    ancho_eje = lienzo.pt(ANCHO_EJE)
+    largo_marca = lienzo.pt(LARGO_MARCA)
+    fuente_marcas = lienzo.fuente(10)
+
+    # Grilla
+    for x in marcas_x:
+        px = a_pixel(x, y_min)[0]
+        lienzo.linea_discontinua((px, arriba), (px, abajo), COLOR_GRILLA, ancho_eje)
+    for y in marcas_y:
+        py = a_pixel(x_min, y)[1]
+        lienzo.linea_discontinua((izq, py), (der, py), COLOR_GRILLA, ancho_eje)
+
+    # Ejes (sin bordes superior y derecho) y marcas
+    lienzo.draw.line([(izq, arriba), (izq, abajo), (der, abajo)], fill="black", width=ancho_eje)
+    for x in marcas_x:
+        px = a_pixel(x, y_min)[0]
+        lienzo.draw.line([(px, abajo), (px, abajo + largo_marca)], fill="black", width=ancho_eje)
+        lienzo.texto((px, abajo + largo_marca + lienzo.pt(SEPARACION_MARCA)), _texto_marca(x), fuente_marcas, "mt")
+    ancho_textos_y = 0
+    for y in marcas_y:
+        py = a_pixel(x_min, y)[1]
+        lienzo.draw.line([(izq - largo_marca, py), (izq, py)], fill="black", width=ancho_eje)
+        texto = _texto_marca(y)
+        ancho_textos_y = max(ancho_textos_y, fuente_marcas.getlength(texto))
+        lienzo.texto((izq - largo_marca - lienzo.pt(SEPARACION_MARCA), py), texto, fuente_marcas, "rm")
+
+    # Etiquetas y título
+    fuente_etiqueta = lienzo.fuente(12, negrita=True)
+    alto_marcas = fuente_marcas.getbbox("0", anchor="lt")[3]
+    lienzo.texto(
+        ((izq + der) / 2, abajo + largo_marca + lienzo.pt(SEPARACION_MARCA) + alto_marcas + lienzo.pt(SEPARACION_ETIQUETA_X)),
+        "Años", fuente_etiqueta, "mt"
+    )
+    x_etiqueta_y = izq - largo_marca - lienzo.pt(SEPARACION_MARCA) - ancho_textos_y - lienzo.pt(SEPARACION_ETIQUETA)
+    alto_etiqueta = fuente_etiqueta.getbbox("Ay", anchor="lt")[3]
+    lienzo.texto_vertical((x_etiqueta_y - alto_etiqueta / 2, (arriba + abajo) / 2), "Porcentaje de devolución", fuente_etiqueta)
+    lienzo.texto(((izq + der) / 2, arriba - lienzo.pt(SEPARACION_TITULO)), datos.titulo, lienzo.fuente(14, negrita=True), "ms")
+
+    # Series
+    ancho_linea = lienzo.pt(ANCHO_LINEA)
+    radio = DIAMETRO_MARCADOR * lienzo.escala / 2
+    for idx, serie in enumerate(datos.series):
+        color = _color(COLORES[idx % len(COLORES)])
+        puntos = [a_pixel(x, y) for x, y in zip(serie.años, serie.valores)]
+        if len(puntos) > 1:
+            lienzo.draw.line(puntos, fill=color, width=ancho_linea, joint="curve")
+        for px, py in puntos:
+            lienzo.draw.ellipse([px - radio, py - radio, px + radio, py + radio], fill=color)
+
+    _dibujar_leyenda(lienzo, datos, izq, arriba)
+
+
+def _dibujar_leyenda(lienzo: LienzoRapido, datos: DatosGrafico, izq: float, arriba: float) -> None:
+    """Leyenda arriba a la izquierda con el estilo por defecto de matplotlib"""
+    if not datos.series:
+        return
+    fuente = lienzo.fuente(10)
+    largo_muestra = lienzo.pt(20)
+    separacion_texto = lienzo.pt(8)
+    relleno = lienzo.pt(4)
+    espacio_filas = lienzo.pt(5)
+    alto_texto = fuente.getbbox("Ay", anchor="lt")[3]
+    ancho_textos = max(fuente.getlength(serie.etiqueta) for serie in datos.series)
+
+    x0 = izq + lienzo.pt(5)
+    y0 = arriba + lienzo.pt(5)
+    x1 = x0 + 2 * relleno + largo_muestra + separacion_texto + ancho_textos
+    y1 = y0 + 2 * relleno + len(datos.series) * alto_texto + (len(datos.series) - 1) * espacio_filas
+    lienzo.draw.rounded_rectangle([x0, y0, x1, y1], radius=lienzo.pt(2), fill="white", outline=(214, 214, 214), width=lienzo.pt(1))
+
+    radio = DIAMETRO_MARCADOR * lienzo.escala / 2
+    for idx, serie in enumerate(datos.series):
+        color = _color(COLORES[idx % len(COLORES)])
+        centro_y = y0 + relleno + idx * (alto_texto + espacio_filas) + alto_texto / 2
+        inicio_x = x0 + relleno
+        lienzo.draw.line([(inicio_x, centro_y), (inicio_x + largo_muestra, centro_y)], fill=color, width=lienzo.pt(ANCHO_LINEA))
+        centro_x = inicio_x + largo_muestra / 2
+        lienzo.draw.ellipse([centro_x - radio, centro_y - radio, centro_x + radio, centro_y + radio], fill=color)
+        lienzo.texto((inicio_x + largo_muestra + separacion_texto, centro_y), serie.etiqueta, fuente, "lm")
+
+
+def _dibujar_tabla(lienzo: LienzoRapido, datos: DatosGrafico) -> None:
+    """Tabla centrada en su área: encabezado azul y filas alternadas"""
+    izq, arriba, der, abajo = lienzo.caja(POSICION_TABLA)
+    ancho_total = der - izq
+    alto_fila = ALTO_FILA_TABLA * lienzo.escala
+    filas = [COLUMNAS] + datos.filas
+    x_inicio = izq + (ancho_total - sum(ANCHOS_COLUMNAS) * ancho_total) / 2
+    y_inicio = (arriba + abajo) / 2 - len(filas) * alto_fila / 2
+
+    fuente = lienzo.fuente(10)
+    fuente_encabezado = lienzo.fuente(10, negrita=True)
+    ancho_borde = lienzo.pt(BORDE_TABLA)
+    for i, fila in enumerate(filas):
+        y0 = y_inicio + i * alto_fila
+        x0 = x_inicio
+        if i == 0:
+            fondo, color_texto, fuente_fila = _color(COLOR_ENCABEZADO), "white", fuente_encabezado
+        else:
+            fondo, color_texto, fuente_fila = _color(COLORES_FILAS[i % 2 == 0]), "black", fuente
+        for ancho, valor in zip(ANCHOS_COLUMNAS, fila):
+            x1 = x0 + ancho * ancho_total
+            lienzo.draw.rectangle([x0, y0, x1, y0 + alto_fila], fill=fondo, outline="black", width=ancho_borde)
+            lienzo.texto(((x0 + x1) / 2, y0 + alto_fila / 2), valor, fuente_fila, "mm", color_texto)
+            x0 = x1
+
+
+def precargar_fuentes(dpi: int = 300) -> None:
+    """Abre las fuentes que usa el gráfico para que el primer render no pague ese costo"""
+    escala = dpi / 72
+    for puntos, negrita in ((10, False), (10, True), (12, True), (14, True)):
+        _fuente(max(1, round(puntos * escala)), negrita)
+
+
+def renderizar_rapido(
+    datos: DatosGrafico,
+    archivo_salida: str,
+    formato: str = "jpeg",
+    dpi: float = 300,
+    calidad: Optional[int] = None
+) -> None:
+    """
+    Dibuja el gráfico y la tabla con Pillow y guarda la imagen
+
+    Solo formatos raster (JPEG, PNG, WebP); calidad aplica a JPEG y WebP.
+    """
+    if formato == "svg":
+        raise ValueError("El renderizador rapido no genera SVG")
+    with medir_etapa("construccion_figura"):
+        lienzo = LienzoRapido(dpi)
+        _dibujar_grafico(lienzo, datos)
+        _dibujar_tabla(lienzo, datos)
+    opciones = {"quality": calidad} if calidad is not None and formato in ("jpeg", "webp") else {}
+    with medir_etapa("savefig"):
+        lienzo.imagen.save(archivo_salida, format=formato.upper(), dpi=(dpi, dpi), **opciones)
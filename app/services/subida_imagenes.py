@@ -0,0 +1,191 @@
+"""
+Subida de imágenes a un servicio de archivos temporales
+Cliente HTTP compartido (conexiones reutilizadas), subida en streaming desde
+disco y reintentos con backoff acotado. httpx se importa con la primera
+subida, no al arrancar la API.
+"""
+import os
+import time
+import asyncio
+from typing import TYPE_CHECKING, Dict, Optional
+
+from app.services.metricas import medir_etapa
+from app.services.bitacora import bitacora
+
+
+UPLOAD_URL = os.getenv("UPLOAD_URL", "https://tmpfiles.org/api/v1/upload")
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "15"))
+UPLOAD_REINTENTOS = int(os.getenv("UPLOAD_REINTENTOS", "3"))
+UPLOAD_BACKOFF_BASE = float(os.getenv("UPLOAD_BACKOFF_BASE", "0.5"))
+UPLOAD_BACKOFF_MAX = float(os.getenv("UPLOAD_BACKOFF_MAX", "4"))
+UPLOAD_MAX_CONEXIONES = int(os.getenv("UPLOAD_MAX_CONEXIONES", "10"))
+
+_TIPOS_MIME = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".svg": "image/svg+xml",
+}
+
+
+if TYPE_CHECKING:
+    import httpx
+
+
+class SubidaError(Exception):
+    """Error no recuperable al subir una imagen"""
+
+
+def _url_publica(data: Dict) -> Optional[str]:
+    """
+    Extrae la URL pública de la respuesta ({"status": "success", "data": {"url": ...}})
+
+    tmpfiles.org devuelve la página del archivo; la descarga directa está en /dl/
+    """
+    if data.get("status") != "success":
+        return None
+    url = data["data"]["url"]
+    if "tmpfiles.org/" in url and "tmpfiles.org/dl/" not in url:
+        url = url.replace("tmpfiles.org/", "tmpfiles.org/dl/")
+    return url
+
+
+def _reintentable(codigo: int) -> bool:
+    return codigo == 429 or codigo >= 500
+
+
+class ClienteSubida:
+    """
+    Sube imágenes al servicio temporal configurado en UPLOAD_URL
+
+    Mantiene un cliente HTTP por proceso con pool de conexiones (async para la
+    API, sync para scripts y workers de renderizado).
+    """
+
+    def __init__(
+        self,
+        url: str = UPLOAD_URL,
+        timeout: float = UPLOAD_TIMEOUT,
+        reintentos: int = UPLOAD_REINTENTOS,
+        backoff_base: float = UPLOAD_BACKOFF_BASE,
+        backoff_max: float = UPLOAD_BACKOFF_MAX
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.reintentos = max(1, reintentos)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cliente_async: Optional["httpx.AsyncClient"] = None
+        self._cliente_sync: Optional["httpx.Client"] = None
+
+        self.subidas = 0
+        self.fallidas = 0
+        self.reintentos_realizados = 0
+
+    def _espera(self, intento: int) -> float:
+        return min(self.backoff_max, self.backoff_base * (2 ** intento))
+
+    def _archivo(self, ruta_archivo: str):
+        extension = os.path.splitext(ruta_archivo)[1].lower()
+        nombre = f"cotizacion{extension or '.jpg'}"
+        return nombre, _TIPOS_MIME.get(extension, "application/octet-stream")
+
+    def _limites(self) -> "httpx.Limits":
+        import httpx
+        return httpx.Limits(max_connections=UPLOAD_MAX_CONEXIONES, max_keepalive_connections=UPLOAD_MAX_CONEXIONES)
+
+    def _procesar_respuesta(self, response: "httpx.Response") -> Optional[str]:
+        import httpx
+
+        if response.status_code == 200:
+            url = _url_publica(response.json())
+            if url:
+                self.subidas += 1
+                return url
+        if _reintentable(response.status_code):
+            raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request, response=response)
+        raise SubidaError(f"Error al subir imagen a {self.url}: {response.text}")
+
+    async def subir(self, ruta_archivo: str) -> Optional[str]:
+        """
+        Sube la imagen sin bloquear el event loop
+
+        El archivo se envía por partes desde disco (no se carga entero en memoria).
+
+        Returns:
+            URL pública de la imagen o None si falla
+        """
+        import httpx
+
+        if self._cliente_async is None:
+            self._cliente_async = httpx.AsyncClient(timeout=self.timeout, limits=self._limites())
+
+        nombre, mime = self._archivo(ruta_archivo)
+        with medir_etapa("subida"):
+            for intento in range(self.reintentos):
+                try:
+                    with open(ruta_archivo, "rb") as file:
+                        response = await self._cliente_async.post(self.url, files={"file": (nombre, file, mime)})
+                    return self._procesar_respuesta(response)
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    if intento + 1 >= self.reintentos:
+                        bitacora.error("subida_fallida", f"Excepción al subir imagen tras {self.reintentos} intentos: {e}", ruta=ruta_archivo)
+                        break
+                    self.reintentos_realizados += 1
+                    await asyncio.sleep(self._espera(intento))
+                except Exception as e:
+                    bitacora.error("subida_fallida", f"Excepción al subir imagen: {e}", excepcion=e, ruta=ruta_archivo)
+                    break
+
+        self.fallidas += 1
+        return None
+
+    def subir_sync(self, ruta_archivo: str) -> Optional[str]:
+        """Igual que subir, para código síncrono (scripts, workers de renderizado)"""
+        import httpx
+
+        if self._cliente_sync is None:
+            self._cliente_sync = httpx.Client(timeout=self.timeout, limits=self._limites())
+
+        nombre, mime = self._archivo(ruta_archivo)
+        with medir_etapa("subida"):
+            for intento in range(self.reintentos):
+                try:
+                    with open(ruta_archivo, "rb") as file:
+                        response = self._cliente_sync.post(self.url, files={"file": (nombre, file, mime)})
+                    return self._procesar_respuesta(response)
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    if intento + 1 >= self.reintentos:
+                        bitacora.error("subida_fallida", f"Excepción al subir imagen tras {self.reintentos} intentos: {e}", ruta=ruta_archivo)
+                        break
+                    self.reintentos_realizados += 1
+                    time.sleep(self._espera(intento))
+                except Exception as e:
+                    bitacora.error("subida_fallida", f"Excepción al subir imagen: {e}", excepcion=e, ruta=ruta_archivo)
+                    break
+
+        self.fallidas += 1
+        return None
+
+    async def cerrar(self) -> None:
+        """Cierra las conexiones abiertas"""
+        if self._cliente_async is not None:
+            await self._cliente_async.aclose()
+            self._cliente_async = None
+        if self._cliente_sync is not None:
+            self._cliente_sync.close()
+            self._cliente_sync = None
+
+    def obtener_estadisticas(self) -> Dict:
+        """Contadores de subidas de este proceso"""
+        return {
+            "url": self.url,
+            "subidas": self.subidas,
+            "fallidas": self.fallidas,
+            "reintentos": self.reintentos_realizados,
+        }
+
+
+# Cliente compartido por el proceso
+cliente_subida = ClienteSubida()
@@ -0,0 +1,242 @@
+"""
+Tabla precalculada de cotizaciones
+Guarda en un arreglo NumPy denso todas las combinaciones válidas
+(edad × sexo × prima × periodo) para responder con una consulta por índice
+en lugar de recalcular las fórmulas en cada request
+"""
+import os
+import json
+import math
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.services.motor_vectorizado import MotorVectorizado, SEXOS
+from app.services.cotizacion_calculada import CotizacionCalculada, formatear_tabla_devolucion
+from app.services.periodos_config import huella_config
+
+
+# Posición de cada campo en la última dimensión de la tabla
+CAMPOS = (
+    "porcentaje_devolucion",    # redondeado, igual que _generar_porcentaje_devolucion
+    "trea",                     # redondeada, igual que _generar_trea
+    "aporte_total",             # sin redondear (lo usa crear)
+    "devolucion_total",         # sin redondear (lo usa crear)
+    "aporte_total_redondeado",
+    "ganancia_total_redondeado",
+    "devolucion_total_redondeado",
+    "rentabilidad_redondeado",
+    "porcentaje_entero",        # 1.0 si la versión escalar devuelve el porcentaje como int
+)
+_IDX = {nombre: i for i, nombre in enumerate(CAMPOS)}
+
+VERSION_FORMATO = 1
+
+
+class TablaPrecalculada:
+    """Tabla densa de cotizaciones con consulta O(1) por índice"""
+
+    def __init__(self, valores: np.ndarray, metadata: Dict):
+        """
+        Args:
+            valores: Arreglo (edades, sexos, primas, periodos, campos); NaN donde
+                el periodo no está permitido para la prima
+            metadata: edad_min, sexos, primas, periodo_min, periodos_por_prima, huella_config
+        """
+        self.valores = valores
+        # Vista ndarray sin copia: indexar un np.memmap crea subclases en cada acceso
+        self._datos = np.asarray(valores)
+        self.metadata = metadata
+        self.edad_min = int(metadata["edad_min"])
+        self.edad_max = self.edad_min + valores.shape[0] - 1
+        self.periodo_min = int(metadata["periodo_min"])
+        self.huella_config = metadata["huella_config"]
+        self._sexo_idx = {sexo: i for i, sexo in enumerate(metadata["sexos"])}
+        self._prima_idx = {float(prima): i for i, prima in enumerate(metadata["primas"])}
+        self._periodos_por_prima = {
+            float(prima): list(periodos)
+            for prima, periodos in zip(metadata["primas"], metadata["periodos_por_prima"])
+        }
+
+        # Contadores de uso
+        self.consultas_servidas = 0
+        self.consultas_fuera_tabla = 0
+
+    @classmethod
+    def construir(cls, config: List[Dict], edades: Sequence[int], sexos: Sequence[str] = SEXOS) -> "TablaPrecalculada":
+        """Construye la tabla con el motor vectorizado a partir de la configuración de periodos"""
+        edades = list(edades)
+        primas: List[float] = []
+        periodos_por_prima: List[List[int]] = []
+        for item in config:
+            for prima in item["primas"]:
+                if float(prima) in primas:
+                    # Igual que _obtener_periodos_para_prima: gana el primer grupo
+                    continue
+                primas.append(float(prima))
+                periodos_por_prima.append(list(item["periodos"]))
+
+        todos_periodos = [p for periodos in periodos_por_prima for p in periodos] or [1]
+        periodo_min, periodo_max = min(todos_periodos), max(todos_periodos)
+
+        edad, sexo, prima, periodo = np.meshgrid(
+            np.asarray(edades, dtype=np.float64),
+            np.arange(len(sexos), dtype=np.float64),
+            np.asarray(primas, dtype=np.float64),
+            np.arange(periodo_min, periodo_max + 1, dtype=np.float64),
+            indexing="ij"
+        )
+
+        motor = MotorVectorizado()
+        # Los periodos no permitidos también se calculan (y luego se descartan)
+        with np.errstate(invalid="ignore"):
+            porcentaje = motor.generar_porcentaje_devolucion(periodo, prima, edad)
+            trea = motor.generar_trea(porcentaje, periodo)
+            campos = motor.calcular_campos_adicionales(porcentaje, trea, prima, periodo)
+            aporte_total = prima * 12 * periodo
+            devolucion_total = aporte_total * (porcentaje / 100)
+            porcentaje_entero = motor.porcentaje_es_entero(periodo, prima, edad)
+
+        valores = np.stack([
+            porcentaje,
+            trea,
+            aporte_total,
+            devolucion_total,
+            campos["aporte_total"],
+            campos["ganancia_total"],
+            campos["devolucion_total"],
+            campos["rentabilidad"],
+            porcentaje_entero.astype(np.float64),
+        ], axis=-1)
+
+        # Marcar como inválidos los periodos que la configuración no permite
+        permitido = np.zeros((len(primas), periodo_max - periodo_min + 1), dtype=bool)
+        for i, periodos in enumerate(periodos_por_prima):
+            for p in periodos:
+                permitido[i, p - periodo_min] = True
+        valores[:, :, ~permitido, :] = np.nan
+
+        metadata = {
+            "version_formato": VERSION_FORMATO,
+            "edad_min": edades[0] if edades else 0,
+            "sexos": list(sexos),
+            "primas": primas,
+            "periodo_min": periodo_min,
+            "periodos_por_prima": periodos_por_prima,
+            "campos": list(CAMPOS),
+            "huella_config": huella_config(config),
+        }
+        return cls(valores, metadata)
+
+    def guardar(self, ruta: str) -> None:
+        """
+        Guarda la tabla como .npy (binario, mapeable en memoria) y su metadata
+        en un archivo .json al lado. Ambos se escriben de forma atómica.
+        """
+        directorio = os.path.dirname(os.path.abspath(ruta))
+        os.makedirs(directorio, exist_ok=True)
+
+        tmp_valores = f"{ruta}.tmp"
+        with open(tmp_valores, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.valores))
+        os.replace(tmp_valores, ruta)
+
+        tmp_meta = f"{ruta}.json.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(self.metadata, f)
+        os.replace(tmp_meta, f"{ruta}.json")
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "TablaPrecalculada":
+        """Carga una tabla prearmada mapeando el archivo en memoria (sin copiarlo)"""
+        with open(f"{ruta}.json", "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        if metadata.get("version_formato") != VERSION_FORMATO or metadata.get("campos") != list(CAMPOS):
+            raise ValueError(f"Formato de tabla precalculada incompatible: {ruta}")
+        valores = np.load(ruta, mmap_mode="r")
+        return cls(valores, metadata)
+
+    def _fila(self, edad: int, sexo: str, prima: float, periodo: int) -> Optional[List[float]]:
+        """Devuelve la fila de campos o None si la combinación no está en la tabla"""
+        if not self.edad_min <= edad <= self.edad_max:
+            return None
+        sexo_idx = self._sexo_idx.get(sexo)
+        prima_idx = self._prima_idx.get(float(prima))
+        periodo_idx = periodo - self.periodo_min
+        if sexo_idx is None or prima_idx is None or not 0 <= periodo_idx < self._datos.shape[3]:
+            return None
+        fila = self._datos[edad - self.edad_min, sexo_idx, prima_idx, periodo_idx].tolist()
+        if math.isnan(fila[0]):
+            return None
+        return fila
+
+    @staticmethod
+    def _porcentaje(fila: List[float]) -> Union[float, int]:
+        """Porcentaje con el mismo tipo que devuelve la versión escalar"""
+        porcentaje = fila[_IDX["porcentaje_devolucion"]]
+        if fila[_IDX["porcentaje_entero"]]:
+            return int(porcentaje)
+        return porcentaje
+
+    def buscar(self, edad: int, sexo: str, prima: float, periodo: int) -> Optional[Tuple[float, float, float, float, str]]:
+        """
+        Consulta para una cotización individual
+
+        Returns:
+            (porcentaje_devolucion, trea, aporte_total, devolucion_total, tabla_devolucion)
+            o None si la combinación no está en la tabla
+        """
+        fila = self._fila(edad, sexo, prima, periodo)
+        if fila is None:
+            self.consultas_fuera_tabla += 1
+            return None
+
+        self.consultas_servidas += 1
+        return (
+            fila[_IDX["porcentaje_devolucion"]],
+            fila[_IDX["trea"]],
+            fila[_IDX["aporte_total"]],
+            fila[_IDX["devolucion_total"]],
+            formatear_tabla_devolucion(periodo, str(self._porcentaje(fila))),
+        )
+
+    def buscar_coleccion(self, edad: int, sexo: str, prima: float) -> Optional[List[CotizacionCalculada]]:
+        """
+        Consulta para una colección: todos los periodos permitidos de la prima
+
+        Returns:
+            Una CotizacionCalculada por periodo, o None si la combinación no
+            está en la tabla
+        """
+        periodos = self._periodos_por_prima.get(float(prima))
+        filas = [self._fila(edad, sexo, prima, periodo) for periodo in periodos] if periodos else None
+        if not filas or any(fila is None for fila in filas):
+            self.consultas_fuera_tabla += 1
+            return None
+
+        self.consultas_servidas += 1
+        return [
+            CotizacionCalculada(
+                periodo,
+                self._porcentaje(fila),
+                fila[_IDX["trea"]],
+                fila[_IDX["aporte_total_redondeado"]],
+                fila[_IDX["ganancia_total_redondeado"]],
+                fila[_IDX["devolucion_total_redondeado"]],
+                fila[_IDX["rentabilidad_redondeado"]],
+            )
+            for periodo, fila in zip(periodos, filas)
+        ]
+
+    def obtener_estadisticas(self) -> Dict:
+        """Estadísticas de uso de la tabla"""
+        return {
+            "combinaciones": int(np.count_nonzero(~np.isnan(self._datos[..., 0]))),
+            "bytes": int(self.valores.nbytes),
+            "mapeada_en_memoria": isinstance(self.valores, np.memmap),
+            "edad_min": self.edad_min,
+            "edad_max": self.edad_max,
+            "huella_config": self.huella_config,
+            "consultas_servidas": self.consultas_servidas,
+            "consultas_fuera_tabla": self.consultas_fuera_tabla,
+        }
@@ -0,0 +1,286 @@
+"""
+Micro-benchmarks de cada etapa del camino de una cotización
+
+Uso:
+    python -m benchmarks.bench_etapas [--muestras 15] [--etapas porcentaje_devolucion,serializacion_json]
+    python -m benchmarks.bench_etapas --guardar-linea-base      # fija la línea base de esta máquina
+
+Mide por separado el cálculo (porcentaje, TREA, cotización, colección), el
+armado de CotizacionColeccionResponse, la serialización JSON, la carga de la
+configuración de periodos, el gráfico (figura de matplotlib vs savefig y los
+otros renderizadores) y la subida de la imagen contra un servidor local falso.
+
+Los resultados (mediana, p90 y mínimo por llamada, en µs) se guardan en
+benchmarks/resultados/ y se comparan con benchmarks/linea_base.json: una
+etapa cuya mediana supera la de la línea base en más del umbral (25% por
+defecto, o el "umbral" de esa etapa en la línea base) es una regresión y el
+comando termina con código 1.
+"""
+import argparse
+import json
+import os
+import pickle
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+from app.schemas.cotizacion import (
+    CotizacionColeccionRequest,
+    CotizacionCreate,
+    ParametrosCotizacion,
+    ParametrosCotizacionSinPeriodo
+)
+from app.services.cotizacion_service import CotizacionService, PERIODOS_CONFIG_PATH
+from app.services.datos_grafico import preparar_datos_grafico
+from app.services.image_service import ImageService
+from app.services.periodos_config import ConfiguracionPeriodos
+from app.services.subida_imagenes import ClienteSubida
+
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+LINEA_BASE = os.path.join(DIRECTORIO, "linea_base.json")
+RESULTADOS = os.path.join(DIRECTORIO, "resultados")
+UMBRAL_POR_DEFECTO = 0.25
+
+# Duración mínima de una muestra: las etapas rápidas se repiten dentro de la muestra
+MUESTRA_MINIMA_NS = 2_000_000
+
+
+def medir(funcion: Callable, muestras: int, preparar: Optional[Callable] = None) -> Dict:
+    """
+    Tiempo por llamada de funcion (µs): mediana, p90 y mínimo de las muestras
+
+    Con preparar, cada muestra es una sola llamada funcion(preparar()) y solo
+    se mide la llamada; sin preparar, cada muestra repite funcion() las veces
+    necesarias para durar al menos MUESTRA_MINIMA_NS.
+    """
+    llamadas = 1
+    if preparar is None:
+        funcion()  # calentamiento
+        while True:
+            inicio = time.perf_counter_ns()
+            for _ in range(llamadas):
+                funcion()
+            if time.perf_counter_ns() - inicio >= MUESTRA_MINIMA_NS:
+                break
+            llamadas *= 2
+    else:
+        funcion(preparar())
+
+    tiempos = []
+    for _ in range(muestras):
+        if preparar is None:
+            inicio = time.perf_counter_ns()
+            for _ in range(llamadas):
+                funcion()
+            tiempos.append((time.perf_counter_ns() - inicio) / llamadas)
+        else:
+            estado = preparar()
+            inicio = time.perf_counter_ns()
+            funcion(estado)
+            tiempos.append(time.perf_counter_ns() - inicio)
+
+    tiempos.sort()
+    return {
+        "mediana_us": round(statistics.median(tiempos) / 1000, 3),
+        "p90_us": round(tiempos[min(len(tiempos) - 1, int(0.9 * len(tiempos)))] / 1000, 3),
+        "min_us": round(tiempos[0] / 1000, 3),
+        "llamadas_por_muestra": llamadas,
+    }
+
+
+class _SubidaFalsa(BaseHTTPRequestHandler):
+    """Responde como tmpfiles.org sin salir de la máquina"""
+
+    def do_POST(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                tamano = int(self.rfile.readline().strip(), 16)
+                self.rfile.read(tamano + 2)
+                if tamano == 0:
+                    break
+        else:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cuerpo = json.dumps({"status": "success", "data": {"url": "http://127.0.0.1/falsa.jpg"}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def etapas(directorio: str, url_subida: str) -> Dict[str, tuple]:
+    """Etapas a medir: nombre → (función, preparar, cálculos por llamada)"""
+    service = CotizacionService()
+    image_service = ImageService()
+    cliente = ClienteSubida(url=url_subida, reintentos=1)
+
+    entradas = [(periodo, prima, edad, sexo) for periodo in (5, 6, 7) for prima in (200, 300, 500, 1000)
+                for edad in (18, 30, 45, 60) for sexo in ("M", "F")]
+    porcentajes = [(service._generar_porcentaje_devolucion(*e), e[0]) for e in entradas]
+    cotizacion = CotizacionCreate(
+        producto="RUMBO",
+        parametros=ParametrosCotizacion(edad_actuarial=30, sexo="M", prima=300, periodo_pago=5)
+    )
+    request = CotizacionColeccionRequest(
+        producto="RUMBO",
+        parametros=ParametrosCotizacionSinPeriodo(edad_actuarial=30, sexo="M", prima=500)
+    )
+    periodos, cotizaciones = service._calcular_coleccion(request)
+    respuesta = service._armar_respuesta_coleccion(request, periodos, cotizaciones, None, usar_cache=False).response
+    individual = service.cotizar(cotizacion, 1)
+    data = service.datos_grafico_coleccion(request)
+    datos = preparar_datos_grafico(data)
+    imagen = os.path.join(directorio, "grafico.jpg")
+    image_service.renderizar(datos, imagen, "rapido")
+
+    def pipeline_coleccion():
+        # Todo lo que una colección recorre fuera del render: cálculo, entrada
+        # del gráfico (ida y vuelta por pickle, como al pool) y respuesta JSON
+        periodos_, cotizaciones_ = service._calcular_coleccion(request)
+        preparar_datos_grafico(pickle.loads(pickle.dumps(service._datos_grafico(request, periodos_, cotizaciones_))))
+        service._armar_respuesta_coleccion(request, periodos_, cotizaciones_, None, usar_cache=False).cuerpo
+
+    def porcentaje_devolucion():
+        for entrada in entradas:
+            service._generar_porcentaje_devolucion(*entrada)
+
+    def trea():
+        for porcentaje, periodo in porcentajes:
+            service._generar_trea(porcentaje, periodo)
+
+    def carga_config():
+        with open(PERIODOS_CONFIG_PATH, "r", encoding="utf-8") as f:
+            ConfiguracionPeriodos(json.load(f))
+
+    def figura_matplotlib():
+        import matplotlib.pyplot as plt
+        plt.close(image_service._construir_figura_matplotlib(datos))
+
+    def subida_imagen():
+        cliente.subir_sync(imagen)
+
+    def savefig_matplotlib(fig):
+        import matplotlib.pyplot as plt
+        fig.savefig(os.path.join(directorio, "savefig.jpg"), format="jpeg", dpi=300, bbox_inches="tight")
+        plt.close(fig)
+
+    return {
+        # Las dos primeras recorren todas las entradas; el tiempo se reporta por cálculo
+        "porcentaje_devolucion": (porcentaje_devolucion, None, len(entradas)),
+        "trea": (trea, None, len(porcentajes)),
+        "cotizacion_individual": (lambda: service.cotizar(cotizacion, 1), None, 1),
+        "calculo_coleccion": (lambda: service._calcular_coleccion(request), None, 1),
+        "respuesta_coleccion": (
+            lambda: service._armar_respuesta_coleccion(request, periodos, cotizaciones, None, usar_cache=False), None, 1
+        ),
+        "serializacion_json_coleccion": (respuesta.model_dump_json, None, 1),
+        "pipeline_coleccion": (pipeline_coleccion, None, 1),
+        "serializacion_json_individual": (individual.model_dump_json, None, 1),
+        "carga_config": (carga_config, None, 1),
+        "consulta_config": (lambda: service._obtener_periodos_para_prima(500), None, 1),
+        "datos_grafico": (lambda: preparar_datos_grafico(data), None, 1),
+        "figura_matplotlib": (figura_matplotlib, None, 1),
+        "savefig_matplotlib": (savefig_matplotlib, lambda: image_service._construir_figura_matplotlib(datos), 1),
+        "render_plantilla": (lambda: image_service.renderizar(datos, imagen, "plantilla"), None, 1),
+        "render_rapido": (lambda: image_service.renderizar(datos, imagen, "rapido"), None, 1),
+        "subida_imagen": (subida_imagen, None, 1),
+    }
+
+
+def comparar(resultados: Dict, linea_base: Dict, umbral: float) -> list:
+    """Etapas cuya mediana empeoró más que el umbral respecto de la línea base"""
+    regresiones = []
+    for nombre, actual in resultados.items():
+        base = linea_base.get("etapas", {}).get(nombre)
+        if base is None:
+            continue
+        limite = base.get("umbral", umbral)
+        cambio = actual["mediana_us"] / base["mediana_us"] - 1
+        actual["cambio"] = round(cambio, 4)
+        if cambio > limite:
+            regresiones.append((nombre, cambio, limite))
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de las etapas de cotización e imagen")
+    parser.add_argument("--muestras", type=int, default=15)
+    parser.add_argument("--etapas", default=None, help="Lista separada por comas (por defecto todas)")
+    parser.add_argument("--linea-base", default=LINEA_BASE, help="Archivo JSON de la línea base")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_POR_DEFECTO, help="Empeoramiento máximo permitido (0.25 = 25%%)")
+    parser.add_argument("--guardar-linea-base", action="store_true", help="Guardar estos resultados como línea base")
+    parser.add_argument("--salida", default=None, help="Archivo de resultados (por defecto benchmarks/resultados/<fecha>.json)")
+    args = parser.parse_args()
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _SubidaFalsa)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    url_subida = f"http://127.0.0.1:{servidor.server_address[1]}/api/v1/upload"
+
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        disponibles = etapas(directorio, url_subida)
+        elegidas = args.etapas.split(",") if args.etapas else list(disponibles)
+        for nombre in elegidas:
+            if nombre not in disponibles:
+                parser.error(f"Etapa desconocida: {nombre} (disponibles: {', '.join(disponibles)})")
+            funcion, preparar, por_llamada = disponibles[nombre]
+            medicion = medir(funcion, args.muestras, preparar)
+            for campo in ("mediana_us", "p90_us", "min_us"):
+                medicion[campo] = round(medicion[campo] / por_llamada, 3)
+            resultados[nombre] = medicion
+            print(f"{nombre + ':':32} {medicion['mediana_us']:12.2f} µs  (p90 {medicion['p90_us']:.2f})", flush=True)
+    servidor.shutdown()
+
+    regresiones = []
+    if not args.guardar_linea_base and os.path.exists(args.linea_base):
+        with open(args.linea_base, "r", encoding="utf-8") as f:
+            regresiones = comparar(resultados, json.load(f), args.umbral)
+
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "muestras": args.muestras,
+        "etapas": resultados,
+    }
+    if args.guardar_linea_base:
+        salida = args.linea_base
+        # Conservar las etapas no medidas y los umbrales propios de la línea base anterior
+        if os.path.exists(salida):
+            with open(salida, "r", encoding="utf-8") as f:
+                anterior = json.load(f).get("etapas", {})
+            for nombre, medicion in resultados.items():
+                if "umbral" in anterior.get(nombre, {}):
+                    medicion["umbral"] = anterior[nombre]["umbral"]
+            informe["etapas"] = {**anterior, **resultados}
+    else:
+        salida = args.salida or os.path.join(RESULTADOS, f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados en {salida}")
+
+    if any("cambio" in r for r in resultados.values()):
+        print(f"\nComparación con {args.linea_base}:")
+        for nombre, medicion in resultados.items():
+            if "cambio" in medicion:
+                print(f"  {nombre + ':':32} {medicion['cambio']:+8.1%}")
+    if regresiones:
+        print("\n✗ Regresiones:")
+        for nombre, cambio, limite in regresiones:
+            print(f"  {nombre}: {cambio:+.1%} (umbral {limite:.0%})")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark: renderizador original (matplotlib) vs plantilla preconstruida vs rápido (Pillow)
+
+Uso:
+    python -m benchmarks.bench_plantilla_grafico [--repeticiones 20]
+
+Genera el mismo gráfico con cada renderizador en un directorio temporal y
+reporta el tiempo por imagen y la mejora respecto del original.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from app.schemas.cotizacion import CotizacionColeccionRequest, ParametrosCotizacionSinPeriodo
+from app.services.cotizacion_service import CotizacionService
+from app.services.datos_grafico import preparar_datos_grafico
+from app.services.image_service import ImageService, RENDERIZADORES
+
+
+def _datos(prima: float):
+    request = CotizacionColeccionRequest(
+        producto="RUMBO",
+        parametros=ParametrosCotizacionSinPeriodo(prima=prima, edad_actuarial=30, sexo="M")
+    )
+    return preparar_datos_grafico(CotizacionService().datos_grafico_coleccion(request))
+
+
+def medir(image_service: ImageService, renderizador: str, datos: list, directorio: str, repeticiones: int) -> float:
+    """
+    Tiempo medio por imagen (segundos), sin contar la primera llamada (calentamiento)
+
+    Se renderiza directamente (sin el almacén por contenido, que reutilizaría
+    las imágenes repetidas)
+    """
+    image_service.renderizar(datos[0], os.path.join(directorio, "calentamiento.jpg"), renderizador)
+    inicio = time.perf_counter()
+    for i in range(repeticiones):
+        image_service.renderizar(datos[i % len(datos)], os.path.join(directorio, f"{renderizador}_{i}.jpg"), renderizador)
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los renderizadores de imágenes")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    datos = [_datos(prima) for prima in (200, 240, 300, 500, 1000)]
+
+    with tempfile.TemporaryDirectory() as directorio:
+        image_service = ImageService()
+
+        tiempos = {
+            renderizador: medir(image_service, renderizador, datos, directorio, args.repeticiones)
+            for renderizador in RENDERIZADORES
+        }
+
+    original = tiempos["matplotlib"]
+    for renderizador, tiempo in tiempos.items():
+        print(f"{renderizador + ':':12} {tiempo * 1000:8.1f} ms/imagen  {original / tiempo:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -38,7 +38,8 @@ gcloud run deploy $SERVICE_NAME \
   --cpu 2 \
   --timeout 300 \
   --max-instances 10 \
-  --min-instances 0
+  --min-instances 0 \
+  --cpu-boost
 
 echo ""
 echo "=== Deployment completado ==="
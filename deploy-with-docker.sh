@@ -60,6 +60,7 @@ gcloud run deploy $SERVICE_NAME \
   --timeout 300 \
   --max-instances 10 \
   --min-instances 0 \
+  --cpu-boost \
   --set-env-vars LIBREOFFICE_HEADLESS=1
 
 echo ""
@@ -4,12 +4,13 @@
 
 echo "=== Iniciando RumbIA Cotizador ==="
 
-# Crear directorio para imágenes
-mkdir -p /app/db
+# Crear directorios para imágenes y base de cotizaciones
+mkdir -p /app/db /app/datos
 
 echo "✓ Directorios creados"
 
 # Iniciar la aplicación
+# Más de un worker requiere ALMACEN_COTIZACIONES=sqlite (IDs compartidos entre procesos)
 echo "=== Iniciando servidor FastAPI ==="
-exec uvicorn app.main:app --host 0.0.0.0 --port ${PORT:-8080} --workers 1
+exec uvicorn app.main:app --host 0.0.0.0 --port ${PORT:-8080} --workers ${UVICORN_WORKERS:-1}
 